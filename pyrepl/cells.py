@@ -0,0 +1,129 @@
+"""The screen as a grid of cells: a character and its attributes.
+
+Lines handed to the console may contain escape sequences: SGR ones
+(ESC [ ... m) setting colours and such, from coloured prompts or syntax
+highlighting, and maybe others.  parse_line() splits a line into the
+cells it displays, each with the SGR parameters in effect for it, so
+that the console can compare what is on the screen with what should be
+there cell by cell, and only write the cells that changed, switching
+attributes only where they differ (see sgr()).
+
+Other escape sequences are kept with the character after them, so a
+cell also changes if they do.  A wide character takes up two cells,
+the second of which is "", and combining characters go in the cell of
+the character before them (see pyrepl.widths).
+"""
+
+import re
+from typing import Dict, List, NamedTuple, Tuple
+
+from pyrepl.widths import disp_cells
+
+_escape = re.compile(
+    r"\x1b(?:\[(?P<params>[0-9;:?]*)(?P<final>[@-~])"
+    r"|\][^\x07\x1b]*(?:\x07|\x1b\\)?|.?)"
+)
+
+# forget the lines parsed beyond this many
+_MAX_CACHE = 1000
+
+
+class Cells(NamedTuple):
+    # what each cell shows
+    chars: List[str]
+    # the SGR parameters each is shown with, "" for none
+    attrs: List[str]
+
+
+_cache: Dict[str, Cells] = {}
+
+
+def _apply(attr: str, params: str) -> str:
+    parts = attr.split(";") if attr else []
+    for param in params.split(";"):
+        if param in ("", "0"):
+            parts = []
+        else:
+            parts.append(param)
+    return ";".join(parts)
+
+
+def parse_line(line: str) -> Cells:
+    """Return the cells `line' displays."""
+    cells = _cache.get(line)
+    if cells is not None:
+        return cells
+    chars: List[str] = []
+    attrs: List[str] = []
+    attr = ""
+    pending = ""
+    i = 0
+    while True:
+        j = line.find("\x1b", i)
+        if j < 0:
+            j = len(line)
+        if i < j:
+            shown = disp_cells(line[i:j])[0]
+            if pending:
+                shown[0] = pending + shown[0]
+                pending = ""
+            chars.extend(shown)
+            attrs.extend([attr] * len(shown))
+        if j == len(line):
+            break
+        m = _escape.match(line, j)
+        assert m is not None
+        if m.group("final") == "m":
+            attr = _apply(attr, m.group("params"))
+        else:
+            pending += m.group()
+        i = m.end()
+    if pending and chars:
+        chars[-1] += pending
+    cells = Cells(chars, attrs)
+    if len(_cache) >= _MAX_CACHE:
+        _cache.clear()
+    _cache[line] = cells
+    return cells
+
+
+def sgr(old: str, new: str) -> str:
+    """Return the escape sequence switching from the attributes `old'
+    to `new'."""
+    if old == new:
+        return ""
+    if not new:
+        return "\x1b[0m"
+    if not old:
+        return f"\x1b[{new}m"
+    if new.startswith(old + ";"):
+        return f"\x1b[{new[len(old) + 1:]}m"
+    return f"\x1b[0;{new}m"
+
+
+def changed_spans(old: Cells, new: Cells, gap: int = 4) -> List[Tuple[int, int]]:
+    """Return the ranges of the cells of `new' that differ from `old';
+    ranges fewer than `gap' cells apart are merged, as moving the cursor
+    over the cells between costs about as much as writing them."""
+    spans: List[Tuple[int, int]] = []
+    n = min(len(old.chars), len(new.chars))
+    start = None
+    end = 0
+    for x in range(n):
+        if old.chars[x] != new.chars[x] or old.attrs[x] != new.attrs[x]:
+            if start is None:
+                start = x
+            elif x - end >= gap:
+                spans.append((start, end))
+                start = x
+            end = x + 1
+    if len(new.chars) > n:
+        if start is not None and n - end < gap:
+            spans.append((start, len(new.chars)))
+            return spans
+        if start is not None:
+            spans.append((start, end))
+        spans.append((n, len(new.chars)))
+    elif start is not None:
+        spans.append((start, end))
+    return spans
@@ -38,6 +38,7 @@ import cmd
 
 from pyrepl import completer
 from pyrepl.completing_reader import CompletingReader as CR
+from pyrepl.fuzzy import FuzzyMatcher
 
 
 class CmdReader(CR):
@@ -50,10 +51,13 @@ class CmdReader(CR):
     def __init__(self, completions):
         super().__init__()
         self.completions = completions
+        self.matcher = FuzzyMatcher()
 
     def get_completions(self, stem):
         if len(stem) != self.pos:
             return []
+        if self.fuzzy_completion and stem:
+            return self.matcher.match(sorted(set(self.completions)), stem)
         return sorted(set(s for s in self.completions if s.startswith(stem)))
 
 
@@ -40,6 +40,10 @@ if TYPE_CHECKING:
 class Command(abc.ABC):
     finish: int = 0
     kills_digit_arg: int = 1
+    # set for the commands of the events background threads post to
+    # the console, which aren't the user's: they don't count as the
+    # last command, nor kill the digit argument
+    posted: int = 0
 
     def __init__(
         self,
@@ -0,0 +1,174 @@
+"""Telling whether some source is a complete statement, without
+compiling it.
+
+Pressing return at the prompt either accepts the input or starts a new
+line, depending on whether it is a complete statement yet.  Compiling
+it to find out means compiling all of a long definition again for every
+line of it, and compiling has side effects, e.g. warnings.  Instead,
+StatementChecker tokenizes just enough to know about brackets, strings,
+backslash continuations and block statements, a line at a time, and
+remembers what it found in each line: when the source only changed at
+its end, the lines before are not looked at again.
+
+It is not a parser: what it thinks is complete still needs compiling
+(see more_lines()), and an error it doesn't notice only shows when the
+statement is finished.
+"""
+
+import re
+from typing import List, NamedTuple, Optional, Tuple
+
+# the statements that may be followed by an indented block
+COMPOUND_KEYWORDS = frozenset(
+    ["if", "while", "for", "try", "with", "def", "class", "async", "@"]
+)
+
+_CLOSING = {")": "(", "]": "[", "}": "{"}
+
+_first_word = re.compile(r"@|\w+")
+
+
+class LineState(NamedTuple):
+    """Where the tokenizer is at the start of a line."""
+
+    # the open brackets, innermost last
+    brackets: str = ""
+    # the quotes of the string literal still open, if any
+    string: Optional[str] = None
+    # the line before ended with a backslash
+    continued: bool = False
+
+
+class LineInfo(NamedTuple):
+    exit: LineState
+    # there is something besides blanks and comments in the line
+    code: bool
+    # the first word of the statement the line starts, if it does
+    first: str
+    # the line ends a statement with a colon
+    colon: bool
+    error: bool
+
+
+def scan_line(line: str, state: LineState) -> LineInfo:
+    """Tokenize `line', starting in `state'."""
+    brackets = list(state.brackets)
+    string = state.string
+    starts = not (state.brackets or state.string or state.continued)
+    first = ""
+    code = error = continued = False
+    last = ""
+    i, n = 0, len(line)
+    while i < n:
+        if string is not None:
+            if line[i] == "\\":
+                i += 2
+            elif line.startswith(string, i):
+                i += len(string)
+                string = None
+            else:
+                i += 1
+            continue
+        c = line[i]
+        if c == "#":
+            break
+        if c.isspace():
+            i += 1
+            continue
+        if starts and not code:
+            m = _first_word.match(line, i)
+            if m is not None:
+                first = m.group()
+        code = True
+        last = c
+        if c in "'\"":
+            string = c * 3 if line.startswith(c * 3, i) else c
+            i += len(string)
+            continue
+        if c == "\\" and i == n - 1:
+            continued = True
+        elif c in "([{":
+            brackets.append(c)
+        elif c in _CLOSING and (not brackets or brackets.pop() != _CLOSING[c]):
+            error = True
+        i += 1
+    if string is not None and len(string) == 1 and i <= n:
+        # only a backslash before the end of the line continues these
+        error = True
+        string = None
+    exit = LineState("".join(brackets), string, continued)
+    colon = last == ":" and exit == LineState()
+    return LineInfo(exit, code, first, colon, error)
+
+
+class StatementChecker:
+    """Tells whether sources are complete statements, remembering the
+    lines of the last one it was asked about."""
+
+    def __init__(self):
+        self._lines: List[str] = []
+        self._infos: List[LineInfo] = []
+        # for the lines up to each: the first word, whether there was a
+        # colon ending a statement, whether there was an error
+        self._totals: List[Tuple[Optional[str], bool, bool]] = []
+
+    def scan(self, text: str) -> List[LineInfo]:
+        """Return what is in each line of `text'; only the lines from
+        the first that changed since the last call are tokenized."""
+        lines = text.split("\n")
+        k = 0
+        n = min(len(lines), len(self._lines))
+        while k < n and lines[k] == self._lines[k]:
+            k += 1
+        del self._infos[k:], self._totals[k:]
+        if k:
+            state = self._infos[-1].exit
+            first, colon, error = self._totals[-1]
+        else:
+            state = LineState()
+            first, colon, error = None, False, False
+        for line in lines[k:]:
+            info = scan_line(line, state)
+            if first is None and info.code:
+                first = info.first
+            colon = colon or info.colon
+            error = error or info.error
+            self._infos.append(info)
+            self._totals.append((first, colon, error))
+            state = info.exit
+        self._lines = lines
+        return self._infos
+
+    def state(self, text: str) -> Tuple[LineState, bool]:
+        """Return the state at the end of `text', and whether it has a
+        block statement."""
+        infos = self.scan(text)
+        first, colon, error = self._totals[-1]
+        if error:
+            raise SyntaxError("unbalanced brackets or quotes")
+        return infos[-1].exit, colon or first in COMPOUND_KEYWORDS
+
+    def is_incomplete(self, text: str) -> bool:
+        """Return whether `text' needs more lines to be a statement.
+
+        Block statements are only complete once followed by an empty
+        line, as at the standard prompt.  Errors count as complete, for
+        compiling to report them.
+        """
+        try:
+            state, block = self.state(text)
+        except SyntaxError:
+            return False
+        if state != LineState():
+            return True
+        return block and not text.endswith("\n")
+
+    def more_lines(self, text: str, compiler) -> bool:
+        """Return whether `text' needs more lines, only compiling it with
+        `compiler' (a codeop.CommandCompiler) if it looks complete."""
+        if self.is_incomplete(text):
+            return True
+        try:
+            return compiler(text) is None
+        except (OverflowError, SyntaxError, ValueError):
+            return False
@@ -18,11 +18,158 @@
 # CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
 
 import builtins
+import keyword
+import os
+import re
+import types
+import weakref
+from bisect import bisect_left
+from typing import AbstractSet, Dict, List, Optional, Tuple
+
+from pyrepl import module_lister
+from pyrepl.fuzzy import FuzzyMatcher
+
+
+def prefix_matches(names: List[str], prefix: str) -> List[str]:
+    """Return the names in the sorted list `names' starting with
+    `prefix'."""
+    lo = bisect_left(names, prefix)
+    # sorts after everything starting with prefix
+    hi = bisect_left(names, prefix + "\U0010ffff", lo)
+    return names[lo:hi]
+
+
+def _keys_stamp(d) -> tuple:
+    """Something that changes when the key set of the dict `d' does.
+
+    New keys go at the end of a dict, so this only misses contrived
+    sequences of deletions and insertions.
+    """
+    return id(d), len(d), next(reversed(d), None) if d else None
+
+
+def _last_key(d):
+    try:
+        return next(reversed(d), None)
+    except TypeError:  # mapping proxies before Python 3.9
+        return None
+
+
+# class -> (stamp, attribute names, the same sorted)
+_class_members: "weakref.WeakKeyDictionary[type, tuple]" = weakref.WeakKeyDictionary()
+
+
+def class_members(klass: type) -> Tuple[AbstractSet[str], List[str]]:
+    """Return the names of the attributes of the class `klass' (as
+    revealed by dir(), so including those of its bases), as a set and
+    as a sorted list.
+
+    Both are cached until the key set of the dict of a class in the
+    MRO of `klass' changes.
+    """
+    if type(klass).__dir__ is not type.__dir__:
+        # the metaclass makes something else up
+        names = set(dir(klass))
+        return names, sorted(names)
+    stamp = tuple((len(vars(c)), _last_key(vars(c))) for c in klass.__mro__)
+    cached = _class_members.get(klass)
+    if cached is None or cached[0] != stamp:
+        names = frozenset(dir(klass))
+        cached = stamp, names, sorted(names)
+        _class_members[klass] = cached
+    return cached[1], cached[2]
+
+
+class ModuleAttributeCache:
+    """The attributes of modules, remembered across sessions.
+
+    Listing the attributes of a module means importing it, which takes
+    seconds for the likes of numpy.  record() saves what dir() found
+    in a module that was completed on, along with the path, mtime and
+    version of the module; lookup() returns it, without importing
+    anything, for as long as the module file is unchanged.
+    """
+
+    def __init__(self, filename: Optional[str] = None):
+        if filename is None:
+            filename = module_lister.cache_file("attributes")
+        self.filename = filename
+        self._entries: Optional[Dict[str, dict]] = None
+        # name -> id of the module recorded in this session
+        self._recorded: Dict[str, int] = {}
+
+    @property
+    def entries(self) -> Dict[str, dict]:
+        if self._entries is None:
+            self._entries = module_lister.load_cache(self.filename)
+        return self._entries
+
+    def record(self, module: types.ModuleType):
+        name = getattr(module, "__name__", None)
+        path = getattr(module, "__file__", None)
+        if not isinstance(name, str) or not isinstance(path, str):
+            return
+        if self._recorded.get(name) == id(module):
+            return
+        self._recorded[name] = id(module)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return
+        entry = {
+            "path": path,
+            "mtime": mtime,
+            "version": str(getattr(module, "__version__", "")),
+            "names": sorted(dir(module)),
+        }
+        if self.entries.get(name) == entry:
+            return
+        # merge with what other sessions saved meanwhile
+        entries = module_lister.load_cache(self.filename)
+        entries.update(self.entries)
+        entries[name] = entry
+        self._entries = entries
+        module_lister.save_cache(self.filename, entries)
+
+    def lookup(self, name: str) -> Optional[List[str]]:
+        """Return the sorted attribute names of the module `name' as
+        recorded, if it is unchanged since."""
+        entry = self.entries.get(name)
+        if entry is None:
+            return None
+        try:
+            spec = module_lister.find_spec(name)
+        except (ImportError, ValueError):
+            return None
+        if spec is None or spec.origin != entry["path"]:
+            return None
+        try:
+            if os.stat(spec.origin).st_mtime_ns != entry["mtime"]:
+                return None
+        except OSError:
+            return None
+        return entry["names"]
 
 
 class Completer:
-    def __init__(self, ns):
+    """Completes names in the namespace `ns'.
+
+    With `fuzzy', names match if the text fuzzily matches them (see
+    pyrepl.fuzzy), and come best match first rather than sorted.
+    """
+
+    def __init__(
+        self,
+        ns,
+        attribute_cache: Optional[ModuleAttributeCache] = None,
+        fuzzy: bool = False,
+    ):
         self.ns = ns
+        self.attribute_cache = attribute_cache
+        self.fuzzy = fuzzy
+        self._matcher = FuzzyMatcher()
+        self._names: List[str] = []
+        self._names_stamp = None
 
     def complete(self, text):
         if "." in text:
@@ -33,23 +180,32 @@ class Completer:
     def global_matches(self, text):
         """Compute matches when text is a simple name.
 
-        Return a list of all keywords, built-in functions and names
-        currently defines in __main__ that match.
+        Return a sorted list of all keywords, built-in functions and
+        names currently defined in the namespace that match.
 
         """
-        import keyword
+        return self.matching(self.global_names(), text)
 
-        matches = []
+    def matching(self, names: List[str], text: str) -> List[str]:
+        """Return the names of the sorted `names' that `text' matches."""
+        if self.fuzzy and text:
+            return self._matcher.match(names, text)
+        return prefix_matches(names, text)
 
-        for list_ in [
-            keyword.kwlist,
-            list(builtins.__dict__.keys()),
-            list(self.ns.keys()),
-        ]:
-            for word in list_:
-                if word.startswith(text) and word != "__builtins__":
-                    matches.append(word)
-        return matches
+    def global_names(self) -> List[str]:
+        """Return the sorted keywords, builtins and namespace names.
+
+        The list is only rebuilt when the set of names changes.
+        """
+        stamp = _keys_stamp(self.ns), _keys_stamp(builtins.__dict__)
+        if stamp != self._names_stamp:
+            names = set(keyword.kwlist)
+            names.update(builtins.__dict__)
+            names.update(self.ns)
+            names.discard("__builtins__")
+            self._names = sorted(names)
+            self._names_stamp = stamp
+        return self._names
 
     def attr_matches(self, text):
         """Compute matches when text contains a dot.
@@ -63,29 +219,52 @@ class Completer:
         WARNING: this can still invoke arbitrary C code, if an object
         with a __getattr__ hook is evaluated.
 
-        """
-        import re
+        If the expression names a module that isn't imported, but was
+        recorded in attribute_cache, its attributes come from there.
 
+        """
         m = re.match(r"(\w+(\.\w+)*)\.(\w*)", text)
         if not m:
             return []
         expr, attr = m.group(1, 3)
-        object = eval(expr, self.ns)
-        words = dir(object)
-        if hasattr(object, "__class__"):
-            words.append("__class__")
-            words = words + get_class_members(object.__class__)
-        matches = []
-        n = len(attr)
-        for word in words:
-            if word[:n] == attr and word != "__builtins__":
-                matches.append(f"{expr}.{word}")
-        return matches
-
-
-def get_class_members(klass):
-    ret = dir(klass)
-    if hasattr(klass, "__bases__"):
-        for base in klass.__bases__:
-            ret = ret + get_class_members(base)
-    return ret
+        try:
+            object = eval(expr, self.ns)
+        except NameError:
+            # maybe a module that isn't imported yet
+            cached = None
+            if self.attribute_cache is not None:
+                cached = self.attribute_cache.lookup(expr)
+            if cached is None:
+                raise
+            return [f"{expr}.{word}" for word in self.matching(cached, attr)]
+        if isinstance(object, types.ModuleType) and self.attribute_cache is not None:
+            self.attribute_cache.record(object)
+        # fuzzy matching needs all the names to rank them
+        start = "" if self.fuzzy else attr
+        words = set(prefix_matches(class_members(type(object))[1], start))
+        words.update(self._own_attr_matches(object, start))
+        words.discard("__builtins__")
+        return [f"{expr}.{word}" for word in self.matching(sorted(words), attr)]
+
+    def _own_attr_matches(self, object, attr):
+        """Return the names of the attributes of `object' starting with
+        `attr', beyond those of its class.
+
+        Objects with their own __dir__, such as pandas DataFrames
+        (which list their columns), still get dir() called on every
+        completion: what it returns can depend on anything about them,
+        so there is nothing to cache it by.  The completion cache only
+        saves repeating it for the same stem.
+        """
+        klass = type(object)
+        if klass.__dir__ is builtins.object.__dir__:
+            # dir() would add the keys of __dict__ to the class members
+            d = getattr(object, "__dict__", None) or {}
+            return [k for k in d if isinstance(k, str) and k.startswith(attr)]
+        if isinstance(object, type) and klass.__dir__ is type.__dir__:
+            return prefix_matches(class_members(object)[1], attr)
+        return [word for word in dir(object) if word.startswith(attr)]
+
+
+def get_class_members(klass: type) -> List[str]:
+    return list(class_members(klass)[1])
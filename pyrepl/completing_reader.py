@@ -18,29 +18,54 @@
 # CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF OR IN
 # CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
 
+import functools
+import inspect
+import queue
 import re
-from typing import TYPE_CHECKING, List
-
-from pyrepl import commands, reader
+import threading
+from bisect import bisect_left
+from collections import OrderedDict
+from typing import (
+    TYPE_CHECKING,
+    Callable,
+    Dict,
+    Hashable,
+    Iterator,
+    List,
+    Optional,
+    Union,
+)
+
+from pyrepl import commands, fuzzy, reader
+from pyrepl.console import Event
 from pyrepl.reader import Reader
+from pyrepl.trace import trace
 
 if TYPE_CHECKING:
     from .console import Console
 
+# something that returns the completions of a stem, or a generator of
+# batches of them
+CompletionSource = Callable[[str], Union[List[str], Iterator[List[str]]]]
+
+
+def source_completions(source: CompletionSource, stem: str) -> List[str]:
+    """Return all the completions of `stem' by `source'."""
+    result = source(stem)
+    if inspect.isgenerator(result):
+        return [word for batch in result for word in batch]
+    return list(result)
+
 
 def prefix(wordlist, j=0):
-    d = {}
-    i = j
-    try:
-        while 1:
-            for word in wordlist:
-                d[word[i]] = 1
-            if len(d) > 1:
-                return wordlist[0][j:i]
-            i += 1
-            d = {}
-    except IndexError:
-        return wordlist[0][j:i]
+    """Return the prefix common to all the words, from index j on."""
+    # the smallest and the largest words differ first
+    first, last = min(wordlist), max(wordlist)
+    i = 0
+    n = min(len(first), len(last))
+    while i < n and first[i] == last[i]:
+        i += 1
+    return first[j:i]
 
 
 STRIPCOLOR_REGEX = re.compile(r"\x1B\[([0-9]{1,3}(;[0-9]{1,2})?)?[m|K]")
@@ -51,11 +76,13 @@ def stripcolor(s):
 
 
 def real_len(s):
+    if "\x1b" not in s:
+        return len(s)
     return len(stripcolor(s))
 
 
 def left_align(s, maxlen):
-    stripped = stripcolor(s)
+    stripped = stripcolor(s) if "\x1b" in s else s
     if len(stripped) > maxlen:
         # too bad, we remove the color
         return stripped[:maxlen]
@@ -63,46 +90,117 @@ def left_align(s, maxlen):
     return s + " " * padding
 
 
-def build_menu(cons, wordlist, start, use_brackets, sort_in_column):
-    if use_brackets:
-        item = "[ %s ]"
-        padding = 4
-    else:
-        item = "%s  "
-        padding = 2
-    maxlen = min(max(list(map(real_len, wordlist))), cons.width - padding)
-    cols = int(cons.width / (maxlen + padding))
-    rows = int((len(wordlist) - 1) / cols + 1)
-
-    if sort_in_column:
+def prefix_range(wordlist, stem, lo=0, hi=None):
+    """Return the range of the words starting with `stem' within
+    wordlist[lo:hi], which is sorted."""
+    if hi is None:
+        hi = len(wordlist)
+    lo = bisect_left(wordlist, stem, lo, hi)
+    # sorts after everything starting with stem
+    hi = bisect_left(wordlist, stem + "\U0010ffff", lo, hi)
+    return lo, hi
+
+
+class CompletionMenu:
+    """The completion menu, laid out a page at a time.
+
+    offset is where the page shown starts: the index of its first word
+    or, with sort_in_column, of its first row.  Rendering a page only
+    measures the words that can make it to it (each word is measured
+    once), so its cost doesn't depend on how many words there are;
+    with sort_in_column, the column width does depend on all of them.
+    """
+
+    def __init__(
+        self,
+        words: List[str],
+        use_brackets: bool,
+        sort_in_column: bool,
+        offset: int = 0,
+        lengths: Optional[Dict[str, int]] = None,
+    ):
+        self.words = words
+        if use_brackets:
+            self.item = "[ %s ]"
+            self.padding = 4
+        else:
+            self.item = "%s  "
+            self.padding = 2
+        self.sort_in_column = sort_in_column
+        self.offset = offset
+        self.next_offset = 0
+        # word -> its length on screen
+        self.lengths = {} if lengths is None else lengths
+        self._maxlen: Optional[int] = None
+
+    def length(self, word: str) -> int:
+        n = self.lengths.get(word)
+        if n is None:
+            n = self.lengths[word] = real_len(word)
+        return n
+
+    def next_page(self):
+        self.offset = self.next_offset
+
+    def render(self, cons: "Console") -> List[str]:
+        """Return the lines of the page at offset."""
+        page_rows = max(cons.height - 3, 1)
+        if self.sort_in_column:
+            return self._render_columns(cons, page_rows)
+        n = len(self.words)
+        # there is room for this many rows of at most this many words
+        fits = page_rows * max(cons.width // (self.padding + 1), 1)
+        shown = self.words[self.offset : self.offset + fits]
+        maxlen = min(max(map(self.length, shown)), cons.width - self.padding)
+        cols = max(cons.width // (maxlen + self.padding), 1)
+        del shown[page_rows * cols :]
+        menu = [
+            self._row(shown[i : i + cols], maxlen) for i in range(0, len(shown), cols)
+        ]
+        self.next_offset = self.offset + len(shown)
+        if self.next_offset < n:
+            menu.append(f"   {n - self.next_offset} more... ")
+        else:
+            self.next_offset = 0
+        return menu
+
+    def _render_columns(self, cons: "Console", page_rows: int) -> List[str]:
         # sort_in_column=False (default)     sort_in_column=True
         #          A B C                       A D G
         #          D E F                       B E
         #          G                           C F
-        #
-        # "fill" the table with empty words, so we always have the same amout
-        # of rows for each column
-        missing = cols * rows - len(wordlist)
-        wordlist = wordlist + [""] * missing
-        indexes = [(i % cols) * rows + i // cols for i in range(len(wordlist))]
-        wordlist = [wordlist[i] for i in indexes]
-    menu = []
-    i = start
-    for r in range(rows):
-        row = []
-        for _col in range(cols):
-            row.append(item % left_align(wordlist[i], maxlen))
-            i += 1
-            if i >= len(wordlist):
-                break
-        menu.append("".join(row))
-        if i >= len(wordlist):
-            i = 0
-            break
-        if r + 5 > cons.height:
-            menu.append(f"   {len(wordlist)-1} more... ")
-            break
-    return menu, i
+        words = self.words
+        n = len(words)
+        if self._maxlen is None:
+            self._maxlen = max(map(self.length, words))
+        maxlen = min(self._maxlen, cons.width - self.padding)
+        cols = max(cons.width // (maxlen + self.padding), 1)
+        rows = (n - 1) // cols + 1
+        end = min(self.offset + page_rows, rows)
+        menu = []
+        for r in range(self.offset, end):
+            row = [words[j] for j in range(r, n, rows)]
+            row += [""] * (cols - len(row))
+            menu.append(self._row(row, maxlen))
+        if end < rows:
+            # the words in the rows below
+            full, rest = divmod(n, rows)
+            more = full * (rows - end) + max(rest - end, 0)
+            menu.append(f"   {more} more... ")
+            self.next_offset = end
+        else:
+            self.next_offset = 0
+        return menu
+
+    def _row(self, words: List[str], maxlen: int) -> str:
+        return "".join(self.item % left_align(word, maxlen) for word in words)
+
+
+def build_menu(cons, wordlist, start, use_brackets, sort_in_column):
+    """Return the lines of the page of the menu of `wordlist' at
+    `start', and where the next page starts."""
+    menu = CompletionMenu(wordlist, use_brackets, sort_in_column, start)
+    return menu.render(cons), menu.next_offset
 
 
 # this gets somewhat user interface-y, and as a result the logic gets
@@ -152,40 +250,203 @@ def build_menu(cons, wordlist, start, use_brackets, sort_in_column):
 # for subsequent bangs, rotate the menu around (if there are sufficient
 # choices).
 
+# if the completions take longer than completion_deadline to compute,
+# say so and go back to editing; they are delivered later as a complete
+# event carrying the CompletionRequest, unless a key was pressed since.
+
+
+class _Workers:
+    """Daemon threads running functions, reused while idle.
+
+    Unlike the workers of concurrent.futures, they don't keep the
+    interpreter from exiting while some completer hangs, and a hanging
+    one doesn't hold up the others.
+    """
+
+    def __init__(self, max_idle: int = 4):
+        self.max_idle = max_idle
+        self._idle = 0
+        self._lock = threading.Lock()
+        self._queue: queue.SimpleQueue[Callable[[], None]] = queue.SimpleQueue()
+
+    def submit(self, fn: Callable[[], None]):
+        with self._lock:
+            spawn = not self._idle
+            if not spawn:
+                self._idle -= 1
+        self._queue.put(fn)
+        if spawn:
+            threading.Thread(
+                target=self._work, name="pyrepl-completion", daemon=True
+            ).start()
+
+    def _work(self):
+        while True:
+            self._queue.get()()
+            with self._lock:
+                if self._idle >= self.max_idle:
+                    return
+                self._idle += 1
+
+
+_workers = _Workers()
+
+
+class CompletionRequest:
+    """Completions being computed on worker threads, one per source
+    (see CompletingReader.get_completion_sources)."""
+
+    def __init__(
+        self,
+        reader: "CompletingReader",
+        stem: str,
+        last_is_completer: bool,
+        key: Optional[Hashable],
+        sources: Optional[List[CompletionSource]] = None,
+    ):
+        self.reader = reader
+        self.stem = stem
+        # for the completion cache
+        self.key = key
+        self.last_is_completer = last_is_completer
+        if sources is None:
+            sources = [reader.get_completions]
+        # the results of each source, as they arrive
+        self.results: List[List[str]] = [[] for _ in sources]
+        self.remaining = len(sources)
+        self.detached = False
+        self.cancelled = False
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        if not sources:
+            self._done.set()
+        for i, source in enumerate(sources):
+            _workers.submit(functools.partial(self._run, i, source))
+
+    def _run(self, i: int, source: CompletionSource):
+        try:
+            result = source(self.stem)
+            if inspect.isgenerator(result):
+                for batch in result:
+                    if self.cancelled:
+                        result.close()
+                        break
+                    self._add(i, batch, False)
+            else:
+                self._add(i, result, False)
+        except Exception as e:
+            trace("completing {!r} failed: {!r}", self.stem, e)
+        self._add(i, [], True)
+
+    def _add(self, i: int, completions: List[str], last: bool):
+        if not completions and not last:
+            return
+        with self._lock:
+            self.results[i] = self.results[i] + list(completions)
+            if last:
+                self.remaining -= 1
+            done = not self.remaining
+            detached = self.detached
+        if done:
+            self._done.set()
+        if detached and not self.cancelled:
+            self.reader.console.post_event(Event("complete", self))
+
+    def cancel(self):
+        """Stop the sources that produce batches of completions."""
+        self.cancelled = True
+
+    @property
+    def done(self) -> bool:
+        return self._done.is_set()
+
+    def completions(self) -> List[str]:
+        """Return the completions of the sources that are done so far,
+        in the order of the sources."""
+        with self._lock:
+            results = list(self.results)
+        return [word for words in results for word in words]
+
+    def wait(self, timeout: Optional[float]) -> bool:
+        """Wait up to `timeout' seconds for all the sources; return
+        whether they are done.  If not, each of the others will post
+        the request to the console as it is done."""
+        self._done.wait(timeout)
+        with self._lock:
+            if self.remaining:
+                self.detached = True
+            return not self.remaining
+
 
 class complete(commands.Command):
+    @property
+    def posted(self):
+        return isinstance(self.event, CompletionRequest)
+
     def do(self):
         r = self.reader
+        if isinstance(self.event, CompletionRequest):
+            request = self.event
+            if request is not r.cmpltn_pending:
+                return  # cancelled, superseded or already complete
+        else:
+            # pressed again before the completions are in: show them
+            # if they are done by now, what there is so far if not, but
+            # never complete from the choices of a previous completion
+            request = r.cmpltn_pending
+        if request is not None:
+            if not request.done:
+                self.show_pending(request)
+                return
+            r.cmpltn_pending = None
+            r.cmpltn_menu_choices = r.cache_completions(
+                request.key, request.completions()
+            )
+            # fill in the menu if it shows what came first
+            if r.cmpltn_menu_vis:
+                self.show_menu(r.cmpltn_menu_choices, next_page=False)
+                r.msg = ""
+            else:
+                self.show(request.stem, request.last_is_completer, False)
+            return
         last_is_completer = r.last_command_is(self.__class__)
         immutable_completions = r.assume_immutable_completions
         completions_unchangable = last_is_completer and immutable_completions
         stem = r.get_stem()
         if not completions_unchangable:
-            r.cmpltn_menu_choices = r.get_completions(stem)
-
+            completions = r.request_completions(stem, last_is_completer)
+            if completions is None:
+                self.show_pending(r.cmpltn_pending)
+                return
+            r.cmpltn_menu_choices = completions
+        self.show(stem, last_is_completer, completions_unchangable)
+
+    def show(self, stem, last_is_completer, completions_unchangable):
+        r = self.reader
         completions = r.cmpltn_menu_choices
         if not completions:
             r.error("no matches")
         elif len(completions) == 1:
-            if completions_unchangable and len(completions[0]) == len(stem):
+            if completions_unchangable and completions[0] == stem:
                 r.msg = "[ sole completion ]"
                 r.dirty = True
-            r.insert(completions[0][len(stem) :])
+            if r.fuzzy_completion and not completions[0].startswith(stem):
+                del r.buffer[r.pos - len(stem) : r.pos]
+                r.pos -= len(stem)
+                r.insert(completions[0])
+            else:
+                r.insert(completions[0][len(stem) :])
         else:
-            p = prefix(completions, len(stem))
+            # fuzzy matches needn't start with the stem, nor have a
+            # common prefix to add to it
+            fuzzy = r.fuzzy_completion and not all(
+                word.startswith(stem) for word in completions
+            )
+            p = "" if fuzzy else prefix(completions, len(stem))
             if p:
                 r.insert(p)
-            if last_is_completer:
-                if not r.cmpltn_menu_vis:
-                    r.cmpltn_menu_vis = 1
-                r.cmpltn_menu, r.cmpltn_menu_end = build_menu(
-                    r.console,
-                    completions,
-                    r.cmpltn_menu_end,
-                    r.use_brackets,
-                    r.sort_in_column,
-                )
-                r.dirty = True
+            if last_is_completer or fuzzy:
+                self.show_menu(completions)
             elif stem + p in completions:
                 r.msg = "[ complete but not unique ]"
                 r.dirty = True
@@ -194,6 +455,41 @@ class complete(commands.Command):
                 r.dirty = True
 
 
+    def show_menu(self, completions, next_page=True):
+        r = self.reader
+        menu = r.cmpltn_menu_pages
+        if not r.cmpltn_menu_vis or menu is None:
+            r.cmpltn_menu_vis = 1
+            menu = CompletionMenu(completions, r.use_brackets, r.sort_in_column)
+        elif menu.words is not completions:
+            # recomputed: carry on paging from where we were
+            menu = CompletionMenu(
+                completions,
+                r.use_brackets,
+                r.sort_in_column,
+                menu.next_offset if next_page else menu.offset,
+                menu.lengths,
+            )
+        elif next_page:
+            menu.next_page()
+        r.cmpltn_menu_pages = menu
+        r.cmpltn_menu_range = 0, len(completions)
+        r.cmpltn_menu = menu.render(r.console)
+        r.dirty = True
+
+    def show_pending(self, request):
+        """Show what the sources that are done found so far, without
+        inserting anything: the others may not agree.  Pressing the
+        completion key again shows it again until they are done."""
+        r = self.reader
+        completions = r.merge_completions(request.completions())
+        if completions:
+            r.cmpltn_menu_choices = completions
+            self.show_menu(completions, next_page=False)
+        r.msg = "[ computing... ]"
+        r.dirty = True
+
+
 class self_insert(commands.self_insert):
     def do(self):
         commands.self_insert.do(self)
@@ -202,12 +498,35 @@ class self_insert(commands.self_insert):
             stem = r.get_stem()
             if len(stem) < 1:
                 r.cmpltn_reset()
+            elif r.fuzzy_completion:
+                # keep the ranking of the ones that still match
+                words = [w for w in r.cmpltn_menu_pages.words if fuzzy.matches(stem, w)]
+                if words:
+                    r.cmpltn_menu_choices = words
+                    r.cmpltn_menu_range = 0, len(words)
+                    r.cmpltn_menu_pages = CompletionMenu(
+                        words,
+                        r.use_brackets,
+                        r.sort_in_column,
+                        lengths=r.cmpltn_menu_pages.lengths,
+                    )
+                    r.cmpltn_menu = r.cmpltn_menu_pages.render(r.console)
+                else:
+                    r.cmpltn_reset()
             else:
-                completions = [w for w in r.cmpltn_menu_choices if w.startswith(stem)]
-                if completions:
-                    r.cmpltn_menu, r.cmpltn_menu_end = build_menu(
-                        r.console, completions, 0, r.use_brackets, r.sort_in_column
+                # the stem only got longer, so the matches are within
+                # the previous ones
+                lo, hi = prefix_range(r.cmpltn_menu_choices, stem, *r.cmpltn_menu_range)
+                if lo < hi:
+                    r.cmpltn_menu_range = lo, hi
+                    # the words were measured already
+                    r.cmpltn_menu_pages = CompletionMenu(
+                        r.cmpltn_menu_choices[lo:hi],
+                        r.use_brackets,
+                        r.sort_in_column,
+                        lengths=r.cmpltn_menu_pages.lengths,
                     )
+                    r.cmpltn_menu = r.cmpltn_menu_pages.render(r.console)
                 else:
                     r.cmpltn_reset()
 
@@ -216,14 +535,39 @@ class CompletingReader(Reader):
     """Adds completion support
 
     Adds instance variables:
-      * cmpltn_menu, cmpltn_menu_vis, cmpltn_menu_end, cmpltn_choices:
-      *
+      * cmpltn_menu, cmpltn_menu_vis, cmpltn_choices:
+      * cmpltn_menu_pages:
+        the CompletionMenu cmpltn_menu is a page of.
+      * cmpltn_menu_range:
+        the range of the (sorted) cmpltn_menu_choices the visible menu
+        shows, narrowed down as the stem gets longer.  With
+        fuzzy_completion, the choices are in the order get_completions()
+        ranked them, and narrowing filters them.
+      * cmpltn_pending:
+        the CompletionRequest still being computed, if any; pressing
+        any key but the completion key cancels it.  The menu shows the
+        completions of its sources that are done, and fills in as the
+        others are.
+      * cmpltn_cache, cmpltn_generation:
+        the completions computed recently, by stem, completion context
+        and generation.  invalidate_completions() starts a new
+        generation; call it whenever the completions may have changed,
+        e.g. after executing some code.
     """
 
     # see the comment for the complete command
     assume_immutable_completions: bool = True
     use_brackets: bool = True  # display completions inside []
     sort_in_column: bool = False
+    # if not None, get_completions() runs on a worker thread, and is
+    # waited for that many seconds before going back to editing;
+    # needs a console with post_event()
+    completion_deadline: Optional[float] = None
+    # how many results of get_completions() to keep around
+    completion_cache_size: int = 64
+    # get_completions() returns fuzzy matches of the stem (see
+    # pyrepl.fuzzy), best first
+    fuzzy_completion: bool = False
 
     def collect_keymap(self):
         return super().collect_keymap() + ((r"\t", "complete"),)
@@ -232,13 +576,21 @@ class CompletingReader(Reader):
         super().__init__(console)
         self.cmpltn_menu = ["[ menu 1 ]", "[ menu 2 ]"]
         self.cmpltn_menu_vis = 0
-        self.cmpltn_menu_end = 0
+        self.cmpltn_menu_pages: Optional[CompletionMenu] = None
+        self.cmpltn_menu_range = 0, 0
+        self.cmpltn_pending: Optional[CompletionRequest] = None
+        self.cmpltn_cache: OrderedDict[Hashable, List[str]] = OrderedDict()
+        self.cmpltn_generation = 0
         for c in (complete, self_insert):
             self.commands[c.__name__] = c
             self.commands[c.__name__.replace("_", "-")] = c
 
     def after_command(self, cmd):
         super().after_command(cmd)
+        if cmd.posted:
+            return
+        if not isinstance(cmd, complete):
+            self.cmpltn_cancel()
         if not isinstance(cmd, (complete, self_insert)):
             self.cmpltn_reset()
 
@@ -258,8 +610,88 @@ class CompletingReader(Reader):
     def cmpltn_reset(self):
         self.cmpltn_menu = []
         self.cmpltn_menu_vis = 0
-        self.cmpltn_menu_end = 0
+        self.cmpltn_menu_pages = None
         self.cmpltn_menu_choices = []
+        self.cmpltn_menu_range = 0, 0
+        self.cmpltn_cancel()
+
+    def cmpltn_cancel(self):
+        if self.cmpltn_pending is not None:
+            self.cmpltn_pending.cancel()
+            self.cmpltn_pending = None
+
+    def request_completions(
+        self, stem: str, last_is_completer: bool
+    ) -> Optional[List[str]]:
+        """Return the sorted completions of `stem', or None if they are
+        being computed in the background (see completion_deadline); the
+        request is then cmpltn_pending."""
+        context = self.get_completion_context(stem)
+        key = None
+        if context is not None:
+            key = stem, context, self.cmpltn_generation
+            completions = self.cmpltn_cache.get(key)
+            if completions is not None:
+                self.cmpltn_cache.move_to_end(key)
+                return completions
+        sources = self.get_completion_sources(stem)
+        if not self.completes_in_background():
+            completions = [
+                word for source in sources for word in source_completions(source, stem)
+            ]
+        else:
+            self.cmpltn_cancel()
+            request = CompletionRequest(self, stem, last_is_completer, key, sources)
+            if not request.wait(self.completion_deadline):
+                self.cmpltn_pending = request
+                return None
+            completions = request.completions()
+        return self.cache_completions(key, completions)
+
+    def completes_in_background(self) -> bool:
+        """Return whether the completion sources run in the background,
+        with the results that miss the completion_deadline posted."""
+        return self.completion_deadline is not None and hasattr(
+            self.console, "post_event"
+        )
+
+    def get_completion_sources(self, stem: str) -> List[CompletionSource]:
+        """Return the functions finding the completions of `stem', which
+        run concurrently if there is a completion_deadline, and the
+        results of which are merged.  By default, just get_completions.
+
+        A source can also be a generator function yielding batches of
+        completions, which are shown as they come; it is closed if the
+        completion is cancelled.
+        """
+        return [self.get_completions]
+
+    def merge_completions(self, completions: List[str]) -> List[str]:
+        """Return `completions' without duplicates, sorted, for
+        self_insert to narrow them down, or ranked if fuzzy."""
+        if self.fuzzy_completion:
+            return list(dict.fromkeys(completions))
+        return sorted(set(completions))
+
+    def cache_completions(
+        self, key: Optional[Hashable], completions: List[str]
+    ) -> List[str]:
+        completions = self.merge_completions(completions)
+        if key is not None and self.completion_cache_size > 0:
+            self.cmpltn_cache[key] = completions
+            if len(self.cmpltn_cache) > self.completion_cache_size:
+                self.cmpltn_cache.popitem(last=False)
+        return completions
+
+    def invalidate_completions(self):
+        self.cmpltn_generation += 1
+        self.cmpltn_cache.clear()
+
+    def get_completion_context(self, stem: str) -> Optional[str]:
+        """Return what, besides `stem', the completions may depend on in
+        the buffer: by default, everything before it.  None means they
+        shouldn't be cached."""
+        return "".join(self.buffer[: self.pos - len(stem)])
 
     def get_stem(self) -> str:
         st = self.syntax_table
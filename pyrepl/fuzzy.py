@@ -0,0 +1,119 @@
+"""Fuzzy matching of completions.
+
+A query matches a word if its characters appear in the word in the
+same order, the first one at its start, ignoring case.  Matches are
+ranked by how many characters of the query fall at the start of a
+segment of the word (after an underscore, or where lowercase turns to
+uppercase or letters to digits) or right after the previous one, so
+that "gcm" ranks get_completion_menu and getCompletionMenu first.
+Words the query is a prefix of come before all others.
+
+What matching needs to know about a word (its lowercase version and
+segment starts) is computed once per word, and only the words starting
+with the first character of the query are looked at: they are found
+by bisection in the sorted list of words.
+"""
+
+from bisect import bisect_left
+from typing import Dict, List, Optional, Sequence, Tuple
+
+PREFIX_BONUS = 1000
+SEGMENT_BONUS = 3
+CONSECUTIVE_BONUS = 2
+
+# lowercased word, segment starts
+Features = Tuple[str, Tuple[int, ...]]
+
+# forget the features of words beyond this many
+_MAX_FEATURES = 200000
+
+
+def features(word: str) -> Features:
+    starts = [0]
+    for i in range(1, len(word)):
+        c, before = word[i], word[i - 1]
+        if (
+            (before == "_" and c != "_")
+            or (c.isupper() and not before.isupper())
+            or (c.isdigit() and not before.isdigit())
+        ):
+            starts.append(i)
+    return word.lower(), tuple(starts)
+
+
+def _follows(query: str, k: int, lower: str, i: int) -> bool:
+    """Return whether query[k:] is a subsequence of lower[i + 1:]."""
+    for c in query[k:]:
+        i = lower.find(c, i + 1)
+        if i < 0:
+            return False
+    return True
+
+
+def score(query: str, feats: Features) -> Optional[int]:
+    """Return how well the lowercase `query' matches the word with
+    features `feats', or None if it doesn't."""
+    lower, starts = feats
+    if not lower.startswith(query[0]):
+        return None
+    if lower.startswith(query):
+        return PREFIX_BONUS + len(query) * CONSECUTIVE_BONUS
+    total = SEGMENT_BONUS
+    prev = 0
+    for k in range(1, len(query)):
+        c = query[k]
+        i = lower.find(c, prev + 1)
+        if i < 0:
+            return None
+        if i == prev + 1:
+            total += CONSECUTIVE_BONUS
+        else:
+            # rather the start of a later segment, if the rest of the
+            # query can still match after it
+            for s in starts:
+                if s > i and lower[s] == c and _follows(query, k + 1, lower, s):
+                    i = s
+                    break
+        if i in starts:
+            total += SEGMENT_BONUS
+        prev = i
+    return total
+
+
+def matches(query: str, word: str) -> bool:
+    """Return whether `query' fuzzily matches `word'."""
+    return bool(query) and score(query.lower(), features(word)) is not None
+
+
+class FuzzyMatcher:
+    """Ranks words against queries, remembering the features of the
+    words it has seen."""
+
+    def __init__(self):
+        self._features: Dict[str, Features] = {}
+
+    def features(self, word: str) -> Features:
+        feats = self._features.get(word)
+        if feats is None:
+            if len(self._features) >= _MAX_FEATURES:
+                self._features.clear()
+            feats = self._features[word] = features(word)
+        return feats
+
+    def match(self, words: Sequence[str], query: str) -> List[str]:
+        """Return the words of the sorted `words' that `query' matches,
+        best first; equally good ones stay in sorted order."""
+        if not query:
+            return list(words)
+        lowered = query.lower()
+        ranked = []
+        for first in sorted({query[0].lower(), query[0].upper()}):
+            lo = bisect_left(words, first)
+            hi = bisect_left(words, first + "\U0010ffff", lo)
+            for i in range(lo, hi):
+                word = words[i]
+                s = score(lowered, self.features(word))
+                if s is not None:
+                    ranked.append((-s, word))
+        ranked.sort()
+        return [word for _, word in ranked]
@@ -0,0 +1,169 @@
+"""Syntax highlighting of Python source, a line at a time.
+
+Highlighter.colors() lexes the lines of the buffer into runs of
+characters to colour.  What it finds in a line only depends on the line
+and on whether the line before left a string literal open, so the
+results are cached by both: after a keystroke, only the edited line is
+lexed again, along with the lines after it if it opened or closed a
+triple-quoted string.
+
+The colours are SGR parameters, by kind of token (see DEFAULT_THEME);
+Reader.calc_screen() wraps each run in its own escape sequences, so a
+line that didn't change is drawn the same, and isn't written again.
+"""
+
+import builtins
+import keyword
+import re
+from typing import Dict, List, Optional, Tuple
+
+# kind -> SGR parameters
+DEFAULT_THEME: Dict[str, str] = {
+    "keyword": "1;34",
+    "builtin": "36",
+    "definition": "1;33",
+    "string": "32",
+    "number": "33",
+    "comment": "2;37",
+}
+
+# start, end, kind of a run of characters in a line
+Run = Tuple[int, int, str]
+
+# the quotes of the string literal a line leaves open, if any
+State = Optional[str]
+
+_token = re.compile(
+    r"""
+    (?P<comment>\#.*)
+  | (?P<string>(?<![\w])[rRbBuUfF]{0,2}(?:'''|\"\"\"|'|"))
+  | (?P<number>(?<![\w.])(?:0[xXoObB][0-9a-fA-F_]+|(?:\d[\d_]*\.?[\d_]*|\.\d[\d_]*)
+                (?:[eE][+-]?\d+)?[jJ]?))
+  | (?P<name>[^\W\d]\w*)
+    """,
+    re.VERBOSE,
+)
+
+_KEYWORDS = frozenset(keyword.kwlist)
+# only keywords at the start of some statements, and names elsewhere
+# (the wildcard "_" is always taken for a name)
+_SOFT_KEYWORDS = frozenset(["match", "case", "type"])
+_type_alias = re.compile(r"\s+[^\W\d]\w*\s*(?:\[.*\])?\s*=(?!=)")
+_BUILTINS = frozenset(name for name in dir(builtins) if not name.startswith("_"))
+
+# forget the lines lexed beyond this many
+_MAX_CACHE = 10000
+
+
+def _string_end(line: str, i: int, quote: str) -> int:
+    """Return where the string literal closed by `quote' that goes on
+    at line[i] ends, or -1 if not in this line."""
+    n = len(line)
+    while i < n:
+        if line[i] == "\\":
+            i += 2
+        elif line.startswith(quote, i):
+            return i + len(quote)
+        else:
+            i += 1
+    return -1
+
+
+def _soft_keyword(line: str, start: int, end: int) -> bool:
+    """Return whether the soft keyword at line[start:end] starts a
+    statement it is a keyword of: a block statement ending with a
+    colon, or a type alias definition."""
+    if line[:start].strip() or not line[end : end + 1].isspace():
+        return False
+    rest = line[end:]
+    if line[start:end] == "type":
+        return _type_alias.match(rest) is not None
+    # roughly: a "#" may be in a string
+    return any(
+        code.rstrip().endswith(":") for code in (rest, rest.partition("#")[0])
+    )
+
+
+def lex_line(line: str, state: State) -> Tuple[List[Run], State]:
+    """Return the runs to colour in `line', starting in `state', and the
+    state at its end."""
+    runs: List[Run] = []
+    i = 0
+    if state is not None:
+        end = _string_end(line, 0, state)
+        if end < 0:
+            return [(0, len(line), "string")] if line else [], state
+        runs.append((0, end, "string"))
+        i = end
+    after_def = False
+    while True:
+        m = _token.search(line, i)
+        if m is None:
+            break
+        kind = m.lastgroup
+        start, i = m.span()
+        if kind == "string":
+            quote = m.group().lstrip("rRbBuUfF")
+            end = _string_end(line, i, quote)
+            if end < 0:
+                runs.append((start, len(line), "string"))
+                # only triple-quoted strings (or escaped newlines)
+                # carry on
+                if len(quote) == 3 or line.endswith("\\"):
+                    return runs, quote
+                return runs, None
+            runs.append((start, end, "string"))
+            i = end
+        elif kind == "name":
+            word = m.group()
+            if after_def:
+                runs.append((start, i, "definition"))
+            elif word in _KEYWORDS or (
+                word in _SOFT_KEYWORDS and _soft_keyword(line, start, i)
+            ):
+                runs.append((start, i, "keyword"))
+            elif word in _BUILTINS:
+                runs.append((start, i, "builtin"))
+            after_def = word in ("def", "class")
+            continue
+        else:
+            runs.append((start, i, kind))  # type: ignore[arg-type]
+        after_def = False
+    return runs, None
+
+
+class Highlighter:
+    """Colours lines of Python source, remembering the lines it lexed
+    by their contents and the state they started in."""
+
+    def __init__(self, theme: Optional[Dict[str, str]] = None):
+        self.theme = dict(DEFAULT_THEME if theme is None else theme)
+        self._cache: Dict[Tuple[State, str], Tuple[List[Run], State]] = {}
+        # how many lines were lexed, for the curious
+        self.lexed = 0
+
+    def lex(self, line: str, state: State) -> Tuple[List[Run], State]:
+        key = state, line
+        result = self._cache.get(key)
+        if result is None:
+            if len(self._cache) >= _MAX_CACHE:
+                self._cache.clear()
+            result = self._cache[key] = lex_line(line, state)
+            self.lexed += 1
+        return result
+
+    def colors(self, lines: List[str]) -> List[List[Tuple[int, int, str]]]:
+        """Return the runs of each line to colour, with the SGR
+        parameters to colour them with."""
+        state: State = None
+        colors = []
+        for line in lines:
+            runs, state = self.lex(line, state)
+            colors.append(
+                [
+                    (start, end, self.theme[kind])
+                    for start, end, kind in runs
+                    if self.theme.get(kind)
+                ]
+            )
+        return colors
@@ -17,10 +17,16 @@
 # CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF OR IN
 # CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
 
-from typing import TYPE_CHECKING, Dict, List
+import heapq
+import math
+import threading
+from typing import TYPE_CHECKING, Dict, List, Optional, Sequence, Tuple
 
 from pyrepl import commands
+from pyrepl.console import Event
+from pyrepl.history import CompactHistory, History, HistoryFile
 from pyrepl.reader import Reader as R
+from pyrepl.trace import trace
 
 if TYPE_CHECKING:
     from .console import Console
@@ -47,10 +53,106 @@ isearch_keymap: "KeyMap" = (
     (r"\<backspace>", "isearch-backspace"),
 )
 
+fuzzy_keymap: "KeyMap" = (
+    *((f"\\{c:03o}", "fuzzy-history-end") for c in range(256) if chr(c) != "\\"),
+    *(
+        (c, "fuzzy-history-add-character")
+        for c in map(chr, list(range(32, 127)))
+        if c != "\\"
+    ),
+    *(
+        (f"\\{c:03o}", "fuzzy-history-add-character")
+        for c in range(256)
+        if chr(c).isalpha() and chr(c) != "\\"
+    ),
+    ("\\\\", "fuzzy-history-add-character"),
+    (r"\C-n", "fuzzy-history-next"),
+    (r"\<down>", "fuzzy-history-next"),
+    (r"\C-p", "fuzzy-history-previous"),
+    (r"\<up>", "fuzzy-history-previous"),
+    (r"\C-c", "fuzzy-history-cancel"),
+    (r"\C-g", "fuzzy-history-cancel"),
+    (r"\<backspace>", "fuzzy-history-backspace"),
+)
+
 ISEARCH_DIRECTION_NONE = ""
 ISEARCH_DIRECTION_BACKWARDS = "r"
 ISEARCH_DIRECTION_FORWARDS = "f"
 
+# Fuzzy history search.  A candidate is a tuple
+#
+#   (lowercased entry, history index, frequency, last matched position,
+#    score)
+#
+# and appending a character to the search term only has to look past
+# the last matched position of each surviving candidate, so a keystroke
+# costs O(survivors) instead of a rescan of the whole history.  The
+# candidate lists for every prefix of the term are kept around, which
+# makes backspacing free.
+
+FUZZY_MATCH_BONUS = 16
+FUZZY_CONSECUTIVE_BONUS = 8
+FUZZY_BOUNDARY_BONUS = 8
+FUZZY_MAX_GAP_PENALTY = 8
+FUZZY_RECENCY_WEIGHT = 8.0
+FUZZY_FREQUENCY_WEIGHT = 4.0
+
+FuzzyCandidate = Tuple[str, int, int, int, int]
+
+
+def fuzzy_candidates(history: Sequence[str]) -> List[FuzzyCandidate]:
+    """Return one candidate per distinct history entry, most recent
+    first."""
+    counts: Dict[str, int] = {}
+    latest = []
+    # a single pass over the entries, which matters when history is
+    # not an in-memory list
+    for i, entry in zip(range(len(history) - 1, -1, -1), reversed(history)):
+        n = counts.get(entry)
+        if n is None:
+            counts[entry] = 1
+            latest.append((entry, i))
+        else:
+            counts[entry] = n + 1
+    return [(entry.lower(), i, counts[entry], -1, 0) for entry, i in latest]
+
+
+def fuzzy_extend(candidates: List[FuzzyCandidate], char: str) -> List[FuzzyCandidate]:
+    """Narrow `candidates' to the ones that still match once `char' is
+    appended to the search term, updating their scores."""
+    char = char.lower()
+    result = []
+    append = result.append
+    for text, i, count, last, score in candidates:
+        p = text.find(char, last + 1)
+        if p == -1:
+            continue
+        score += FUZZY_MATCH_BONUS
+        if p == last + 1:
+            score += FUZZY_CONSECUTIVE_BONUS
+        elif not text[p - 1].isalnum():
+            score += FUZZY_BOUNDARY_BONUS
+        score -= min(p - last - 1, FUZZY_MAX_GAP_PENALTY)
+        append((text, i, count, p, score))
+    return result
+
+
+def fuzzy_rank(candidates: List[FuzzyCandidate], size: int, n: int) -> List[int]:
+    """Return the history indexes of the `n' best candidates, combining
+    the match score with the recency and frequency of each entry;
+    `size' is the length of the history."""
+    size = max(size, 1)
+
+    def key(candidate):
+        _, i, count, _, score = candidate
+        return (
+            score
+            + FUZZY_RECENCY_WEIGHT * i / size
+            + FUZZY_FREQUENCY_WEIGHT * math.log2(count)
+        )
+
+    return [c[1] for c in heapq.nlargest(n, candidates, key=key)]
+
 
 class next_history(commands.Command):
     def do(self):
@@ -193,22 +295,124 @@ class isearch_end(commands.Command):
         r.dirty = True
 
 
+class fuzzy_history_search(commands.Command):
+    def do(self):
+        r = self.reader
+        r.fuzzy_active = True
+        r.fuzzy_start = r.historyi, r.pos
+        r.fuzzy_term = ""
+        r.fuzzy_levels = []
+        r.push_input_trans(r.fuzzy_trans)
+        r.fuzzy_update()
+        r.dirty = True
+
+
+class fuzzy_history_add_character(commands.Command):
+    def do(self):
+        r = self.reader
+        r.fuzzy_term += self.event[-1]
+        r.fuzzy_update()
+        r.dirty = True
+
+
+class fuzzy_history_backspace(commands.Command):
+    def do(self):
+        r = self.reader
+        if r.fuzzy_term:
+            r.fuzzy_term = r.fuzzy_term[:-1]
+            r.fuzzy_update()
+            r.dirty = True
+        else:
+            r.error("nothing to rubout")
+
+
+class fuzzy_history_next(commands.Command):
+    def do(self):
+        r = self.reader
+        if r.fuzzy_selected + 1 < len(r.fuzzy_matches):
+            r.fuzzy_select(r.fuzzy_selected + 1)
+        else:
+            r.error("no more matches")
+
+
+class fuzzy_history_previous(commands.Command):
+    def do(self):
+        r = self.reader
+        if r.fuzzy_selected > 0:
+            r.fuzzy_select(r.fuzzy_selected - 1)
+        else:
+            r.error("no more matches")
+
+
+class fuzzy_history_cancel(commands.Command):
+    def do(self):
+        r = self.reader
+        r.fuzzy_stop()
+        r.select_item(r.fuzzy_start[0])
+        r.pos = r.fuzzy_start[1]
+        r.dirty = True
+
+
+class fuzzy_history_end(commands.Command):
+    def do(self):
+        r = self.reader
+        r.fuzzy_stop()
+        r.dirty = True
+
+
+class fuzzy_history_ranked(commands.Command):
+    """Posted by the background ranking thread once it is done."""
+
+    posted = 1
+
+    def do(self):
+        r = self.reader
+        generation, result = self.event
+        if r.fuzzy_active and generation == r.fuzzy_generation:
+            r.fuzzy_install(result)
+            r.dirty = True
+
+
 class HistoricalReader(R):
     """Adds history support (with incremental history searching) to the
     Reader class.
 
     Adds the following instance variables:
       * history:
-        a list of strings
+        a list of strings; by default a History (a CompactHistory if
+        history_compact is set) bounded by history_max_length and
+        applying the history_ignore_dups and history_erase_dups
+        policies, but any list will do.
       * historyi:
+      * history_file:
+        if not None, a HistoryFile shared with other sessions: accepted
+        entries are appended to it, and entries appended by others are
+        merged into history in prepare().
       * transient_history:
+        the edited versions of the history entries; an entry is only
+        copied there once it was changed.
       * next_history:
       * isearch_direction, isearch_term, isearch_start:
+      * fuzzy_active, fuzzy_term, fuzzy_start, fuzzy_matches,
+        fuzzy_selected:
+        state of the fuzzy history search; fuzzy_matches holds the
+        history indexes of the best fuzzy_menu_size matches.
       * yank_arg_i, yank_arg_yanked:
         used by the yank-arg command; not actually manipulated by any
         HistoricalReader instance methods.
     """
 
+    history_max_length: Optional[int] = None
+    history_ignore_dups: bool = False
+    history_erase_dups: bool = False
+    # for very large histories
+    history_compact: bool = False
+
+    fuzzy_menu_size: int = 10
+    # rank on a background thread above this many candidates, provided
+    # the console supports post_event()
+    fuzzy_thread_threshold: int = 50000
+
     def collect_keymap(self) -> "KeyMap":
         return super().collect_keymap() + (
             (r"\C-n", "next-history"),
@@ -218,17 +422,31 @@ class HistoricalReader(R):
             (r"\C-s", "forward-history-isearch"),
             (r"\M-r", "restore-history"),
             (r"\M-.", "yank-arg"),
+            (r"\C-x\C-r", "fuzzy-history-search"),
             (r"\<page down>", "last-history"),
             (r"\<page up>", "first-history"),
         )
 
     def __init__(self, console: "Console"):
         super().__init__(console)
-        self.history: List[str] = []
+        history_class = CompactHistory if self.history_compact else History
+        self.history: List[str] = history_class(
+            maxlen=self.history_max_length,
+            ignore_dups=self.history_ignore_dups,
+            erase_dups=self.history_erase_dups,
+        )
         self.historyi = 0
+        self.history_file: Optional[HistoryFile] = None
         self.transient_history: Dict[int, str] = {}
         self.next_history = None
         self.isearch_direction = ISEARCH_DIRECTION_NONE
+        self.fuzzy_active = False
+        self.fuzzy_term = ""
+        self.fuzzy_levels: List[Tuple[str, List[FuzzyCandidate]]] = []
+        self.fuzzy_matches: List[int] = []
+        self.fuzzy_selected = 0
+        self.fuzzy_pending = False
+        self.fuzzy_generation = 0
         for c in (
             next_history,
             previous_history,
@@ -246,6 +464,14 @@ class HistoricalReader(R):
             isearch_forwards,
             isearch_backwards,
             operate_and_get_next,
+            fuzzy_history_search,
+            fuzzy_history_add_character,
+            fuzzy_history_backspace,
+            fuzzy_history_next,
+            fuzzy_history_previous,
+            fuzzy_history_cancel,
+            fuzzy_history_end,
+            fuzzy_history_ranked,
         ):
             self.commands[c.__name__] = c
             self.commands[c.__name__.replace("_", "-")] = c
@@ -256,9 +482,18 @@ class HistoricalReader(R):
             invalid_cls=isearch_end,
             character_cls=isearch_add_character,
         )
+        self.fuzzy_trans = input.KeymapTranslator(
+            fuzzy_keymap,
+            invalid_cls=fuzzy_history_end,
+            character_cls=fuzzy_history_add_character,
+        )
 
     def select_item(self, i: int):
-        self.transient_history[self.historyi] = self.get_str()
+        current = self.get_str()
+        if self.historyi < len(self.history) and current == self.history[self.historyi]:
+            self.transient_history.pop(self.historyi, None)
+        else:
+            self.transient_history[self.historyi] = current
         buf = self.transient_history.get(i)
         self.buffer = list(self.history[i] if buf is None else buf)
         self.historyi = i
@@ -275,6 +510,8 @@ class HistoricalReader(R):
         super().prepare()
         try:
             self.transient_history = {}
+            if self.history_file is not None:
+                self.merge_history_file()
             if self.next_history is not None and self.next_history < len(self.history):
                 self.historyi = self.next_history
                 self.buffer[:] = list(self.history[self.next_history])
@@ -283,6 +520,7 @@ class HistoricalReader(R):
             else:
                 self.historyi = len(self.history)
             self.next_history = None
+            self.fuzzy_active = False
         except:
             self.restore()
             raise
@@ -291,9 +529,100 @@ class HistoricalReader(R):
         if cursor_on_line and self.isearch_direction != ISEARCH_DIRECTION_NONE:
             d = "rf"[self.isearch_direction == ISEARCH_DIRECTION_FORWARDS]
             return f"({d}-search `{self.isearch_term}') "
+        if cursor_on_line and self.fuzzy_active:
+            return f"(fuzzy-search `{self.fuzzy_term}') "
 
         return super().get_prompt(lineno, cursor_on_line)
 
+    def calc_screen(self):
+        screen = super().calc_screen()
+        if self.fuzzy_active:
+            # the menu goes below everything else, so screeninfo (and
+            # with it the cursor position) is left alone
+            screen.extend(self.fuzzy_menu())
+        return screen
+
+    def fuzzy_menu(self) -> List[str]:
+        width = self.console.width - 3
+        menu = []
+        for j, i in enumerate(self.fuzzy_matches):
+            mark = ">" if j == self.fuzzy_selected else " "
+            entry = self.history[i][:width].replace("\n", " ")
+            menu.append(f"{mark} {entry}")
+        if self.fuzzy_pending:
+            menu.append("  [ ranking... ]")
+        return menu
+
+    def fuzzy_update(self):
+        """Recompute the matches after fuzzy_term changed.
+
+        The candidates surviving the longest still-valid prefix of the
+        term are narrowed down; if there are many of them the work is
+        done on a background thread and the result is posted back to
+        the console as a fuzzy-history-ranked event."""
+        self.fuzzy_generation += 1
+        generation = self.fuzzy_generation
+        term = self.fuzzy_term.lower()
+        levels = self.fuzzy_levels
+        while levels and not term.startswith(levels[-1][0]):
+            levels.pop()
+        size = len(levels[-1][1]) if levels else len(self.history)
+        if size > self.fuzzy_thread_threshold and hasattr(self.console, "post_event"):
+            self.fuzzy_pending = True
+            threading.Thread(
+                target=self._fuzzy_rank_in_background,
+                args=(generation, list(levels), term),
+                daemon=True,
+            ).start()
+        else:
+            self.fuzzy_install(self.fuzzy_compute(generation, list(levels), term))
+
+    def _fuzzy_rank_in_background(self, generation, levels, term):
+        result = self.fuzzy_compute(generation, levels, term)
+        if result is not None:
+            self.console.post_event(
+                Event("fuzzy-history-ranked", (generation, result))
+            )
+
+    def fuzzy_compute(
+        self,
+        generation: int,
+        levels: List[Tuple[str, List[FuzzyCandidate]]],
+        term: str,
+    ) -> Optional[tuple]:
+        """Extend `levels' up to `term' and rank the survivors.  Returns
+        None if a newer search made the computation moot."""
+        if not levels:
+            levels.append(("", fuzzy_candidates(self.history)))
+        for j in range(len(levels[-1][0]), len(term)):
+            if generation != self.fuzzy_generation:
+                return None
+            levels.append((term[: j + 1], fuzzy_extend(levels[-1][1], term[j])))
+        matches = fuzzy_rank(levels[-1][1], len(self.history), self.fuzzy_menu_size)
+        return levels, matches
+
+    def fuzzy_install(self, result: tuple):
+        self.fuzzy_levels, self.fuzzy_matches = result
+        self.fuzzy_pending = False
+        if self.fuzzy_matches:
+            self.fuzzy_select(0)
+        else:
+            self.fuzzy_selected = 0
+            self.error("not found")
+
+    def fuzzy_select(self, j: int):
+        self.fuzzy_selected = j
+        self.select_item(self.fuzzy_matches[j])
+
+    def fuzzy_stop(self):
+        self.fuzzy_active = False
+        self.fuzzy_pending = False
+        # makes any ranking still running in the background stale
+        self.fuzzy_generation += 1
+        self.fuzzy_levels = []
+        self.fuzzy_matches = []
+        self.pop_input_trans()
+
     def isearch_next(self):
         st = self.isearch_term
         p = self.pos
@@ -306,18 +635,39 @@ class HistoricalReader(R):
                 self.select_item(i)
                 self.pos = p
                 return
-            if (forwards and i == len(self.history) - 1) or (not forwards and i == 0):
+            i = self.isearch_next_item(st, i, forwards)
+            if i is None:
                 self.error("not found")
                 return
 
+            s = self.get_item(i)
+            p = -1 if forwards else len(s)
+
+    def isearch_next_item(self, term: str, i: int, forwards: bool) -> Optional[int]:
+        """Return the index of the next history item after (or before)
+        `i' worth looking for `term' in, or None if there is none.
+
+        If history has a search(term, i, forwards) method, it is used to
+        skip straight to the next stored entry containing `term'."""
+        search = getattr(self.history, "search", None)
+        if search is None:
             if forwards:
-                i += 1
-                s = self.get_item(i)
-                p = -1
-            else:
-                i -= 1
-                s = self.get_item(i)
-                p = len(s)
+                return i + 1 if i < len(self.history) - 1 else None
+            return i - 1 if i > 0 else None
+
+        # edited entries are not in the store
+        edited = self.transient_history
+        j = search(term, i, forwards)
+        while j is not None and j in edited:
+            j = search(term, j, forwards)
+        found = [] if j is None else [j]
+        for k, text in edited.items():
+            beyond = k > i if forwards else k < i
+            if beyond and k < len(self.history) and term in text:
+                found.append(k)
+        if not found:
+            return None
+        return min(found) if forwards else max(found)
 
     def finish(self):
         super().finish()
@@ -326,7 +676,33 @@ class HistoricalReader(R):
             if i < len(self.history) and i != self.historyi:
                 self.history[i] = t
         if ret:
-            self.history.append(ret)
+            self.append_history(ret)
+            if self.history_file is not None:
+                try:
+                    self.history_file.append(ret)
+                except OSError as e:
+                    trace("could not append to the history file: {e}", e=e)
+
+    def append_history(self, entry: str):
+        self.history.append(entry)
+        removed = getattr(self.history, "last_removed", None)
+        if (
+            removed is not None
+            and self.next_history is not None
+            and removed < self.next_history
+        ):
+            # an older entry made room for this one
+            self.next_history -= 1
+
+    def merge_history_file(self):
+        """Append the entries other sessions added to history_file."""
+        try:
+            entries = self.history_file.tail()
+        except OSError as e:
+            trace("could not read the history file: {e}", e=e)
+            return
+        for entry in entries:
+            self.append_history(entry)
 
 
 def test():
@@ -0,0 +1,708 @@
+"""Containers for the entries of a HistoricalReader.
+
+The readers only rely on the list protocol (len, integer indexing,
+append, item assignment and deletion), so a plain list still works;
+History adds an optional maximum length and duplicate policies on top,
+and CompactHistory does the same for histories too big to keep as one
+str object per entry.
+
+HistoryFile shares history between concurrently running sessions.
+"""
+
+import operator
+import os
+from array import array
+from bisect import bisect_left, bisect_right
+from collections.abc import MutableSequence
+from itertools import islice, repeat
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # no advisory locking, e.g. on windows
+    fcntl = None  # type: ignore[assignment]
+
+# evicted slots at the front of the storage are only reclaimed once
+# there are this many of them and they make up half of it
+_COMPACT_THRESHOLD = 1024
+
+
+class History(MutableSequence):
+    """A list of history entries with ring-buffer semantics.
+
+    * maxlen:
+      if not None, appending to a full history drops its oldest entry.
+    * ignore_dups:
+      don't append an entry equal to the most recent one.
+    * erase_dups:
+      appending an entry removes any older occurrence of it first.
+
+    Appending and evicting are O(1) (amortized); erasing a duplicate
+    finds it through a hash index of the entries and a bisection of
+    their sequence numbers, and then costs a single memmove.
+
+    After each append, `last_removed' is the index the entry dropped
+    to make room for it (or erased as a duplicate) had, or None.  It
+    lets callers holding on to indexes adjust them.
+    """
+
+    def __init__(
+        self,
+        entries: Iterable[str] = (),
+        maxlen: Optional[int] = None,
+        ignore_dups: bool = False,
+        erase_dups: bool = False,
+    ):
+        self._maxlen = maxlen
+        self.ignore_dups = ignore_dups
+        self.erase_dups = erase_dups
+        self.last_removed: Optional[int] = None
+        self._reset(entries)
+
+    def _reset(self, entries: Iterable[str]):
+        self._entries: List[Optional[str]] = list(entries)
+        # strictly increasing, so positions can be found by bisection
+        # even after entries were removed from the middle
+        self._seqs = list(range(len(self._entries)))
+        self._next_seq = len(self._entries)
+        self._start = 0
+        # entry -> sequence number of its most recent occurrence; only
+        # built once erase_dups needs it
+        self._index: Optional[Dict[str, int]] = None
+        # entry -> how many more occurrences of it there are than one,
+        # for the indexed entries assignments (or the initial entries)
+        # duplicated
+        self._extra: Dict[str, int] = {}
+        self._trim()
+
+    @property
+    def maxlen(self) -> Optional[int]:
+        return self._maxlen
+
+    @maxlen.setter
+    def maxlen(self, maxlen: Optional[int]):
+        self._maxlen = maxlen
+        self._trim()
+
+    def __len__(self) -> int:
+        return len(self._entries) - self._start
+
+    def __iter__(self) -> Iterator[str]:
+        return islice(self._entries, self._start, None)
+
+    def __reversed__(self) -> Iterator[str]:
+        for p in range(len(self._entries) - 1, self._start - 1, -1):
+            yield self._entries[p]
+
+    def __contains__(self, entry) -> bool:
+        if self._index is not None:
+            return entry in self._index
+        return any(e == entry for e in self)
+
+    def __eq__(self, other):
+        if isinstance(other, (History, list)):
+            return len(self) == len(other) and all(
+                a == b for a, b in zip(self, other)
+            )
+        return NotImplemented
+
+    __hash__ = None  # type: ignore[assignment]
+
+    def __repr__(self):
+        return f"History({list(self)!r}, maxlen={self._maxlen!r})"
+
+    def _pos(self, i: int) -> int:
+        n = len(self)
+        if i < 0:
+            i += n
+        if not 0 <= i < n:
+            raise IndexError("history index out of range")
+        return i + self._start
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            start, stop, step = i.indices(len(self))
+            if step == 1:
+                return self._entries[self._start + start : self._start + stop]
+            return [self._entries[self._start + j] for j in range(start, stop, step)]
+        return self._entries[self._pos(i)]
+
+    def __setitem__(self, i, entry):
+        if isinstance(i, slice):
+            entries = list(self)
+            entries[i] = entry
+            self._reset(entries)
+            return
+        p = self._pos(i)
+        self._unindex(p)
+        self._entries[p] = entry
+        self._reindex(p)
+
+    def __delitem__(self, i):
+        if isinstance(i, slice):
+            entries = list(self)
+            del entries[i]
+            self._reset(entries)
+            return
+        p = self._pos(i)
+        self._unindex(p)
+        del self._entries[p]
+        del self._seqs[p]
+
+    def insert(self, i: int, entry: str):
+        if i >= len(self):
+            self.append(entry)
+            return
+        # inserting in the middle has to renumber everything; nothing
+        # in pyrepl does this
+        entries = list(self)
+        entries.insert(i, entry)
+        self._reset(entries)
+
+    def append(self, entry: str):
+        self.last_removed = None
+        if self.ignore_dups and len(self) and self._entries[-1] == entry:
+            return
+        if self.erase_dups:
+            index = self._index
+            if index is None:
+                index = self._build_index()
+            seq = index.get(entry)
+            if seq is not None:
+                p = bisect_left(self._seqs, seq, self._start)
+                self._unindex(p)
+                del self._entries[p]
+                del self._seqs[p]
+                self.last_removed = p - self._start
+        self._entries.append(entry)
+        self._seqs.append(self._next_seq)
+        self._next_seq += 1
+        self._reindex(len(self._entries) - 1)
+        if self._trim():
+            self.last_removed = 0
+
+    def clear(self):
+        self._reset(())
+
+    def _build_index(self) -> Dict[str, int]:
+        self._index = {}
+        self._extra = {}
+        for p in range(self._start, len(self._entries)):
+            self._reindex(p)
+        return self._index
+
+    def _reindex(self, p: int):
+        """Add the entry at position p to the index."""
+        index = self._index
+        if index is None:
+            return
+        entry = self._entries[p]
+        seq = index.get(entry)
+        if seq is not None:
+            self._extra[entry] = self._extra.get(entry, 0) + 1
+        if seq is None or seq < self._seqs[p]:
+            index[entry] = self._seqs[p]
+
+    def _unindex(self, p: int):
+        """Remove the entry at position p, which is about to be
+        overwritten or removed, from the index."""
+        index = self._index
+        if index is None:
+            return
+        entry = self._entries[p]
+        extra = self._extra.get(entry)
+        if extra is None:
+            del index[entry]
+            return
+        if extra > 1:
+            self._extra[entry] = extra - 1
+        else:
+            del self._extra[entry]
+        if index[entry] == self._seqs[p]:
+            # the most recent occurrence is now the one before
+            for q in range(len(self._entries) - 1, self._start - 1, -1):
+                if q != p and self._entries[q] == entry:
+                    index[entry] = self._seqs[q]
+                    break
+
+    def _trim(self) -> bool:
+        """Evict the oldest entries down to maxlen; return whether
+        anything was evicted."""
+        if self._maxlen is None or len(self) <= self._maxlen:
+            return False
+        while len(self) > self._maxlen:
+            self._unindex(self._start)
+            self._entries[self._start] = None
+            self._start += 1
+        if (
+            self._start >= _COMPACT_THRESHOLD
+            and 2 * self._start >= len(self._entries)
+        ):
+            del self._entries[: self._start]
+            del self._seqs[: self._start]
+            self._start = 0
+        return True
+
+
+class CompactHistory(MutableSequence):
+    """A History that stores its entries compactly.
+
+    The entries are kept UTF-8 encoded one after the other in a single
+    bytearray, along with an array of their offsets in it, so a million
+    entries cost little more than their text rather than a str object
+    and a list slot each.  Entries are decoded whenever they are
+    accessed.  Assigning to an entry only records the new text in a
+    sparse overlay, which is folded back into the blob once it holds
+    _COMPACT_THRESHOLD entries, or when evicted entries are reclaimed.
+
+    maxlen, ignore_dups, erase_dups and last_removed behave as for
+    History.  A duplicate to erase is found through an index of the
+    hashes of the entries (only built once erase_dups needs it), but
+    removing it means shifting all the offsets after it.
+    """
+
+    def __init__(
+        self,
+        entries: Iterable[str] = (),
+        maxlen: Optional[int] = None,
+        ignore_dups: bool = False,
+        erase_dups: bool = False,
+    ):
+        self._maxlen = maxlen
+        self.ignore_dups = ignore_dups
+        self.erase_dups = erase_dups
+        self.last_removed: Optional[int] = None
+        self._reset(entries)
+
+    def _reset(self, entries: Iterable[str]):
+        # entries may be an iterator over self: nothing is replaced
+        # before it is exhausted
+        blob = bytearray()
+        offsets = array("Q", [0])
+        for entry in entries:
+            blob += _encode(entry)
+            offsets.append(len(blob))
+        # entry p is blob[offsets[p] : offsets[p + 1]]; the ones before
+        # _start were evicted
+        self._blob = blob
+        self._offsets = offsets
+        # strictly increasing, as for History
+        self._seqs = array("Q", range(len(offsets) - 1))
+        self._next_seq = len(offsets) - 1
+        self._start = 0
+        # position -> text of the entries assigned to since
+        self._overlay: Dict[int, str] = {}
+        # hash of an entry -> sequence number of its most recent
+        # occurrence; hashes rather than the entries, which would take
+        # a str object each again
+        self._index: Optional[Dict[int, int]] = None
+        # hash -> how many more entries with it there are than one
+        self._extra: Dict[int, int] = {}
+        self._trim()
+
+    @property
+    def maxlen(self) -> Optional[int]:
+        return self._maxlen
+
+    @maxlen.setter
+    def maxlen(self, maxlen: Optional[int]):
+        self._maxlen = maxlen
+        self._trim()
+
+    def _text(self, p: int) -> str:
+        text = self._overlay.get(p)
+        if text is None:
+            text = _decode(self._blob[self._offsets[p] : self._offsets[p + 1]])
+        return text
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1 - self._start
+
+    def __iter__(self) -> Iterator[str]:
+        for p in range(self._start, len(self._offsets) - 1):
+            yield self._text(p)
+
+    def __reversed__(self) -> Iterator[str]:
+        for p in range(len(self._offsets) - 2, self._start - 1, -1):
+            yield self._text(p)
+
+    def __contains__(self, entry) -> bool:
+        return self._find(entry) is not None
+
+    def __eq__(self, other):
+        if isinstance(other, (CompactHistory, History, list)):
+            return len(self) == len(other) and all(
+                a == b for a, b in zip(self, other)
+            )
+        return NotImplemented
+
+    __hash__ = None  # type: ignore[assignment]
+
+    def __repr__(self):
+        return f"CompactHistory({list(self)!r}, maxlen={self._maxlen!r})"
+
+    def _pos(self, i: int) -> int:
+        n = len(self)
+        if i < 0:
+            i += n
+        if not 0 <= i < n:
+            raise IndexError("history index out of range")
+        return i + self._start
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self._text(self._start + j) for j in range(*i.indices(len(self)))]
+        return self._text(self._pos(i))
+
+    def __setitem__(self, i, entry):
+        if isinstance(i, slice):
+            entries = list(self)
+            entries[i] = entry
+            self._reset(entries)
+            return
+        p = self._pos(i)
+        self._unindex(p)
+        self._overlay[p] = entry
+        self._reindex(p)
+        if len(self._overlay) >= _COMPACT_THRESHOLD:
+            self._compact()
+
+    def __delitem__(self, i):
+        if isinstance(i, slice):
+            entries = list(self)
+            del entries[i]
+            self._reset(entries)
+            return
+        self._remove(self._pos(i))
+
+    def insert(self, i: int, entry: str):
+        if i >= len(self):
+            self.append(entry)
+            return
+        entries = list(self)
+        entries.insert(i, entry)
+        self._reset(entries)
+
+    def append(self, entry: str):
+        self.last_removed = None
+        end = len(self._offsets) - 1
+        if self.ignore_dups and len(self) and self._text(end - 1) == entry:
+            return
+        if self.erase_dups:
+            p = self._find_indexed(entry)
+            if p is not None:
+                self._remove(p)
+                self.last_removed = p - self._start
+        self._blob += _encode(entry)
+        self._offsets.append(len(self._blob))
+        self._seqs.append(self._next_seq)
+        self._next_seq += 1
+        self._reindex(len(self._seqs) - 1)
+        if self._trim():
+            self.last_removed = 0
+
+    def clear(self):
+        self._reset(())
+
+    def _find(self, entry: str) -> Optional[int]:
+        """Return the position of an occurrence of `entry', or None."""
+        overlay = self._overlay
+        for p, text in overlay.items():
+            if text == entry and p >= self._start:
+                return p
+        blob, offsets = self._blob, self._offsets
+        start, end = self._start, len(offsets) - 1
+        needle = _encode(entry)
+        at = blob.find(needle, offsets[start])
+        while at != -1:
+            # the entry starting there, if any; for the empty entry, the
+            # first of those starting there
+            if needle:
+                p = bisect_right(offsets, at, start, end) - 1
+            else:
+                p = bisect_left(offsets, at, start, end)
+            if (
+                p < end
+                and offsets[p] == at
+                and offsets[p + 1] == at + len(needle)
+                and p not in overlay
+            ):
+                return p
+            at = blob.find(needle, at + 1)
+        return None
+
+    def _find_indexed(self, entry: str) -> Optional[int]:
+        """Return the position of the most recent occurrence of
+        `entry', or None, looking it up in the index."""
+        index = self._index
+        if index is None:
+            index = self._build_index()
+        key = hash(entry)
+        seq = index.get(key)
+        if seq is None:
+            return None
+        p = bisect_left(self._seqs, seq, self._start)
+        if self._text(p) == entry:
+            return p
+        if key not in self._extra:
+            return None
+        # another entry with the same hash
+        return self._rfind(lambda q: self._text(q) == entry)
+
+    def _rfind(self, match: Callable[[int], bool], skip: int = -1) -> Optional[int]:
+        """Return the last position but `skip' that `match' is true of."""
+        for q in range(len(self._seqs) - 1, self._start - 1, -1):
+            if q != skip and match(q):
+                return q
+        return None
+
+    def _build_index(self) -> Dict[int, int]:
+        self._index = {}
+        self._extra = {}
+        for p in range(self._start, len(self._seqs)):
+            self._reindex(p)
+        return self._index
+
+    def _reindex(self, p: int):
+        """Add the entry at position p to the index."""
+        index = self._index
+        if index is None:
+            return
+        key = hash(self._text(p))
+        seq = index.get(key)
+        if seq is not None:
+            self._extra[key] = self._extra.get(key, 0) + 1
+        if seq is None or seq < self._seqs[p]:
+            index[key] = self._seqs[p]
+
+    def _unindex(self, p: int):
+        """Remove the entry at position p, which is about to be
+        overwritten or removed, from the index."""
+        index = self._index
+        if index is None:
+            return
+        key = hash(self._text(p))
+        extra = self._extra.get(key)
+        if extra is None:
+            del index[key]
+            return
+        if extra > 1:
+            self._extra[key] = extra - 1
+        else:
+            del self._extra[key]
+        if index[key] == self._seqs[p]:
+            # the most recent entry with the hash is now the one before
+            q = self._rfind(lambda q: hash(self._text(q)) == key, p)
+            index[key] = self._seqs[q]
+
+    def _remove(self, p: int):
+        self._unindex(p)
+        del self._seqs[p]
+        offsets = self._offsets
+        a, b = offsets[p], offsets[p + 1]
+        del self._blob[a:b]
+        following = offsets[p + 2 :]
+        del offsets[p + 1 :]
+        offsets.extend(map(operator.sub, following, repeat(b - a)))
+        if self._overlay:
+            self._overlay = {
+                q - (q > p): text for q, text in self._overlay.items() if q != p
+            }
+
+    def _trim(self) -> bool:
+        """Evict the oldest entries down to maxlen; return whether
+        anything was evicted."""
+        if self._maxlen is None or len(self) <= self._maxlen:
+            return False
+        while len(self) > self._maxlen:
+            self._unindex(self._start)
+            self._overlay.pop(self._start, None)
+            self._start += 1
+        if (
+            self._start >= _COMPACT_THRESHOLD
+            and 2 * self._start >= len(self._offsets) - 1
+        ):
+            self._compact()
+        return True
+
+    def _compact(self):
+        """Reclaim the space of the evicted entries, and fold the
+        overlay into the blob."""
+        if self._overlay:
+            self._reset(iter(self))
+            return
+        base = self._offsets[self._start]
+        del self._blob[:base]
+        self._offsets = array(
+            "Q", map(operator.sub, self._offsets[self._start :], repeat(base))
+        )
+        self._seqs = self._seqs[self._start :]
+        self._start = 0
+
+
+def _encode(entry: str) -> bytes:
+    # entries read with unicode_escape may contain lone surrogates
+    return entry.encode("utf-8", "surrogatepass")
+
+
+def _decode(data: bytes) -> str:
+    return data.decode("utf-8", "surrogatepass")
+
+
+class HistoryFile:
+    """A history file shared by several concurrently running sessions.
+
+    Instead of rewriting the whole file, every accepted entry is
+    appended to it under an exclusive fcntl lock.  tail() returns the
+    entries other sessions appended since we last looked; it only
+    stat()s the file unless it grew, and then reads just the new part.
+    If the file was replaced or rewritten (e.g. by a plain
+    write_history_file()), which is noticed from its inode, size and
+    the few bytes just before the point we had read up to, reading
+    resumes from its current end.
+
+    The on-disk format is the one of readline.write_history_file():
+    one entry per line, with the continuation lines of multiline
+    entries ending in \\r\\n.  Call read() first to load what is
+    already there.
+    """
+
+    def __init__(self, filename: str):
+        self.filename = os.path.abspath(os.path.expanduser(filename))
+        self._tailing = False
+        self._offset = 0
+        # the bytes just before _offset, to tell appends from rewrites
+        self._last = b""
+        self._stamp: Optional[Tuple[int, int, int]] = None
+        # entries of other sessions found while appending our own
+        self._pending: List[str] = []
+
+    def encode(self, entry: str) -> bytes:
+        return entry.replace("\n", "\r\n").encode("utf-8") + b"\n"
+
+    def decode(self, data: bytes) -> List[str]:
+        """Split `data', which ends on an entry boundary, into entries."""
+        entries = []
+        buffer = []
+        for line in data.decode("utf-8", "replace").split("\n")[:-1]:
+            if line.endswith("\r"):
+                buffer.append(line[:-1])
+            else:
+                buffer.append(line)
+                entry = "\n".join(buffer)
+                del buffer[:]
+                if entry:
+                    entries.append(entry)
+        return entries
+
+    def complete_length(self, data: bytes) -> int:
+        """Return the length of the longest prefix of `data' made of
+        whole entries."""
+        end = data.rfind(b"\n")
+        while end > 0 and data[end - 1 : end] == b"\r":
+            end = data.rfind(b"\n", 0, end - 1)
+        return end + 1
+
+    def read(self) -> List[str]:
+        """Return all the entries in the file and start tailing it."""
+        self._tailing = True
+        self._offset = 0
+        self._last = b""
+        self._stamp = None
+        self._pending = []
+        try:
+            fd = os.open(self.filename, os.O_RDONLY)
+        except FileNotFoundError:
+            return []
+        try:
+            _lock(fd, shared=True)
+            return self._read_new(fd, os.fstat(fd), final=True)
+        finally:
+            os.close(fd)
+
+    def tail(self) -> List[str]:
+        """Return the entries other sessions appended since the last
+        call to read(), tail() or append()."""
+        pending, self._pending = self._pending, []
+        try:
+            st = os.stat(self.filename)
+        except FileNotFoundError:
+            return pending
+        if self._unchanged(st):
+            return pending
+        try:
+            fd = os.open(self.filename, os.O_RDONLY)
+        except FileNotFoundError:
+            return pending
+        try:
+            _lock(fd, shared=True)
+            return pending + self._read_new(fd, os.fstat(fd))
+        finally:
+            os.close(fd)
+
+    def append(self, entry: str):
+        """Append `entry' to the file."""
+        fd = os.open(self.filename, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o600)
+        try:
+            _lock(fd, shared=False)
+            st = os.fstat(fd)
+            if not self._tailing:
+                # never read: only what comes after us is of interest
+                self._tailing = True
+                self._mark_read(fd, st.st_size)
+            # pick up whatever was written since we last looked, so that
+            # our own entry isn't read back later
+            self._pending.extend(self._read_new(fd, st, final=True))
+            data = self.encode(entry)
+            if st.st_size and os.pread(fd, 1, st.st_size - 1) != b"\n":
+                data = b"\n" + data
+            os.write(fd, data)
+            st = os.fstat(fd)
+            self._mark_read(fd, st.st_size)
+            self._stamp = _stamp(st)
+        finally:
+            os.close(fd)
+
+    def _unchanged(self, st: os.stat_result) -> bool:
+        return _stamp(st) == self._stamp and st.st_size == self._offset
+
+    def _read_new(
+        self, fd: int, st: os.stat_result, final: bool = False
+    ) -> List[str]:
+        """Read what was appended since the last time.  Unless `final',
+        an incomplete entry at the end is left for the next time (its
+        writer may not be done with it)."""
+        if self._stamp is not None and (
+            _stamp(st)[:2] != self._stamp[:2]
+            or st.st_size < self._offset
+            or os.pread(fd, len(self._last), self._offset - len(self._last))
+            != self._last
+        ):
+            # replaced or rewritten: we can't tell what is new in there
+            self._mark_read(fd, st.st_size)
+        entries = []
+        if st.st_size > self._offset:
+            data = os.pread(fd, st.st_size - self._offset, self._offset)
+            n = len(data) if final else self.complete_length(data)
+            chunk = data[:n]
+            if chunk and not chunk.endswith(b"\n"):
+                chunk += b"\n"
+            entries = self.decode(chunk)
+            self._mark_read(fd, self._offset + n)
+        self._stamp = _stamp(st)
+        return entries
+
+    def _mark_read(self, fd: int, offset: int):
+        self._offset = offset
+        n = min(offset, 64)
+        self._last = os.pread(fd, n, offset - n)
+
+
+def _stamp(st: os.stat_result) -> Tuple[int, int, int]:
+    return st.st_dev, st.st_ino, st.st_mtime_ns
+
+
+def _lock(fd: int, shared: bool):
+    # released when fd is closed
+    if fcntl is not None:
+        fcntl.lockf(fd, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
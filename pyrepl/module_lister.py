@@ -17,49 +17,393 @@
 # CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF OR IN
 # CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
 
+"""An index of the importable modules, for completing import lines.
+
+Building it means listing every directory (and zip file) on sys.path
+and in the packages found there, which can take seconds with a lot of
+packages installed, so start_indexing() does it on a background thread
+at startup.  What was found in each sys.path entry is saved to a cache
+file along with the modification times of the directories listed, and
+reused by later sessions for as long as those are unchanged and the
+entry is still on sys.path.
+
+module_exports() lists the names a module defines without importing it.
+"""
+
+import ast
+import glob
+import importlib.machinery
+import importlib.util
+import json
 import os
+import pkgutil
 import sys
+import threading
+import time
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from pyrepl.fuzzy import FuzzyMatcher
+from pyrepl.trace import trace
+
+_CACHE_VERSION = 1
+# seconds after which the temporary file of a save is left over from a
+# session that exited while saving
+_STALE_TMP_AGE = 60
+
+# an entry of the cache: the modification time of every directory that
+# was listed, and the dotted names of the modules found, with whether
+# they are packages
+CacheEntry = Dict[str, list]
+
+
+def cache_file(kind: str) -> str:
+    """Return the name of the cache file for `kind' of data about the
+    modules of this Python."""
+    cache_dir = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    tag = sys.implementation.cache_tag or "python"
+    return os.path.join(cache_dir, "pyrepl", f"{kind}.{tag}.json")
+
+
+def default_cache_file() -> str:
+    return cache_file("modules")
+
+
+def load_cache(filename: str) -> Dict[str, dict]:
+    """Return the entries of the cache file `filename', if it exists
+    and is in the current format."""
+    try:
+        with open(filename, encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(data, dict) or data.get("version") != _CACHE_VERSION:
+        return {}
+    return data["entries"]
+
+
+def save_cache(filename: str, entries: Dict[str, dict]):
+    data = {"version": _CACHE_VERSION, "entries": entries}
+    # other sessions may be reading it: replace it in one go
+    tmp = f"{filename}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        _remove_stale_tmp(filename)
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp, filename)
+    except OSError as e:
+        trace("can't write cache {}: {!r}", filename, e)
+
+
+def _remove_stale_tmp(filename: str):
+    """Remove the temporary files of the saves of `filename' that
+    never got to replace it: they are saved on daemon threads, which
+    are killed at exit."""
+    now = time.time()
+    for tmp in glob.glob(glob.escape(filename) + ".*.tmp"):
+        try:
+            if now - os.stat(tmp).st_mtime > _STALE_TMP_AGE:
+                os.remove(tmp)
+        except OSError:
+            pass
+
+
+def _mtime(path: str) -> int:
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return -1
+
+
+def _namespace_packages(path: str, found: Iterable[str]) -> List[str]:
+    """Return the directories in `path' that are not regular packages
+    but directly contain modules, i.e. namespace packages."""
+    names = []
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                if (
+                    entry.name in found
+                    or not entry.name.isidentifier()
+                    or entry.name == "__pycache__"
+                    or not entry.is_dir()
+                ):
+                    continue
+                if any(True for _ in pkgutil.iter_modules([entry.path])):
+                    names.append(entry.name)
+    except OSError:
+        pass
+    return names
+
+
+def _scan(entry: str) -> CacheEntry:
+    """Find the modules in the sys.path entry `entry'."""
+    stamps: Dict[str, int] = {entry: _mtime(entry)}
+    modules: List[Tuple[str, bool]] = []
+    seen = set()
+
+    def walk(path: str, prefix: str):
+        isdir = os.path.isdir(path)
+        if isdir:
+            real = os.path.realpath(path)
+            if real in seen:
+                return
+            seen.add(real)
+            stamps[path] = _mtime(path)
+        # finds regular modules and packages, in directories as well as
+        # in zip files
+        infos = list(pkgutil.iter_modules([path], prefix))
+        packages = [info.name for info in infos if info.ispkg]
+        modules.extend((info.name, info.ispkg) for info in infos)
+        if isdir:
+            found = {info.name[len(prefix) :] for info in infos}
+            for name in _namespace_packages(path, found):
+                modules.append((prefix + name, True))
+                packages.append(prefix + name)
+        for name in packages:
+            walk(os.path.join(path, name.rpartition(".")[2]), name + ".")
+
+    walk(entry, "")
+    return {"stamps": stamps, "modules": modules}
+
 
-# for the completion support.
-# this is all quite nastily written.
-_packages = {}
-
-
-def _make_module_list_dir(dir, suffs, prefix=""):
-    l = []
-    for fname in os.listdir(dir):
-        file = os.path.join(dir, fname)
-        if os.path.isfile(file):
-            for suff in suffs:
-                if fname.endswith(suff):
-                    l.append(prefix + fname[: -len(suff)])
-                    break
-        elif os.path.isdir(file) and os.path.exists(os.path.join(file, "__init__.py")):
-            l.append(prefix + fname)
-            _packages[prefix + fname] = _make_module_list_dir(
-                file, suffs, prefix + fname + "."
+def _fresh(cached: CacheEntry) -> bool:
+    return all(_mtime(path) == mtime for path, mtime in cached["stamps"].items())
+
+
+class ModuleIndex:
+    """The modules importable from the directories and zip files in
+    `path' (by default, sys.path as it is when the index is built).
+
+    packages maps "" to the top-level modules and every package to its
+    submodules, all by their full dotted names.  It is filled in a path
+    entry at a time while the index is built, and complete once it is
+    ready.
+    """
+
+    def __init__(
+        self, path: Optional[List[str]] = None, cache_file: Optional[str] = None
+    ):
+        self.path = path
+        self.cache_file = cache_file
+        self.packages: Dict[str, List[str]] = {}
+        self._ready = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._matcher = FuzzyMatcher()
+
+    @property
+    def ready(self) -> bool:
+        return self._ready.is_set()
+
+    def start(self):
+        """Build the index on a background thread."""
+        if self._thread is None and not self.ready:
+            self._thread = threading.Thread(
+                target=self.build, name="pyrepl-module-index", daemon=True
             )
-    return sorted(set(l))
+            self._thread.start()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Wait up to `timeout' seconds for the index to be ready,
+        starting to build it if it wasn't; return whether it is
+        ready."""
+        self.start()
+        return self._ready.wait(timeout)
+
+    def build(self):
+        packages = {"": set(sys.builtin_module_names)}
+        try:
+            for cached in self._entries():
+                for name, ispkg in cached["modules"]:
+                    packages.setdefault(name.rpartition(".")[0], set()).add(name)
+                    if ispkg:
+                        packages.setdefault(name, set())
+                # what there is so far, for completions that can't wait
+                self.packages = {
+                    name: sorted(mods) for name, mods in packages.items()
+                }
+        except Exception as e:
+            # completion just doesn't know about what we failed to index
+            trace("module index failed: {!r}", e)
+        self.packages = {name: sorted(mods) for name, mods in packages.items()}
+        self._ready.set()
+
+    def _entries(self) -> Iterator[CacheEntry]:
+        """Yield the cache entry of each entry of the path, scanning it
+        if needed."""
+        cache = self._load_cache()
+        entries = {}
+        changed = False
+        path = sys.path if self.path is None else self.path
+        for entry in path:
+            entry = os.path.abspath(entry or ".")
+            if entry in entries:
+                continue
+            cached = cache.get(entry)
+            if cached is None or not _fresh(cached):
+                cached = _scan(entry)
+                changed = True
+            entries[entry] = cached
+            yield cached
+        if changed or cache.keys() != entries.keys():
+            # only the entries of the path: those of entries that
+            # aren't on it any more would pile up
+            self._save_cache(entries)
+
+    def _load_cache(self) -> Dict[str, CacheEntry]:
+        if self.cache_file is None:
+            return {}
+        return load_cache(self.cache_file)
+
+    def _save_cache(self, entries: Dict[str, CacheEntry]):
+        if self.cache_file is not None:
+            save_cache(self.cache_file, entries)
+
+    def find_modules(
+        self, stem: str, fuzzy: bool = False, timeout: Optional[float] = None
+    ) -> List[str]:
+        """Return the full names of the modules starting with `stem'
+        in the package `stem' is in, or if `fuzzy' the ones whose last
+        component the last component of `stem' fuzzily matches, best
+        first.  If the index isn't ready within `timeout' seconds, only
+        those indexed so far."""
+        ready = self.wait(timeout)
+        pack, dot, name = stem.rpartition(".")
+        try:
+            mods = self.packages[pack]
+        except KeyError as exc:
+            if not ready:
+                return []
+            raise ImportError(f'can\'t find "{pack}" package') from exc
+        if fuzzy and name:
+            # all of mods start with pack + dot, so this is sorted too
+            names = [mod[len(pack + dot) :] for mod in mods]
+            return [pack + dot + n for n in self._matcher.match(names, name)]
+        return [mod for mod in mods if mod.startswith(stem)]
+
+
+_index: Optional[ModuleIndex] = None
 
 
-def _make_module_list():
-    import imp
+def get_index() -> ModuleIndex:
+    global _index
+    if _index is None:
+        _index = ModuleIndex(cache_file=default_cache_file())
+    return _index
 
-    suffs = [x[0] for x in imp.get_suffixes() if x[0] != ".pyc"]
-    suffs.sort(reverse=True)
-    _packages[""] = list(sys.builtin_module_names)
-    for dir in sys.path:
-        if dir == "":
-            dir = "."
-        if os.path.isdir(dir):
-            _packages[""] += _make_module_list_dir(dir, suffs)
-    _packages[""].sort()
 
+def start_indexing():
+    """Start building the module index in the background."""
+    get_index().start()
 
-def find_modules(stem):
-    pack = ".".join(stem.split(".")[:-1])
+
+def find_modules(
+    stem: str, fuzzy: bool = False, timeout: Optional[float] = None
+) -> List[str]:
+    return get_index().find_modules(stem, fuzzy, timeout)
+
+
+# module name -> (origin, mtime, names)
+_exports: Dict[str, Tuple[str, int, List[str]]] = {}
+
+
+def find_spec(name: str):
+    """Like importlib.util.find_spec(), but without importing the
+    parent packages."""
+    spec = None
+    path = None
+    for part in name.split("."):
+        if spec is not None:
+            path = spec.submodule_search_locations
+            if path is None:
+                return None
+        if path is None:
+            spec = importlib.util.find_spec(part)
+        else:
+            spec = importlib.machinery.PathFinder.find_spec(part, list(path))
+        if spec is None:
+            return None
+    return spec
+
+
+def _defined_names(body: List[ast.stmt], names: Set[str]):
+    for node in body:
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            names.add(node.name)
+        elif isinstance(node, (ast.Assign, ast.AnnAssign, ast.AugAssign)):
+            targets = node.targets if isinstance(node, ast.Assign) else [node.target]
+            for target in targets:
+                for n in ast.walk(target):
+                    if isinstance(n, ast.Name):
+                        names.add(n.id)
+            value_names = _all_names(node)
+            if value_names is not None:
+                names.update(value_names)
+        elif isinstance(node, (ast.Import, ast.ImportFrom)):
+            for alias in node.names:
+                if alias.name != "*":
+                    names.add(alias.asname or alias.name.partition(".")[0])
+        # definitions are often made conditionally
+        elif isinstance(node, ast.If):
+            _defined_names(node.body, names)
+            _defined_names(node.orelse, names)
+        elif isinstance(node, ast.Try):
+            _defined_names(node.body, names)
+            for handler in node.handlers:
+                _defined_names(handler.body, names)
+            _defined_names(node.orelse, names)
+            _defined_names(node.finalbody, names)
+        elif isinstance(node, ast.With):
+            _defined_names(node.body, names)
+
+
+def _all_names(node: ast.stmt) -> Optional[List[str]]:
+    """Return the names `node' puts in __all__ if it is a literal
+    assignment (or addition) to it."""
+    targets = node.targets if isinstance(node, ast.Assign) else [node.target]
+    if not any(isinstance(t, ast.Name) and t.id == "__all__" for t in targets):
+        return None
+    if not isinstance(node.value, (ast.List, ast.Tuple)):
+        return None
+    return [
+        elt.value
+        for elt in node.value.elts
+        if isinstance(elt, ast.Constant) and isinstance(elt.value, str)
+    ]
+
+
+def module_exports(name: str) -> List[str]:
+    """Return the sorted names defined by the module `name', without
+    importing it.
+
+    Modules already imported are inspected with dir(); otherwise the
+    top-level definitions and __all__ are read from the source, and
+    remembered until it changes.  Extension modules, whose names can't
+    be known without importing them, have none.
+    """
+    module = sys.modules.get(name)
+    if module is not None:
+        return sorted(dir(module))
+    try:
+        spec = find_spec(name)
+    except (ImportError, ValueError):
+        return []
+    if spec is None or spec.origin is None or spec.loader is None:
+        return []
+    cached = _exports.get(name)
+    try:
+        mtime = os.stat(spec.origin).st_mtime_ns
+    except OSError:
+        mtime = -1  # e.g. in a zip file
+    if cached is not None and cached[:2] == (spec.origin, mtime):
+        return cached[2]
+    names: Set[str] = set()
     try:
-        mods = _packages[pack]
-    except KeyError as exc:
-        raise ImportError(f'can\'t find "{pack}" package') from exc
-    return [mod for mod in mods if mod.startswith(stem)]
+        source = spec.loader.get_source(spec.name)  # type: ignore[union-attr]
+        if source is not None:
+            _defined_names(ast.parse(source).body, names)
+    except (AttributeError, ImportError, SyntaxError, ValueError) as e:
+        trace("can't read the names in {}: {!r}", name, e)
+    exports = sorted(names)
+    _exports[name] = spec.origin, mtime, exports
+    return exports
@@ -0,0 +1,166 @@
+"""Completion of filesystem paths, inside string literals.
+
+Listing a directory with a hundred thousand entries, as data
+directories on network filesystems have, takes seconds, so listings
+are kept in a DirectoryCache and only redone when the modification
+time of the directory changes.  They are also read a batch at a time:
+complete_path() yields the matches of each batch as it goes, so the
+menu fills in while a huge directory is listed.  The directory is
+only kept open while completing: a listing that was interrupted keeps
+the entries it read, and the next completion lists the directory
+again from the start, only adding the entries it doesn't have yet.
+"""
+
+import os
+import threading
+from bisect import bisect_left
+from collections import OrderedDict
+from typing import Iterator, List, Optional, Set
+
+# how many entries to read at a time
+BATCH_SIZE = 4096
+
+
+class Listing:
+    """The entries of the directory `path' read so far."""
+
+    def __init__(self, path: str, mtime: int):
+        self.path = path
+        self.mtime = mtime
+        # in the order the directory lists them
+        self.names: List[str] = []
+        self.dirs: Set[str] = set()
+        self.complete = False
+        self._it = None
+        # the names read before the directory was closed, to skip when
+        # reading on
+        self._skip: Set[str] = set()
+        self._sorted: List[str] = []
+
+    def read(self, n: Optional[int] = None) -> bool:
+        """Read up to `n' (by default BATCH_SIZE) more entries; return
+        whether all are read."""
+        if self.complete:
+            return True
+        if n is None:
+            n = BATCH_SIZE
+        try:
+            if self._it is None:
+                self._it = os.scandir(self.path)
+                self._skip = set(self.names)
+            while n > 0:
+                entry = next(self._it, None)
+                if entry is None:
+                    self.close()
+                    self.complete = True
+                    break
+                if entry.name in self._skip:
+                    continue
+                n -= 1
+                self.names.append(entry.name)
+                try:
+                    if entry.is_dir():
+                        self.dirs.add(entry.name)
+                except OSError:
+                    pass
+        except OSError:
+            # gone, or not a directory: no more entries
+            self.close()
+            self.complete = True
+        return self.complete
+
+    def sorted_names(self) -> List[str]:
+        if len(self._sorted) != len(self.names):
+            self._sorted = sorted(self.names)
+        return self._sorted
+
+    def close(self):
+        """Close the directory; reading more entries reopens it."""
+        if self._it is not None:
+            self._it.close()
+            self._it = None
+            self._skip = set()
+
+
+class DirectoryCache:
+    """The listings of the `size' directories completed in last."""
+
+    def __init__(self, size: int = 64):
+        self.size = size
+        # held while reading listings, which completions may do from
+        # several threads at a time
+        self.lock = threading.RLock()
+        self._listings: OrderedDict[str, Listing] = OrderedDict()
+
+    def listing(self, path: str) -> Optional[Listing]:
+        """Return the listing of the directory `path', which may not be
+        read yet, or None if it can't be listed."""
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        with self.lock:
+            listing = self._listings.get(path)
+            if listing is not None and listing.mtime == st.st_mtime_ns:
+                self._listings.move_to_end(path)
+                return listing
+            if listing is not None:
+                listing.close()
+            listing = self._listings[path] = Listing(path, st.st_mtime_ns)
+            if len(self._listings) > self.size:
+                self._listings.popitem(last=False)[1].close()
+            return listing
+
+    def clear(self):
+        with self.lock:
+            for listing in self._listings.values():
+                listing.close()
+            self._listings.clear()
+
+
+_cache = DirectoryCache()
+
+
+def _matches(names: List[str], tail: str) -> List[str]:
+    """Return the names of the sorted `names' starting with `tail',
+    hidden ones only if `tail' starts with a dot."""
+    lo = bisect_left(names, tail)
+    hi = bisect_left(names, tail + "\U0010ffff", lo)
+    if tail.startswith("."):
+        return names[lo:hi]
+    return [name for name in names[lo:hi] if not name.startswith(".")]
+
+
+def complete_path(
+    stem: str, cache: Optional[DirectoryCache] = None
+) -> Iterator[List[str]]:
+    """Yield the paths starting with `stem', a batch at a time; those
+    of directories end with a slash."""
+    if cache is None:
+        cache = _cache
+    head, tail = os.path.split(stem)
+    listing = cache.listing(os.path.expanduser(head) or os.curdir)
+    if listing is None:
+        return
+    seen = 0
+    try:
+        while True:
+            with cache.lock:
+                complete = listing.read()
+                if complete and not seen:
+                    # all there already
+                    names = _matches(listing.sorted_names(), tail)
+                else:
+                    names = _matches(sorted(listing.names[seen:]), tail)
+                seen = len(listing.names)
+                dirs = listing.dirs
+            yield [
+                os.path.join(head, name) + (os.sep if name in dirs else "")
+                for name in names
+            ]
+            if complete:
+                return
+    finally:
+        # abandoned: don't hold on to the directory until the next time
+        with cache.lock:
+            listing.close()
@@ -28,13 +28,19 @@ import contextlib
 import os
 import re
 import sys
+import threading
+import time
 import traceback
 import warnings
-from importlib import import_module
+from typing import List, Optional
 
 from pyrepl import commands, completer, completing_reader, module_lister, reader
+from pyrepl.completeness import StatementChecker
 from pyrepl.completing_reader import CompletingReader
+from pyrepl.highlight import Highlighter
 from pyrepl.historical_reader import HistoricalReader
+from pyrepl.history import HistoryFile
+from pyrepl.path_completer import complete_path
 
 try:
     import twisted
@@ -61,22 +67,73 @@ class maybe_accept(commands.Command):
     def do(self):
         r = self.reader
         text = r.get_str()
-        try:
-            # ooh, look at the hack:
-            code = r.compiler(text)
-        except (OverflowError, SyntaxError, ValueError):
-            self.finish = 1
+        # only compiled once it looks complete
+        if r.statement_checker.more_lines(text, r.compiler):
+            r.insert("\n")
         else:
-            if code is None:
-                r.insert("\n")
-            else:
-                self.finish = 1
+            self.finish = 1
 
 
 from_line_prog = re.compile(
     r"^from\s+(?P<mod>[A-Za-z_.0-9]*)\s+import\s+(?P<name>[A-Za-z_.0-9]*)"
 )
 import_line_prog = re.compile(r"^(?:import|from)\s+(?P<mod>[A-Za-z_.0-9]*)\s*$")
+# names and dotted names
+history_word_prog = re.compile(r"[A-Za-z_]\w*(?:\.[A-Za-z_]\w*)*")
+
+
+string_prefix_prog = re.compile(r"(?<!\w)[bBfFrRuU]{1,2}\Z")
+# a name, or what comes before one of its attributes
+name_prog = re.compile(r"[^\W\d][\w.]*")
+
+
+def open_string(text: str) -> Optional[int]:
+    """Return where the contents of the string literal still open at
+    the end of the source `text' start, if there is one, and the end
+    isn't in a replacement field of it, which is code."""
+    i, n = 0, len(text)
+    while i < n:
+        c = text[i]
+        if c == "#":
+            i = text.find("\n", i)
+            if i < 0:
+                return None
+        elif c in "'\"":
+            m = string_prefix_prog.search(text, 0, i)
+            formatted = m is not None and "f" in m.group().lower()
+            quote = c * 3 if text.startswith(c * 3, i) else c
+            i += len(quote)
+            start = i
+            while not text.startswith(quote, i):
+                if i >= n:
+                    if formatted and in_replacement_field(text[start:]):
+                        return None
+                    return start
+                if text[i] == "\\":
+                    i += 1
+                elif text[i] == "\n" and len(quote) == 1:
+                    break  # not terminated, but not open either
+                i += 1
+            i += len(quote) - 1
+        i += 1
+    return None
+
+
+def in_replacement_field(text: str) -> bool:
+    """Return whether the end of the contents `text' of an f-string is
+    in a replacement field."""
+    depth = 0
+    i, n = 0, len(text)
+    while i < n:
+        if not depth and text.startswith(("{{", "}}"), i):
+            i += 2  # escaped
+            continue
+        if text[i] == "{":
+            depth += 1
+        elif text[i] == "}" and depth:
+            depth -= 1
+        i += 1
+    return depth > 0
 
 
 def saver(reader=reader):
@@ -90,16 +147,49 @@ def saver(reader=reader):
         pass
 
 
+class PythoniHistoryFile(HistoryFile):
+    """The format of ~/.pythoni.hist: one unicode_escape'd entry per
+    line."""
+
+    def encode(self, entry):
+        return entry.encode("unicode_escape") + b"\n"
+
+    def decode(self, data):
+        return [
+            line.decode("unicode_escape") for line in data.split(b"\n")[:-1] if line
+        ]
+
+    def complete_length(self, data):
+        return data.rfind(b"\n") + 1
+
+
 class PythonicReader(CompletingReader, HistoricalReader):
+    # completing evaluates user code (e.g. __getattr__ hooks), which
+    # shouldn't be able to hang the editor
+    completion_deadline = 0.1
+    # colour the input (see pyrepl.highlight); e.g. set
+    # Reader.syntax_highlighting = True in $PYREPLSTARTUP
+    syntax_highlighting = False
+
     def collect_keymap(self):
         return super().collect_keymap() + (
             (r"\n", "maybe-accept"),
             (r"\M-\n", "insert-nl"),
         )
 
-    def __init__(self, console, locals, compiler=None):
+    def __init__(
+        self,
+        console,
+        locals,
+        compiler=None,
+        shared_history=False,
+        history_database=None,
+    ):
         super().__init__(console)
-        self.completer = completer.Completer(locals)
+        self.completer = completer.Completer(
+            locals,
+            attribute_cache=completer.ModuleAttributeCache(),
+        )
         st = self.syntax_table
         for c in "._0123456789":
             st[c] = reader.SYNTAX_WORD
@@ -108,45 +198,157 @@ class PythonicReader(CompletingReader, HistoricalReader):
             self.compiler = CommandCompiler()
         else:
             self.compiler = compiler
-
-        try:
-            with open(os.path.expanduser("~/.pythoni.hist"), "rb") as fh:
-                lines = fh.readlines()
-            self.history = [line.rstrip(b"\n").decode() for line in lines]
-        except FileNotFoundError:
-            self.history = []
+        self.statement_checker = StatementChecker()
+        self.highlighter = Highlighter()
+
+        if history_database is not None:
+            from pyrepl.sqlite_history import SQLiteHistory
+
+            self.history = SQLiteHistory(history_database)
+        elif shared_history:
+            # entries are appended as they are accepted, so there's
+            # nothing to save at exit
+            self.history_file = PythoniHistoryFile("~/.pythoni.hist")
+            self.history.extend(self.history_file.read())
+        else:
+            with contextlib.suppress(FileNotFoundError):
+                with open(os.path.expanduser("~/.pythoni.hist"), "rb") as fh:
+                    lines = fh.readlines()
+                self.history.extend(line.rstrip(b"\n").decode() for line in lines)
+            atexit.register(lambda: saver(self))
         self.historyi = len(self.history)
+        # how many entries were appended to the history; the length of
+        # a bounded one stops telling
+        self._history_appends = 0
+        # the words used in the history, as of the first
+        # _history_scanned appends (None: not scanned yet)
+        self._history_words: List[str] = []
+        self._history_scanned: Optional[int] = None
+        self._history_lock = threading.Lock()
 
-        atexit.register(lambda: saver(self))
         for c in [maybe_accept]:
             self.commands[c.__name__] = c
             self.commands[c.__name__.replace("_", "-")] = c
 
+    def append_history(self, entry: str):
+        super().append_history(entry)
+        self._history_appends += 1
+
+    def get_colors(self, lines):
+        if not self.syntax_highlighting:
+            return None
+        return self.highlighter.colors(lines)
+
+    def get_stem(self):
+        start = self.string_start()
+        if start is not None:
+            # a path
+            return "".join(self.buffer[start : self.pos])
+        return super().get_stem()
+
+    def string_start(self) -> Optional[int]:
+        """Return where the contents of the string literal the cursor
+        is in start, if it is in one."""
+        return open_string("".join(self.buffer[: self.pos]))
+
+    def get_completion_context(self, stem):
+        if self.string_start() is not None:
+            # paths: the directory cache knows when they change
+            return None
+        return super().get_completion_context(stem)
+
+    def get_completion_sources(self, stem):
+        if self.string_start() is not None:
+            return [self.path_completions]
+        b = self.get_str()
+        if import_line_prog.match(b) or from_line_prog.match(b):
+            return [self.module_completions]
+        return [self.get_completions, self.history_completions]
+
+    def path_completions(self, stem):
+        """Yield the paths `stem' completes to, a batch at a time, or
+        if there are none and it is a name, the names it does."""
+        found = False
+        paths = complete_path(stem)
+        try:
+            for batch in paths:
+                found = found or bool(batch)
+                yield batch
+        finally:
+            paths.close()
+        if not found and name_prog.fullmatch(stem):
+            yield self.get_completions(stem)
+
+    def module_completions(self, stem):
+        """Yield the completions of an import line the module index has
+        so far and, when completing in the background, the others once
+        it is ready."""
+        yield self.get_completions(stem)
+        index = module_lister.get_index()
+        if not index.ready and self.completes_in_background():
+            index.wait()
+            yield self.get_completions(stem)
+
+    def history_completions(self, stem: str) -> List[str]:
+        """Return the names used in the history that `stem' matches;
+        dotted ones only if it is dotted."""
+        with self._history_lock:
+            appends = self._history_appends
+            if self._history_scanned is None:
+                entries = list(self.history)
+            else:
+                n = min(appends - self._history_scanned, len(self.history))
+                # a single read, which matters when history is not an
+                # in-memory list
+                entries = self.history[len(self.history) - n :] if n else []
+            if entries:
+                words = set(self._history_words)
+                for entry in entries:
+                    for word in history_word_prog.findall(entry):
+                        words.add(word)
+                        words.add(word.partition(".")[0])
+                self._history_words = sorted(words)
+            self._history_scanned = appends
+            words = self._history_words
+        dotted = "." in stem
+        self.completer.fuzzy = self.fuzzy_completion
+        return [
+            word
+            for word in self.completer.matching(words, stem)
+            if ("." in word) == dotted
+        ]
+
     def get_completions(self, stem):
+        # fuzzy_completion may have been set since the completer was
+        # made, e.g. by $PYREPLSTARTUP
+        self.completer.fuzzy = self.fuzzy_completion
         b = self.get_str()
         m = import_line_prog.match(b)
         if m:
-            if not self._module_list_ready:
-                module_lister._make_module_list()
-                self._module_list_ready = True
-
             mod = m.group("mod")
             try:
-                return module_lister.find_modules(mod)
+                return module_lister.find_modules(
+                    mod, self.fuzzy_completion, self.completion_deadline
+                )
             except ImportError:
                 pass
         m = from_line_prog.match(b)
         if m:
             mod, name = m.group("mod", "name")
-            try:
-                l = module_lister._packages[mod]
-            except KeyError:
-                with contextlib.suppress(ImportError):
-                    mod = import_module(mod)
-                    return [x for x in dir(mod) if x.startswith(name)]
-            else:
-                return [x[len(mod) + 1 :] for x in l if x.startswith(f"{mod}.{name}")]
+            # the submodules of a package, and what the module defines;
+            # both found without importing anything
+            index = module_lister.get_index()
+            index.wait(self.completion_deadline)
+            names = set(module_lister.module_exports(mod))
+            if mod not in sys.modules and self.completer.attribute_cache is not None:
+                # e.g. the names of star imports, if it was completed on
+                names.update(self.completer.attribute_cache.lookup(mod) or ())
+            names.update(x[len(mod) + 1 :] for x in index.packages.get(mod, ()))
+            return self.completer.matching(sorted(names), name)
         try:
+            if self.fuzzy_completion:
+                # keep the ranking
+                return list(dict.fromkeys(self.completer.complete(stem)))
             return sorted(set(self.completer.complete(stem)))
         except (NameError, AttributeError):
             return []
@@ -155,13 +357,22 @@ class PythonicReader(CompletingReader, HistoricalReader):
 class ReaderConsole(code.InteractiveInterpreter):
     II_init = code.InteractiveInterpreter.__init__
 
-    def __init__(self, console, locals=None):
+    def __init__(
+        self, console, locals=None, shared_history=False, history_database=None
+    ):
         if locals is None:
             locals = {}
         self.II_init(locals)
         self.compiler = CommandCompiler()
         self.compile = self.compiler.compiler
-        self.reader = PythonicReader(console, locals, self.compiler)
+        self.reader = PythonicReader(
+            console,
+            locals,
+            self.compiler,
+            shared_history=shared_history,
+            history_database=history_database,
+        )
+        self.failed = False
         locals["Reader"] = self.reader
 
     def run_user_init_file(self):
@@ -178,16 +389,28 @@ class ReaderConsole(code.InteractiveInterpreter):
             etype, value, tb = sys.exc_info()
             traceback.print_exception(etype, value, tb.tb_next)
 
+    def showtraceback(self):
+        self.failed = True
+        super().showtraceback()
+
     def execute(self, text):
+        start = time.monotonic()
+        self.failed = False
         try:
             # ooh, look at the hack:
             code = self.compile(text, "<stdin>", "single")
         except (OverflowError, SyntaxError, ValueError):
+            self.failed = True
             self.showsyntaxerror("<stdin>")
         else:
             self.runcode(code)
             if sys.stdout and not sys.stdout.closed:
                 sys.stdout.flush()
+        self.reader.invalidate_completions()
+        # recorded by history stores that keep track of it
+        set_outcome = getattr(self.reader.history, "set_outcome", None)
+        if set_outcome is not None:
+            set_outcome(time.monotonic() - start, not self.failed)
 
     def interact(self):
         while True:
@@ -356,7 +579,18 @@ def main(
     interactmethod=default_interactmethod,
     print_banner=True,
     clear_main=True,
+    shared_history=None,
+    history_database=None,
 ):
+    """Run the pyrepl top-level.  With shared_history (by default: if
+    $PYREPL_SHARED_HISTORY is set) the history is shared with the other
+    sessions running at the same time instead of being saved at exit.
+    history_database (by default: $PYREPL_HISTORY_DB) names an SQLite
+    database to keep the history in instead."""
+    if shared_history is None:
+        shared_history = bool(os.environ.get("PYREPL_SHARED_HISTORY"))
+    if history_database is None:
+        history_database = os.environ.get("PYREPL_HISTORY_DB") or None
     si, se, so = sys.stdin, sys.stderr, sys.stdout
     try:
         from pyrepl.unix_console import UnixConsole
@@ -369,9 +603,12 @@ def main(
                 "for more information."
             )
 
-        rc = ReaderConsole(con)
-        rc.reader._module_list_ready = False
+        rc = ReaderConsole(
+            con, shared_history=shared_history, history_database=history_database
+        )
         rc.run_user_init_file()
+        # after the init file, which may well change sys.path
+        module_lister.start_indexing()
         getattr(rc, interactmethod)()
     finally:
         sys.stdin, sys.stderr, sys.stdout = si, se, so
@@ -20,10 +20,11 @@
 # CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
 
 
-import unicodedata
+from functools import partial
 from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Tuple, Union
 
 from pyrepl import commands, input
+from pyrepl.widths import disp_cells
 
 if TYPE_CHECKING:
     from .console import Console
@@ -34,50 +35,105 @@ def disp_str(buffer: List[str]) -> Tuple[str, List[int]]:
     """disp_str(buffer:string) -> (string, [int])
 
     Return the string that should be the printed represenation of
-    |buffer| and a list detailing where the characters of |buffer|
-    get used up.  E.g.:
+    |buffer| and a list detailing how many characters of |buffer|
+    start in each cell of the screen it takes up.  E.g.:
 
     >>> disp_str(chr(3))
     ('^C', [1, 0])
 
-    the list always contains 0s or 1s at present; it could conceivably
-    go higher as and when unicode support happens."""
-
-    def _make_unctrl_map() -> Dict[str, str]:
-        uc_map: Dict[str, str] = {}
-        for c in map(chr, range(256)):
-            if unicodedata.category(c)[0] != "C":
-                uc_map[c] = c
-        for i in range(32):
-            c = chr(i)
-            uc_map[c] = f"^{chr(ord('A')+i -1)}"
-        uc_map["\t"] = "    "  # display TABs as 4 characters
-        uc_map["\177"] = "^?"
-        for i in range(256):
-            c = chr(i)
-            if c not in uc_map:
-                uc_map[c] = f"\\{i:03o}"
-        return uc_map
-
-    def mapper(c):
-        u = _make_unctrl_map()
-
-        if c in u:
-            return u[c]
-
-        if unicodedata.category(c).startswith("C"):
-            return rf"\u{ord(c):04x}".encode()
-
-        return c
-
-    # disp_str proved to be a bottleneck for large inputs,
-    # so it needs to be rewritten in C; it's not required though.
-    s = [mapper(x) for x in buffer]
-    b = []  # XXX: bytearray
-    for x in s:
-        b.append(1)
-        b.extend([0] * (len(x) - 1))
-    return "".join(s), b
+    Wide characters take up two cells, and combining characters none:
+    see pyrepl.widths.disp_cells(), which is what calc_screen() uses."""
+    cells, counts = disp_cells("".join(buffer))
+    return "".join(cells), counts
+
+
+# start, end, SGR parameters of a run of characters to colour
+ColorRun = Tuple[int, int, str]
+
+
+def colored_segments(
+    cells: List[str], counts: List[int], runs: List[ColorRun]
+) -> Callable[[int, int], str]:
+    """Return a function returning the text of cells[a:b] with the
+    `runs' of characters coloured.  `counts' is as returned by
+    disp_cells().
+
+    Each slice gets its own escape sequences, starting and ending in
+    the default colours, so that the rows of a wrapped line and the
+    unchanged parts of the screen are drawn the same every time.
+    """
+    # the cell each character starts in
+    starts = [i for i, n in enumerate(counts) for _ in range(n)]
+    starts.append(len(cells))
+    druns = [(starts[s], starts[min(e, len(starts) - 1)], sgr) for s, e, sgr in runs]
+
+    def segment(a: int, b: int) -> str:
+        out = []
+        i = a
+        for s, e, sgr in druns:
+            if e <= a or s >= b or s == e:
+                continue
+            s, e = max(s, a), min(e, b)
+            out.append("".join(cells[i:s]))
+            out.append(f"\x1b[{sgr}m{''.join(cells[s:e])}\x1b[0m")
+            i = e
+        out.append("".join(cells[i:b]))
+        return "".join(out)
+
+    return segment
+
+
+def wrap_cells(cells: List[str], first: int, width: int) -> List[Tuple[int, int]]:
+    """Return the ranges of `cells' on each row, when the first row has
+    room for `first' cells and the others for `width'.  A wide
+    character isn't split: it goes on the next row."""
+    rows = []
+    start = 0
+    room = first
+    while len(cells) - start >= room:
+        end = start + room
+        if end < len(cells) and cells[end] == "" and end - 1 > start:
+            end -= 1
+        rows.append((start, end))
+        start = end
+        room = width
+    rows.append((start, len(cells)))
+    return rows
+
+
+def scroll_window(
+    cells: List[str], offset: int, cursor: Optional[int], width: int
+) -> Tuple[int, int]:
+    """Return the range of `cells' to show on a row `width' columns wide,
+    which has room for markers of the cells left out at either end.
+
+    The window starts `offset' cells in if the cell `cursor' (which is
+    None for lines without the cursor, and may be just past the end)
+    shows in it, or moves to put it about in the middle if not.
+    """
+    n = len(cells)
+    if n < width:
+        return 0, n
+    width = max(width, 3)
+    if cursor is None:
+        start = 0
+    else:
+        start = offset
+        room = width - (1 if start else 0) - 1
+        if not start <= cursor < start + room:
+            start = cursor - (width - 2) // 2
+            # don't leave the end of the window empty
+            start = max(0, min(start, n + 1 - (width - 2)))
+        if cells[start:start + 1] == [""]:
+            start -= 1
+    end = min(n, start + width - (1 if start else 0) - 1)
+    if end < n and cells[end] == "":
+        end -= 1
+    return start, end
+
+
+def _join_cells(cells: List[str], a: int, b: int) -> str:
+    return "".join(cells[a:b])
 
 
 # syntax classes:
@@ -223,6 +279,11 @@ feeling more loquacious than I am now."""
 
     msg_at_bottom: bool = True
 
+    # show lines longer than the screen is wide on a single row,
+    # scrolled sideways to keep the cursor in sight, rather than
+    # wrapped over several
+    horizontal_scroll: bool = False
+
     def __init__(self, console: "Console"):
         super().__init__()
         self.buffer: List[str] = []
@@ -236,6 +297,8 @@ feeling more loquacious than I am now."""
         self.console = console
         self.commands = {}
         self.msg = ""
+        # how many cells the line with the cursor is scrolled sideways
+        self.hscroll = 0
         for v in list(vars(commands).values()):
             if (
                 isinstance(v, type)
@@ -262,38 +325,49 @@ feeling more loquacious than I am now."""
         especially efficient is certainly simple(r).
         """
         lines = "".join(self.buffer).split("\n")
+        colors = self.get_colors(lines)
         screen = []
         screeninfo = []
         w = self.console.width - 1
         p = self.pos
         for ln, line in enumerate(lines):
             line_length = len(line)
-            if 0 <= p <= line_length:
+            here = 0 <= p <= line_length
+            if here:
                 if self.msg and not self.msg_at_bottom:
                     for mline in self.msg.split("\n"):
                         screen.append(mline)
                         screeninfo.append((0, []))
                 self.lxy = p, ln
-            prompt = self.get_prompt(ln, line_length >= p >= 0)
+            prompt = self.get_prompt(ln, here)
             while "\n" in prompt:
                 pre_prompt, _, prompt = prompt.partition("\n")
                 screen.append(pre_prompt)
                 screeninfo.append((0, []))
             p -= line_length + 1
             prompt, lp = self.process_prompt(prompt)
-            l, l2 = disp_str(line)
-            wrapcount = (len(l) + lp) // w
-            if wrapcount == 0:
-                screen.append(prompt + l)
-                screeninfo.append((lp, l2 + [1]))
+            cells, counts = disp_cells(line)
+            if colors and colors[ln]:
+                seg = colored_segments(cells, counts, colors[ln])
             else:
-                screen.append(prompt + l[: w - lp] + "\\")
-                screeninfo.append((lp, l2[: w - lp]))
-                for i in range(-lp + w, -lp + wrapcount * w, w):
-                    screen.append(l[i : i + w] + "\\")
-                    screeninfo.append((0, l2[i : i + w]))
-                screen.append(l[wrapcount * w - lp :])
-                screeninfo.append((0, l2[wrapcount * w - lp :] + [1]))
+                seg = partial(_join_cells, cells)
+            if self.horizontal_scroll:
+                cursor = self._cursor_cell(counts) if here else None
+                text, info = self._scroll_row(cells, counts, seg, lp, cursor)
+                screen.append(prompt + text)
+                screeninfo.append((lp, info))
+                continue
+            rows = wrap_cells(cells, w - lp, w)
+            for i, (start, end) in enumerate(rows):
+                margin, text = (lp, prompt) if i == 0 else (0, "")
+                if i == len(rows) - 1:
+                    screen.append(text + seg(start, end))
+                    screeninfo.append((margin, counts[start:end] + [1]))
+                else:
+                    # padded where a wide character didn't fit
+                    pad = " " * (w - margin - (end - start))
+                    screen.append(text + seg(start, end) + pad + "\\")
+                    screeninfo.append((margin, counts[start:end] + [0] * len(pad)))
         self.screeninfo = screeninfo
         self.cxy = self.pos2xy(self.pos)
         if self.msg and self.msg_at_bottom:
@@ -302,6 +376,46 @@ feeling more loquacious than I am now."""
                 screeninfo.append((0, []))
         return screen
 
+    def _cursor_cell(self, counts: List[int]) -> int:
+        """Return the cell the cursor is in, in the line it is in."""
+        p = self.lxy[0]
+        x = 0
+        while p > 0:
+            p -= counts[x]
+            x += 1
+        while x < len(counts) and counts[x] == 0:
+            x += 1
+        return x
+
+    def _scroll_row(self, cells, counts, seg, lp, cursor) -> Tuple[str, List[int]]:
+        """Return the row showing a line after its prompt, `lp' columns
+        wide, in horizontal scrolling mode, and its screeninfo."""
+        width = self.console.width - 1 - lp
+        start, end = scroll_window(cells, self.hscroll, cursor, width)
+        if cursor is not None:
+            self.hscroll = start
+        text = ""
+        info = []
+        if start:
+            text += "<"
+            info.append(sum(counts[:start]))
+        text += seg(start, end)
+        info.extend(counts[start:end])
+        if end < len(cells):
+            pad = " " * (width - len(info) - 1)
+            text += pad + ">"
+            info.extend([0] * len(pad))
+            info.append(sum(counts[end:]) + 1)
+        else:
+            info.append(1)
+        return text, info
+
+    def get_colors(self, lines: List[str]) -> Optional[List[List[ColorRun]]]:
+        """Return, for each of `lines', the start, end and SGR
+        parameters of the runs of its characters to colour; or None for
+        no colours, as by default."""
+        return None
+
     def process_prompt(self, prompt: str) -> Tuple[str, int]:
         """Process the prompt.
 
@@ -433,7 +547,7 @@ feeling more loquacious than I am now."""
             return (p + len(l2) - 1, y)
         else:
             for p, l2 in self.screeninfo:  # noqa: B007 # p is used as the return value
-                l = l2.count(1)
+                l = sum(l2)
                 if l > pos:
                     break
                 else:
@@ -461,7 +575,7 @@ feeling more loquacious than I am now."""
 
     def after_command(self, cmd: commands.Command):
         """This function is called to allow post command cleanup."""
-        if getattr(cmd, "kills_digit_arg", 1):
+        if getattr(cmd, "kills_digit_arg", 1) and not getattr(cmd, "posted", 0):
             if self.arg is not None:
                 self.dirty = True
             self.arg = None
@@ -477,6 +591,7 @@ feeling more loquacious than I am now."""
             self.finished = 0
             del self.buffer[:]
             self.pos = 0
+            self.hscroll = 0
             self.dirty = True
             self.last_command = None
             self._pscache = {}
@@ -532,7 +647,7 @@ feeling more loquacious than I am now."""
         else:
             self.update_cursor()
 
-        if not isinstance(command, commands.digit_arg):
+        if not isinstance(command, commands.digit_arg) and not command.posted:
             self.last_command = command.__class__
 
         self.finished = command.finish
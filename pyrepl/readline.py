@@ -29,11 +29,13 @@ extensions for multiline input.
 import contextlib
 import os
 import sys
+from itertools import islice
 from typing import Callable, Union
 
 from pyrepl import commands
 from pyrepl.completing_reader import CompletingReader
 from pyrepl.historical_reader import HistoricalReader
+from pyrepl.history import HistoryFile
 from pyrepl.unix_console import UnixConsole, _error
 
 ENCODING = sys.getfilesystemencoding() or "latin1"  # XXX review
@@ -68,6 +70,9 @@ __all__ = [  # noqa: F822
     "write_history_file",
     # ---- multiline extensions ----
     "multiline_input",
+    # ---- history storage extensions ----
+    "set_shared_history_file",
+    "set_history_database",
 ]
 
 # ____________________________________________________________
@@ -78,6 +83,13 @@ class ReadlineConfig:
     completer_delims = dict.fromkeys(" \t\n`~!@#$%^&*()-=+[{]}\\|;:'\",<>/?")
 
 
+def _batch_completer(function):
+    batch = getattr(function, "all_completions", None)
+    if batch is None:
+        batch = getattr(getattr(function, "__self__", None), "all_completions", None)
+    return batch
+
+
 class ReadlineAlikeReader(HistoricalReader, CompletingReader):
     assume_immutable_completions = False
     use_brackets = False
@@ -86,6 +98,11 @@ class ReadlineAlikeReader(HistoricalReader, CompletingReader):
     def error(self, msg="none"):
         pass  # don't show error messages by default
 
+    def prepare(self):
+        super().prepare()
+        # whatever ran since the last line may have changed them
+        self.invalidate_completions()
+
     def get_stem(self):
         b = self.buffer
         p = self.pos - 1
@@ -100,16 +117,23 @@ class ReadlineAlikeReader(HistoricalReader, CompletingReader):
         if function is not None:
             with contextlib.suppress(UnicodeEncodeError):
                 stem = str(stem)  # rlcompleter.py seems to not like unicode
-            state = 0
-            while True:
+            batch = _batch_completer(function)
+            if batch is not None:
                 try:
-                    next = function(stem, state)
+                    result = [word for word in batch(stem) if isinstance(word, str)]
                 except:  # noqa: E722
-                    break
-                if not isinstance(next, str):
-                    break
-                result.append(next)
-                state += 1
+                    result = []
+            else:
+                state = 0
+                while True:
+                    try:
+                        next = function(stem, state)
+                    except:  # noqa: E722
+                        break
+                    if not isinstance(next, str):
+                        break
+                    result.append(next)
+                    state += 1
             # emulate the behavior of the standard readline that sorts
             # the completions before displaying them.
             result.sort()
@@ -122,7 +146,7 @@ class ReadlineAlikeReader(HistoricalReader, CompletingReader):
                 cut = 0
         else:
             cut = 0
-        return self.history[cut:]
+        return islice(self.history, cut, None)
 
     # --- simplified support for reading multiline Python statements ---
 
@@ -245,6 +269,10 @@ class _ReadlineWrapper:
         pass  # XXX we don't support parsing GNU-readline-style init files
 
     def set_completer(self, function=None):
+        """Set the completer function(text, state).  As an extension,
+        if `function' (or the object it is a method of) has an
+        all_completions(text) method, it is called instead to get all
+        the completions in one go."""
         self.config.readline_completer = function
 
     def get_completer(self):
@@ -290,6 +318,12 @@ class _ReadlineWrapper:
                         history.append(line)
 
     def write_history_file(self, filename="~/.history"):
+        fname = os.path.expanduser(filename)
+        shared = self.get_reader().history_file
+        if shared is not None and shared.filename == os.path.abspath(fname):
+            # shared: every entry was appended as it was accepted, and
+            # rewriting the file would drop those of other sessions
+            return
         maxlength = self.saved_history_length
         history = self.get_reader().get_trimmed_history(maxlength)
         entries = ""
@@ -297,10 +331,32 @@ class _ReadlineWrapper:
             entry = entry.replace("\n", "\r\n")  # multiline history support
             entries += entry + "\n"
 
-        fname = os.path.expanduser(filename)
         with open(fname, "w", encoding="utf-8") as f:
             f.write(entries)
 
+    def set_shared_history_file(self, filename="~/.history"):
+        """Share the history with the other sessions using `filename':
+        load what's already in it, append accepted entries to it and
+        pick up the entries of the other sessions before each prompt.
+        None stops sharing."""
+        reader = self.get_reader()
+        if filename is None:
+            reader.history_file = None
+            return
+        reader.history_file = HistoryFile(filename)
+        for entry in reader.history_file.read():
+            reader.append_history(entry)
+
+    def set_history_database(self, filename="~/.pyrepl_history.sqlite3"):
+        """Keep the history in the SQLite database `filename' (see
+        pyrepl.sqlite_history), shared with the other sessions using
+        it.  The current history is replaced by the database contents."""
+        from pyrepl.sqlite_history import SQLiteHistory
+
+        reader = self.get_reader()
+        reader.history = SQLiteHistory(filename)
+        reader.historyi = len(reader.history)
+
     def clear_history(self):
         del self.get_reader().history[:]
 
@@ -383,6 +439,8 @@ insert_text = _wrapper.insert_text
 
 # Extension
 multiline_input = _wrapper.multiline_input
+set_shared_history_file = _wrapper.set_shared_history_file
+set_history_database = _wrapper.set_history_database
 
 # Internal hook
 _get_reader = _wrapper.get_reader
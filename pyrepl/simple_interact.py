@@ -25,6 +25,7 @@ allowing multiline input and multiline history entries.
 
 import sys
 
+from pyrepl.completeness import StatementChecker
 from pyrepl.readline import _error, _get_reader, multiline_input
 
 
@@ -46,13 +47,11 @@ def run_multiline_interactive_console(mainmodule=None, future_flags=0):
     if future_flags:
         console.compile.compiler.flags |= future_flags
 
-    def more_lines(src: str) -> bool:
-        try:
-            code = console.compile(src, "<stdin>", "single")
-        except (OverflowError, SyntaxError, ValueError):
-            return False
+    checker = StatementChecker()
 
-        return code is None
+    def more_lines(src: str) -> bool:
+        # only compiled once it looks complete
+        return checker.more_lines(src, console.compile)
 
     while True:
         try:
@@ -0,0 +1,309 @@
+"""A history store for HistoricalReader kept in a SQLite database.
+
+Besides the text of each entry, the database records when and in which
+directory it was entered, by which session, and (if the embedding
+application reports it through set_outcome()) how long it took to run
+and whether it succeeded.  query() gives access to all of this, e.g.
+the last ten successful entries in the current directory:
+
+    history.query(cwd=os.getcwd(), success=True, limit=10)
+"""
+
+import os
+import sqlite3
+import time
+import uuid
+from array import array
+from bisect import bisect_left
+from collections.abc import MutableSequence
+from typing import Iterator, List, NamedTuple, Optional
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS history (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    text TEXT NOT NULL,
+    timestamp REAL NOT NULL,
+    cwd TEXT,
+    session TEXT,
+    duration REAL,
+    success INTEGER
+);
+CREATE INDEX IF NOT EXISTS history_text ON history (text);
+CREATE INDEX IF NOT EXISTS history_timestamp ON history (timestamp);
+"""
+
+# substring search; needs an SQLite with the FTS5 trigram tokenizer
+_FTS_SCHEMA = """
+CREATE VIRTUAL TABLE history_fts USING fts5(
+    text, content='history', content_rowid='id', tokenize='trigram'
+);
+CREATE TRIGGER history_fts_insert AFTER INSERT ON history BEGIN
+    INSERT INTO history_fts (rowid, text) VALUES (new.id, new.text);
+END;
+CREATE TRIGGER history_fts_delete AFTER DELETE ON history BEGIN
+    INSERT INTO history_fts (history_fts, rowid, text)
+        VALUES ('delete', old.id, old.text);
+END;
+CREATE TRIGGER history_fts_update AFTER UPDATE OF text ON history BEGIN
+    INSERT INTO history_fts (history_fts, rowid, text)
+        VALUES ('delete', old.id, old.text);
+    INSERT INTO history_fts (rowid, text) VALUES (new.id, new.text);
+END;
+INSERT INTO history_fts (history_fts) VALUES ('rebuild');
+"""
+
+# the trigram tokenizer can't match anything shorter
+_FTS_MIN_TERM = 3
+
+
+class HistoryEntry(NamedTuple):
+    id: int
+    text: str
+    timestamp: float
+    cwd: Optional[str]
+    session: Optional[str]
+    duration: Optional[float]
+    success: Optional[bool]
+
+
+class SQLiteHistory(MutableSequence):
+    """A list-like view of the entries of a history database.
+
+    The list holds the entries that were in the database when it was
+    opened, followed by the ones appended through it; indexing maps to
+    row ids through an in-memory array, so it stays cheap however big
+    the database gets.  Other sessions may use the same database at the
+    same time; entries they delete read as empty strings.
+
+    search() is the hook HistoricalReader.isearch_next_item() uses to
+    find the next entry containing a string with an index lookup
+    instead of scanning the entries one by one.
+    """
+
+    def __init__(self, filename: str = ":memory:", session: Optional[str] = None):
+        if filename != ":memory:":
+            filename = os.path.expanduser(filename)
+        self.filename = filename
+        self.session = session or uuid.uuid4().hex
+        # the fuzzy history search reads from a background thread;
+        # sqlite serializes the accesses itself
+        self.conn = sqlite3.connect(
+            filename, isolation_level=None, check_same_thread=False
+        )
+        if filename != ":memory:":
+            self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(_SCHEMA)
+        self.fts = self._setup_fts()
+        self._ids = array(
+            "q",
+            (row[0] for row in self.conn.execute("SELECT id FROM history ORDER BY id")),
+        )
+        self._last_id: Optional[int] = None
+
+    def _setup_fts(self) -> bool:
+        exists = self.conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'history_fts'"
+        ).fetchone()
+        if exists:
+            return True
+        try:
+            self.conn.executescript(f"BEGIN; {_FTS_SCHEMA} COMMIT;")
+        except sqlite3.OperationalError:
+            self.conn.execute("ROLLBACK")
+            return False
+        return True
+
+    def close(self):
+        self.conn.close()
+
+    # --- the list protocol ---
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def _id(self, i: int) -> int:
+        n = len(self._ids)
+        if i < 0:
+            i += n
+        if not 0 <= i < n:
+            raise IndexError("history index out of range")
+        return self._ids[i]
+
+    def _rows(self, descending: bool) -> Iterator[str]:
+        # merge the rows with our ids, skipping what other sessions
+        # added since we were opened
+        ids = self._ids
+        k, step = (len(ids) - 1, -1) if descending else (0, 1)
+        order = "DESC" if descending else "ASC"
+        for row_id, text in self.conn.execute(
+            f"SELECT id, text FROM history ORDER BY id {order}"
+        ):
+            # ours that were deleted by other sessions
+            while 0 <= k < len(ids) and (ids[k] - row_id) * step < 0:
+                yield ""
+                k += step
+            if not 0 <= k < len(ids):
+                break
+            if row_id == ids[k]:
+                yield text
+                k += step
+        while 0 <= k < len(ids):
+            yield ""
+            k += step
+
+    def __iter__(self) -> Iterator[str]:
+        return self._rows(descending=False)
+
+    def __reversed__(self) -> Iterator[str]:
+        return self._rows(descending=True)
+
+    def __eq__(self, other):
+        if isinstance(other, (SQLiteHistory, list)):
+            return len(self) == len(other) and all(
+                a == b for a, b in zip(self, other)
+            )
+        return NotImplemented
+
+    __hash__ = None  # type: ignore[assignment]
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            ids = self._ids[i]
+            if not ids:
+                return []
+            texts = dict(
+                self.conn.execute(
+                    "SELECT id, text FROM history WHERE id BETWEEN ? AND ?",
+                    (min(ids), max(ids)),
+                )
+            )
+            return [texts.get(row_id, "") for row_id in ids]
+        row = self.conn.execute(
+            "SELECT text FROM history WHERE id = ?", (self._id(i),)
+        ).fetchone()
+        if row is None:
+            # deleted by another session since we counted it: keep the
+            # indexes the reader holds valid
+            return ""
+        return row[0]
+
+    def __setitem__(self, i, text):
+        if isinstance(i, slice):
+            raise TypeError("history database entries can't be assigned to in bulk")
+        self.conn.execute(
+            "UPDATE history SET text = ? WHERE id = ?", (text, self._id(i))
+        )
+
+    def __delitem__(self, i):
+        if isinstance(i, slice):
+            ids = self._ids[i]
+            self.conn.executemany(
+                "DELETE FROM history WHERE id = ?", ((row_id,) for row_id in ids)
+            )
+            del self._ids[i]
+            return
+        self.conn.execute("DELETE FROM history WHERE id = ?", (self._id(i),))
+        del self._ids[i]
+
+    def insert(self, i: int, text: str):
+        if i < len(self):
+            raise ValueError("can only append to a history database")
+        self.append(text)
+
+    def append(self, text: str):
+        try:
+            cwd: Optional[str] = os.getcwd()
+        except OSError:
+            cwd = None
+        cursor = self.conn.execute(
+            "INSERT INTO history (text, timestamp, cwd, session) VALUES (?, ?, ?, ?)",
+            (text, time.time(), cwd, self.session),
+        )
+        self._last_id = cursor.lastrowid
+        self._ids.append(cursor.lastrowid)
+
+    # --- extensions ---
+
+    def set_outcome(self, duration: float, success: bool):
+        """Record how running the entry appended last went."""
+        if self._last_id is not None:
+            self.conn.execute(
+                "UPDATE history SET duration = ?, success = ? WHERE id = ?",
+                (duration, int(success), self._last_id),
+            )
+
+    def search(self, term: str, i: int, forwards: bool) -> Optional[int]:
+        """Return the index of the nearest entry after (or before) index
+        `i' that contains `term', or None."""
+        ids = self._ids
+        if forwards:
+            if i + 1 >= len(ids):
+                return None
+            op, order, bound = ">", "ASC", ids[i] if i >= 0 else -1
+        else:
+            if i <= 0:
+                return None
+            op, order = "<", "DESC"
+            bound = ids[i] if i < len(ids) else ids[-1] + 1
+        if self.fts and len(term) >= _FTS_MIN_TERM:
+            # the trigram index is case insensitive, so check the
+            # candidates it gives
+            query = (
+                f"SELECT rowid, text FROM history_fts WHERE history_fts MATCH ? "
+                f"AND rowid {op} ? ORDER BY rowid {order}"
+            )
+            args = ('"' + term.replace('"', '""') + '"', bound)
+        else:
+            query = (
+                f"SELECT id, text FROM history WHERE instr(text, ?) > 0 "
+                f"AND id {op} ? ORDER BY id {order}"
+            )
+            args = (term, bound)
+        for row_id, text in self.conn.execute(query, args):
+            if term not in text:
+                continue
+            k = bisect_left(ids, row_id)
+            if k < len(ids) and ids[k] == row_id:
+                return k
+        return None
+
+    def query(
+        self,
+        prefix: Optional[str] = None,
+        cwd: Optional[str] = None,
+        session: Optional[str] = None,
+        success: Optional[bool] = None,
+        since: Optional[float] = None,
+        limit: Optional[int] = None,
+    ) -> List[HistoryEntry]:
+        """Return the entries of all sessions matching the given
+        criteria, most recent first."""
+        where = []
+        args: list = []
+        if prefix:
+            # a range, so that the index on text is used
+            where.append("text >= ? AND text < ?")
+            args += [prefix, prefix + "\U0010ffff"]
+        if cwd is not None:
+            where.append("cwd = ?")
+            args.append(cwd)
+        if session is not None:
+            where.append("session = ?")
+            args.append(session)
+        if success is not None:
+            where.append("success = ?")
+            args.append(int(success))
+        if since is not None:
+            where.append("timestamp >= ?")
+            args.append(since)
+        sql = "SELECT * FROM history"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY id DESC"
+        if limit is not None:
+            sql += " LIMIT ?"
+            args.append(limit)
+        return [
+            HistoryEntry(*row[:6], None if row[6] is None else bool(row[6]))
+            for row in self.conn.execute(sql, args)
+        ]
@@ -27,11 +27,14 @@ import select
 import signal
 import struct
 import termios
+import threading
 import time
+from collections import deque
 from fcntl import ioctl
-from typing import List, Optional, Tuple, Union
+from typing import Deque, List, Optional, Tuple, Union
 
 from . import curses
+from .cells import Cells, changed_spans, parse_line, sgr
 from .console import Console, Event
 from .fancy_termios import tcgetattr, tcsetattr
 from .trace import trace
@@ -98,19 +101,32 @@ except AttributeError:
     # do with poll objects
     class poll:
         def __init__(self):
-            pass
+            self.fds = []
 
         def register(self, fd, flag):
-            self.fd = fd
+            self.fds.append(fd)
+
+        def unregister(self, fd):
+            self.fds.remove(fd)
 
         def poll(self, timeout=None):
-            r, w, e = select.select([self.fd], [], [], timeout)
-            return r
+            r, w, e = select.select(self.fds, [], [], timeout)
+            return [(fd, POLLIN) for fd in r]
 
 
 POLLIN = getattr(select, "POLLIN", None)
 
 
+class _Frame:
+    """Output queued for the terminal, and the state of the console once
+    it is all written."""
+
+    def __init__(self, data: bytes, state: tuple):
+        self.data = memoryview(data)
+        self.state = state
+        self.started = False
+
+
 required_curses_tistrings = ("bel", "clear", "cup", "el")
 optional_curses_tistrings = (
     "civis",
@@ -125,6 +141,7 @@ optional_curses_tistrings = (
     "cuu1",
     "dch",
     "dch1",
+    "ed",
     "hpa",
     "ich",
     "ich1",
@@ -143,9 +160,14 @@ class UnixConsole(Console):
         f_out: int = 1,
         term: Optional[str] = None,
         encoding: Optional[str] = None,
+        nonblocking_output: bool = False,
     ):
         super().__init__(encoding=encoding)
         self.__buffer: List[Tuple[Union[bytes, str], bool]] = []
+        # don't wait for the terminal to take the output: queue what it
+        # doesn't, and skip the frames it is too slow for
+        self.nonblocking_output = nonblocking_output
+        self.__frames: Deque[_Frame] = deque()
 
         if isinstance(f_in, int):
             self.input_fd = f_in
@@ -159,6 +181,12 @@ class UnixConsole(Console):
 
         self.pollob = poll()
         self.pollob.register(self.input_fd, POLLIN)
+        # a pipe written to by post_event() so that a blocking
+        # get_event() notices events queued by other threads; only open
+        # between prepare() and restore()
+        self.__wakeup_r: Optional[int] = None
+        self.__wakeup_w: Optional[int] = None
+        self.__wakeup_lock = threading.Lock()
         curses.setupterm(term, self.output_fd)
         self.term = term
 
@@ -204,10 +232,18 @@ class UnixConsole(Console):
 
         self.event_queue = EventQueue(self.input_fd, self.encoding)
         self.cursor_visible = 1
+        # bytes written (or queued, see nonblocking_output) to the
+        # terminal in all, and by the last refresh, and whether that
+        # repainted the rows it changed rather than
+        # rewriting the differences
+        self.output_bytes = 0
+        self.frame_bytes = 0
+        self.frame_repainted = False
 
     def refresh(self, screen, c_xy):
         # this function is still too long (over 90 lines)
         cx, cy = c_xy
+        self.__drop_frames()
         if not self.__gone_tall:
             while len(self.screen) < min(len(screen), self.height):
                 self.__hide_cursor()
@@ -223,6 +259,7 @@ class UnixConsole(Console):
             self.__gone_tall = 1
             self.__move = self.__move_tall
 
+        output_bytes = self.output_bytes
         px, py = self.__posxy
         old_offset = offset = self.__offset
         height = self.height
@@ -260,29 +297,103 @@ class UnixConsole(Console):
 
         self.__offset = offset
 
-        for (
-            y,
-            oldline,
-            newline,
-        ) in zip(range(offset, offset + height), oldscr, newscr):
+        self.frame_repainted = self.__update(offset, oldscr, newscr, px)
+
+        self.__show_cursor()
+
+        self.screen = screen
+        self.move_cursor(cx, cy)
+        self.flushoutput()
+        self.frame_bytes = self.output_bytes - output_bytes
+        trace(
+            "refresh: {n} bytes, repainted: {r}",
+            n=self.frame_bytes,
+            r=self.frame_repainted,
+        )
+
+    def __update(self, offset: int, oldscr: List[str], newscr: List[str], px: int):
+        """Bring the rows from `offset' down from showing `oldscr' to
+        showing `newscr', whichever of rewriting what changed in each
+        and repainting all from the first that changed writes fewer
+        bytes; return whether it repainted."""
+        first = 0
+        n = min(len(oldscr), len(newscr))
+        while first < n and oldscr[first] == newscr[first]:
+            first += 1
+        if first == len(oldscr):
+            return False
+        start = len(self.__buffer)
+        state = self.__posxy, self.cursor_visible
+
+        for y, oldline, newline in zip(
+            range(offset + first, offset + n), oldscr[first:], newscr[first:]
+        ):
             if oldline != newline:
                 self.__write_changed_line(y, oldline, newline, px)
 
-        y = len(newscr)
-        while y < len(oldscr):
+        y = offset + len(newscr)
+        while y < offset + len(oldscr):
             self.__hide_cursor()
             self.__move(0, y)
             self.__posxy = 0, y
             self.__write_code(self._el)
             y += 1
 
-        self.__show_cursor()
-
-        self.screen = screen
-        self.move_cursor(cx, cy)
-        self.flushoutput()
+        diff = self.__buffer[start:]
+        cost = self.__cost(diff)
+        if cost <= sum(map(len, newscr[first:])):
+            # repainting can't do better
+            return False
+        diff_state = self.__posxy, self.cursor_visible
+        del self.__buffer[start:]
+        self.__posxy, self.cursor_visible = state
+        self.__repaint(offset + first, newscr[first:], len(oldscr) - first)
+        if self.__cost(self.__buffer[start:]) < cost:
+            return True
+        self.__buffer[start:] = diff
+        self.__posxy, self.cursor_visible = diff_state
+        return False
+
+    def __repaint(self, y: int, lines: List[str], old_rows: int):
+        """Clear the `old_rows' rows from `y' down and write `lines' in
+        their place."""
+        self.__hide_cursor()
+        self.__move(0, y)
+        self.__posxy = 0, y
+        rows = max(len(lines), old_rows)
+        if self._ed:  # type: ignore[attr-defined]
+            self.__write_code(self._ed)  # type: ignore[attr-defined]
+            rows = len(lines)
+        for i in range(rows):
+            self.__move(0, y + i)
+            self.__posxy = 0, y + i
+            if not self._ed:  # type: ignore[attr-defined]
+                self.__write_code(self._el)
+            if i < len(lines):
+                self.__write(lines[i])
+                self.__posxy = self.__line_width(lines[i]), y + i
+
+    @staticmethod
+    def __line_width(line: str) -> int:
+        if line.isascii() and "\x1b" not in line:
+            return len(line)
+        return len(parse_line(line).chars)
+
+    def __cost(self, items: List[Tuple[Union[bytes, str], bool]]) -> int:
+        """Return how many bytes writing out `items' takes."""
+        return sum(
+            len(text) if iscode else len(text.encode(self.encoding, "replace"))
+            for text, iscode in items
+        )
 
     def __write_changed_line(self, y, oldline, newline, px):
+        if not (oldline.isascii() and newline.isascii()) or (
+            "\x1b" in oldline or "\x1b" in newline
+        ):
+            # escape sequences take up no cells, and other characters
+            # may take up none or two
+            self.__write_changed_cells(y, parse_line(oldline), parse_line(newline))
+            return
         # this is frustrating; there's no reason to test (say)
         # self.dch1 inside the loop -- but alternative ways of
         # structuring this function are equally painful (I'm trying to
@@ -290,11 +401,9 @@ class UnixConsole(Console):
         x = 0
         minlen = min(len(oldline), len(newline))
         #
-        # reuse the oldline as much as possible, but stop as soon as we
-        # encounter an ESCAPE, because it might be the start of an escape
-        # sequene
+        # reuse the oldline as much as possible
         # XXX unicode check!
-        while x < minlen and oldline[x] == newline[x] and newline[x] != "\x1b":
+        while x < minlen and oldline[x] == newline[x]:
             x += 1
         if oldline[x:] == newline[x + 1 :] and self.ich1:
             if (
@@ -334,12 +443,32 @@ class UnixConsole(Console):
             self.__write(newline[x:])
             self.__posxy = len(newline), y
 
-        # XXX: check for unicode mess
-        if "\x1b" in newline:
-            # ANSI escape characters are present, so we can't assume
-            # anything about the position of the cursor.  Moving the cursor
-            # to the left margin should work to get to a known position.
-            self.move_cursor(0, y)
+    def __write_changed_cells(self, y: int, old: Cells, new: Cells):
+        """Write the cells of the line `y' that changed, switching the
+        attributes only where they differ; they are back to the
+        default ones after each run written."""
+        spans = changed_spans(old, new)
+        if spans:
+            self.__hide_cursor()
+        for start, end in spans:
+            # from the start of a wide character
+            while start > 0 and new.chars[start] == "":
+                start -= 1
+            self.__move(start, y)
+            attr = ""
+            out = []
+            for x in range(start, end):
+                out.append(sgr(attr, new.attrs[x]))
+                attr = new.attrs[x]
+                out.append(new.chars[x])
+            out.append(sgr(attr, ""))
+            self.__write("".join(out))
+            self.__posxy = end, y
+        if len(new.chars) < len(old.chars):
+            self.__hide_cursor()
+            self.__move(len(new.chars), y)
+            self.__posxy = len(new.chars), y
+            self.__write_code(self._el)
 
     def __write(self, text: str):
         self.__buffer.append((text, False))
@@ -426,14 +555,29 @@ class UnixConsole(Console):
 
         self.__maybe_write_code(self._smkx)
 
+        if self.__wakeup_r is None:
+            # not inherited by child processes, as os.pipe() goes
+            self.__wakeup_r, self.__wakeup_w = os.pipe()
+            os.set_blocking(self.__wakeup_r, False)
+            os.set_blocking(self.__wakeup_w, False)
+            self.pollob.register(self.__wakeup_r, POLLIN)
+
+        if self.nonblocking_output:
+            os.set_blocking(self.output_fd, False)
+        self.__written_state = self.__state()
+
         with contextlib.suppress(ValueError):
             self.old_sigwinch = signal.signal(signal.SIGWINCH, self.__sigwinch)
 
     def restore(self):
         self.__maybe_write_code(self._rmkx)
         self.flushoutput()
+        if self.nonblocking_output:
+            self.__drain(block=True)
+            os.set_blocking(self.output_fd, True)
         tcsetattr(self.input_fd, termios.TCSADRAIN, self.__svtermstate)
 
+        # before closing the wakeup pipe, which __sigwinch writes to
         if hasattr(self, "old_sigwinch"):
             try:
                 signal.signal(signal.SIGWINCH, self.old_sigwinch)
@@ -442,9 +586,20 @@ class UnixConsole(Console):
                 # signal only works in main thread.
                 pass
 
+        with self.__wakeup_lock:
+            if self.__wakeup_r is not None:
+                self.pollob.unregister(self.__wakeup_r)
+                os.close(self.__wakeup_r)
+                os.close(self.__wakeup_w)
+                self.__wakeup_r = self.__wakeup_w = None
+
     def __sigwinch(self, signum, frame):
         self.height, self.width = self.getheightwidth()
         self.event_queue.insert(Event("resize", None))
+        # not post_event(): the handler may have interrupted the holder
+        # of __wakeup_lock, and restore() removes it before closing the
+        # pipe anyway
+        self.__wakeup()
         if self.old_sigwinch != signal.SIG_DFL:
             self.old_sigwinch(signum, frame)
 
@@ -452,13 +607,46 @@ class UnixConsole(Console):
         trace("push char {char!r}", char=char)
         self.event_queue.push(char)
 
+    def post_event(self, event: Event):
+        """Queue `event' from any thread, waking up get_event() if it
+        is blocked waiting for input."""
+        self.event_queue.insert(event)
+        with self.__wakeup_lock:
+            self.__wakeup()
+
+    def __wakeup(self):
+        if self.__wakeup_w is not None:
+            with contextlib.suppress(BlockingIOError):
+                os.write(self.__wakeup_w, b"\0")
+
+    def __drain_wakeup(self) -> bool:
+        if self.__wakeup_r is None:
+            return False
+        try:
+            return bool(os.read(self.__wakeup_r, 512))
+        except BlockingIOError:
+            return False
+
     def get_event(self, block: bool = True):
         assert isinstance(block, bool)
         while self.event_queue.empty():
+            if block:
+                self.wait()
+                if self.__drain_wakeup():
+                    # something was posted: re-check the queue before
+                    # going back to reading the terminal
+                    continue
             while True:
                 # All hail Unix!
                 try:
                     self.push_char(os.read(self.input_fd, 1))
+                except BlockingIOError:
+                    # the terminal is non-blocking, and there is no
+                    # input after all
+                    if not block:
+                        break
+                    self.wait()
+                    continue
                 except OSError as err:
                     if err.errno == errno.EINTR:
                         if not self.event_queue.empty():
@@ -472,6 +660,16 @@ class UnixConsole(Console):
         return self.event_queue.get()
 
     def wait(self):
+        while self.__frames:
+            # write out the queued output as the terminal takes it,
+            # until there is input
+            fds = [self.input_fd]
+            if self.__wakeup_r is not None:
+                fds.append(self.__wakeup_r)
+            readable, _, _ = select.select(fds, [self.output_fd], [])
+            if readable:
+                return
+            self.__drain()
         self.pollob.poll()
 
     def set_cursor_vis(self, vis):
@@ -527,12 +725,91 @@ class UnixConsole(Console):
         termios.tcflush(self.input_fd, termios.TCIFLUSH)
 
     def flushoutput(self):
+        if self.nonblocking_output:
+            self.__queue_output()
+            return
         for text, iscode in self.__buffer:
             if iscode:
                 self.__tputs(text)
             else:
-                os.write(self.output_fd, text.encode(self.encoding, "replace"))
+                self.__write_out(text.encode(self.encoding, "replace"))
+        del self.__buffer[:]
+
+    def __write_out(self, data: bytes):
+        os.write(self.output_fd, data)
+        self.output_bytes += len(data)
+
+    @property
+    def pending_output(self) -> int:
+        """How many bytes of output are queued for the terminal."""
+        return sum(len(frame.data) for frame in self.__frames)
+
+    def __state(self) -> tuple:
+        return (
+            list(self.screen),
+            self.__posxy,
+            self.__offset,
+            self.__gone_tall,
+            self.__move,
+            self.cursor_visible,
+        )
+
+    def __queue_output(self):
+        """Queue the buffered output as a frame, and write what the
+        terminal takes of the queue."""
+        # no padding: the terminal is slow enough as it is
+        data = b"".join(
+            delayprog.sub(b"", text)
+            if iscode
+            else text.encode(self.encoding, "replace")
+            for text, iscode in self.__buffer
+        )
         del self.__buffer[:]
+        if data:
+            self.__frames.append(_Frame(data, self.__state()))
+            self.output_bytes += len(data)
+        self.__drain()
+
+    def __drain(self, block: bool = False):
+        """Write the queued output, as much as the terminal takes
+        without waiting unless `block'."""
+        while self.__frames:
+            frame = self.__frames[0]
+            try:
+                n = os.write(self.output_fd, frame.data)
+            except BlockingIOError:
+                if not block:
+                    return
+                select.select([], [self.output_fd], [])
+                continue
+            frame.started = True
+            frame.data = frame.data[n:]
+            if not frame.data:
+                self.__written_state = frame.state
+                self.__frames.popleft()
+
+    def __drop_frames(self):
+        """Forget the queued frames that haven't started going out, and
+        go back to the state the terminal is left in by those that
+        have, so that the next frame goes straight there from it."""
+        self.__drain()
+        frames = self.__frames
+        keep = 1 if frames and frames[0].started else 0
+        if len(frames) == keep:
+            return
+        while len(frames) > keep:
+            self.output_bytes -= len(frames.pop().data)
+        state = frames[0].state if frames else self.__written_state
+        (
+            screen,
+            self.__posxy,
+            self.__offset,
+            self.__gone_tall,
+            self.__move,
+            self.cursor_visible,
+        ) = state
+        self.screen = list(screen)
+        trace("dropped frames, {n} bytes still queued", n=self.pending_output)
 
     def __tputs(self, fmt, prog=delayprog):
         """A Python implementation of the curses tputs function; the
@@ -547,17 +824,17 @@ class UnixConsole(Console):
         while True:
             m = prog.search(fmt)
             if not m:
-                os.write(self.output_fd, fmt)
+                self.__write_out(fmt)
                 break
             x, y = m.span()
-            os.write(self.output_fd, fmt[:x])
+            self.__write_out(fmt[:x])
             fmt = fmt[y:]
             delay = int(m.group(1))
             if "*" in m.group(2):
                 delay *= self.height
             if self._pad:
                 nchars = (bps * delay) / 1000
-                os.write(self.output_fd, self._pad * nchars)
+                self.__write_out(self._pad * nchars)
             else:
                 time.sleep(delay / 1000.0)
 
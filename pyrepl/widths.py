@@ -0,0 +1,107 @@
+"""How many cells of the terminal characters take up.
+
+East Asian wide characters take up two cells, combining marks and
+joiners none: they go in the cell of the character before them, with
+which they make up one grapheme cluster (as do characters joined by a
+zero width joiner).  Widths are looked up by bisection in the range
+tables of pyrepl._width_tables, and remembered for the characters seen
+last, so that laying out a line costs about the same with them as
+without; lines of printable ASCII characters skip all of it.
+"""
+
+import unicodedata
+from bisect import bisect_right
+from functools import lru_cache
+from typing import Dict, List, Tuple
+
+from pyrepl._width_tables import WIDE, ZERO
+
+_WIDE_STARTS = [first for first, _ in WIDE]
+_ZERO_STARTS = [first for first, _ in ZERO]
+
+ZWJ = "\u200d"
+
+
+def _in_table(table, starts, code: int) -> bool:
+    i = bisect_right(starts, code) - 1
+    return i >= 0 and code <= table[i][1]
+
+
+def _make_unctrl_map() -> Dict[str, str]:
+    uc_map: Dict[str, str] = {}
+    for i in range(32):
+        uc_map[chr(i)] = f"^{chr(ord('A') + i - 1)}"
+    uc_map["\t"] = "    "  # display TABs as 4 characters
+    uc_map["\177"] = "^?"
+    for i in range(128, 256):
+        c = chr(i)
+        if unicodedata.category(c)[0] == "C":
+            uc_map[c] = f"\\{i:03o}"
+    return uc_map
+
+
+_unctrl_map = _make_unctrl_map()
+
+
+@lru_cache(maxsize=4096)
+def char_display(c: str) -> Tuple[str, int]:
+    """Return what to display for the character `c', and how many cells
+    each of its characters takes up: 0, 1 or 2."""
+    s = _unctrl_map.get(c)
+    if s is not None:
+        return s, 1
+    code = ord(c)
+    if code < 0x300:
+        return c, 1
+    if _in_table(ZERO, _ZERO_STARTS, code):
+        return c, 0
+    if _in_table(WIDE, _WIDE_STARTS, code):
+        return c, 2
+    if unicodedata.category(c)[0] == "C":
+        return f"\\u{code:04x}", 1
+    return c, 1
+
+
+def char_width(c: str) -> int:
+    return char_display(c)[1]
+
+
+def str_width(s: str) -> int:
+    """Return how many cells `s' takes up."""
+    if s.isascii() and s.isprintable():
+        return len(s)
+    return sum(len(text) * width for text, width in map(char_display, s))
+
+
+def disp_cells(text: str) -> Tuple[List[str], List[int]]:
+    """Return the cells displaying `text', and how many of its characters
+    start in each.
+
+    Control characters show as ^X or octal escapes, over several cells.
+    A wide character's second cell is "".  Zero width characters are
+    added to the cell of the cluster they are part of.
+    """
+    if text.isascii() and text.isprintable():
+        return list(text), [1] * len(text)
+    cells: List[str] = []
+    counts: List[int] = []
+    # the cell of the cluster being built
+    last = -1
+    joining = False
+    for c in text:
+        s, width = char_display(c)
+        if last >= 0 and (width == 0 or joining):
+            cells[last] += c
+            counts[last] += 1
+            joining = c == ZWJ
+            continue
+        joining = False
+        last = len(cells)
+        if width == 2:
+            cells.extend((s, ""))
+            counts.extend((1, 0))
+        else:
+            cells.extend(s)
+            counts.append(1)
+            counts.extend([0] * (len(s) - 1))
+    return cells, counts
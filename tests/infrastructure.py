@@ -41,6 +41,8 @@ TestSpec = List[Tuple[Command, ExpectedScreen]]
 
 
 class TestConsole(Console):
+    __test__ = False
+
     def __init__(
         self,
         events: list[tuple[Command, ExpectedScreen]],
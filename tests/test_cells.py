@@ -0,0 +1,41 @@
+from pyrepl.cells import Cells, changed_spans, parse_line, sgr
+
+
+def test_parse_line():
+    cells = parse_line("\x1b[1mif\x1b[0m x \x1b[1;34mpass\x1b[0m")
+    assert "".join(cells.chars) == "if x pass"
+    assert cells.attrs == ["1", "1", "", "", "", "1;34", "1;34", "1;34", "1;34"]
+    # SGR parameters accumulate until reset
+    assert parse_line("\x1b[1m\x1b[34ma\x1b[0;2mb").attrs == ["1;34", "2"]
+    # other escapes stay with the character after them
+    assert parse_line("a\x1b[Kb").chars == ["a", "\x1b[Kb"]
+
+
+def test_sgr():
+    assert sgr("", "") == ""
+    assert sgr("", "1") == "\x1b[1m"
+    assert sgr("1", "") == "\x1b[0m"
+    assert sgr("1", "1;34") == "\x1b[34m"
+    assert sgr("1;34", "32") == "\x1b[0;32m"
+
+
+def cells(text, attr=""):
+    return Cells(list(text), [attr] * len(text))
+
+
+def test_changed_spans():
+    assert changed_spans(cells("abcdef"), cells("abcdef")) == []
+    assert changed_spans(cells("abcdef"), cells("abXdef")) == [(2, 3)]
+    assert changed_spans(cells("abcdef"), cells("abcdef", "1")) == [(0, 6)]
+    # close changes are written in one go
+    assert changed_spans(cells("abcdef"), cells("XbXdef")) == [(0, 3)]
+    assert changed_spans(cells("abcdefghij"), cells("XbcdefghiX")) == [(0, 1), (9, 10)]
+    assert changed_spans(cells("abc"), cells("abcde")) == [(3, 5)]
+    assert changed_spans(cells("abc"), cells("aXcde")) == [(1, 5)]
+    assert changed_spans(cells("abcde"), cells("ab")) == []
+
+
+def test_parse_wide_and_combining():
+    cells = parse_line("日\x1b[1mé\x1b[0m")
+    assert cells.chars == ["日", "", "é"]
+    assert cells.attrs == ["", "", "1"]
@@ -0,0 +1,105 @@
+import code
+import sys
+
+import pytest
+
+from pyrepl import completeness
+from pyrepl.completeness import LineState, StatementChecker, scan_line
+
+SOURCES = [
+    "x = 1",
+    "",
+    "  ",
+    "# comment",
+    "x = 1  # (",
+    "x = (1,",
+    "x = [\n1]",
+    "d = {1:",
+    'f("""\n)',
+    'x = """a',
+    'x = """a\nb"""',
+    's = "("',
+    'x = "a\\',
+    "x = 1 \\",
+    "def f(): pass",
+    "for x in y: pass",
+    "if x:\n  y",
+    "if x:\n  y\n",
+    "if x:\n  y\n  ",
+    "if x: y\n\n",
+    "if 1:\n  pass\nelse:",
+    "if x:\n  y = (\n  1)\n",
+    "class A:\n  pass\n",
+    "@d",
+    "@d\ndef f(): pass",
+    pytest.param(
+        "match x:",
+        marks=pytest.mark.skipif(
+            sys.version_info < (3, 10), reason="no match statement"
+        ),
+    ),
+    pytest.param(
+        "match x:\n  case 1:\n    pass\n",
+        marks=pytest.mark.skipif(
+            sys.version_info < (3, 10), reason="no match statement"
+        ),
+    ),
+]
+
+
+@pytest.mark.parametrize("source", SOURCES)
+def test_agrees_with_compiler(source):
+    compiler = code.CommandCompiler()
+    expected = compiler(source) is None
+    assert StatementChecker().is_incomplete(source) == expected
+
+
+def test_errors_are_complete():
+    checker = StatementChecker()
+    assert not checker.is_incomplete(")")
+    assert not checker.is_incomplete('x = "a')
+    assert not checker.more_lines("x = (1]", code.CommandCompiler())
+
+
+def test_scan_line():
+    info = scan_line("x = f(a, '''", LineState())
+    assert info.exit == LineState("(", "'''")
+    assert info.first == "x"
+    info = scan_line("''', b)", info.exit)
+    assert info.exit == LineState()
+    assert not info.first
+
+
+def test_only_changed_lines_are_scanned(monkeypatch):
+    scanned = []
+
+    def scan(line, state):
+        scanned.append(line)
+        return scan_line(line, state)
+
+    monkeypatch.setattr(completeness, "scan_line", scan)
+    checker = StatementChecker()
+    lines = ["def f(x):", "    y = [", "        x,", "    ]"]
+    assert checker.is_incomplete("\n".join(lines))
+    assert scanned == lines
+    del scanned[:]
+    assert checker.is_incomplete("\n".join(lines + ["    return y"]))
+    assert scanned == ["    return y"]
+    del scanned[:]
+    assert not checker.is_incomplete("\n".join(lines + ["    return y", ""]))
+    assert scanned == [""]
+
+
+def test_compiles_only_when_complete():
+    compiled = []
+
+    def compiler(source):
+        compiled.append(source)
+        return code.CommandCompiler()(source)
+
+    checker = StatementChecker()
+    assert checker.more_lines("def f():", compiler)
+    assert checker.more_lines("def f():\n    return 1", compiler)
+    assert not compiled
+    assert not checker.more_lines("def f():\n    return 1\n", compiler)
+    assert compiled == ["def f():\n    return 1\n"]
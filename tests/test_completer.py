@@ -0,0 +1,103 @@
+import os
+import sys
+
+import pytest
+
+from pyrepl.completer import Completer, ModuleAttributeCache, prefix_matches
+
+
+def test_prefix_matches():
+    names = ["a", "ab", "abc", "b", "ba"]
+    assert prefix_matches(names, "ab") == ["ab", "abc"]
+    assert prefix_matches(names, "") == names
+    assert prefix_matches(names, "c") == []
+
+
+def test_global_matches():
+    ns = {"__builtins__": {}, "spam": 1, "spammer": 2}
+    completer = Completer(ns)
+    assert completer.global_matches("spa") == ["spam", "spammer"]
+    assert completer.global_matches("whil") == ["while"]
+    assert "__builtins__" not in completer.global_matches("__b")
+    # the index follows changes to the namespace
+    ns["spanish"] = 3
+    assert completer.global_matches("spa") == ["spam", "spammer", "spanish"]
+    del ns["spam"]
+    ns["spade"] = 4
+    assert completer.global_matches("spa") == ["spade", "spammer", "spanish"]
+
+
+def test_attr_matches():
+    class Base:
+        def method(self):
+            pass
+
+    class Derived(Base):
+        def other_method(self):
+            pass
+
+    obj = Derived()
+    obj.mine = 1
+    completer = Completer({"obj": obj, "Derived": Derived})
+    assert completer.attr_matches("obj.m") == ["obj.method", "obj.mine"]
+    assert completer.attr_matches("obj.__cla") == ["obj.__class__"]
+    assert completer.attr_matches("Derived.o") == ["Derived.other_method"]
+    assert "Derived.mro" in completer.attr_matches("Derived.mr")
+
+    # class members are cached until a class in the MRO changes
+    Base.more = 2
+    assert completer.attr_matches("obj.m") == ["obj.method", "obj.mine", "obj.more"]
+    del Base.more
+    assert completer.attr_matches("obj.mo") == []
+
+
+def test_attr_matches_custom_dir():
+    import enum
+
+    class Color(enum.Enum):
+        RED = 1
+
+    class Dynamic:
+        def __dir__(self):
+            return ["dynamic"]
+
+    completer = Completer({"Color": Color, "d": Dynamic()})
+    assert completer.attr_matches("Color.R") == ["Color.RED"]
+    assert completer.attr_matches("d.dyn") == ["d.dynamic"]
+
+
+def test_module_attribute_cache(tmp_path, monkeypatch):
+    (tmp_path / "heavy_module.py").write_text("def function(): pass\nfunky = 1\n")
+    monkeypatch.syspath_prepend(str(tmp_path))
+    import heavy_module
+
+    cache_file = str(tmp_path / "cache.json")
+    completer = Completer({"hm": heavy_module}, ModuleAttributeCache(cache_file))
+    assert completer.attr_matches("hm.fun") == ["hm.function", "hm.funky"]
+
+    # a new session, where it isn't imported yet
+    monkeypatch.delitem(sys.modules, "heavy_module")
+    completer = Completer({}, ModuleAttributeCache(cache_file))
+    assert completer.attr_matches("heavy_module.fun") == [
+        "heavy_module.function",
+        "heavy_module.funky",
+    ]
+    assert "heavy_module" not in sys.modules
+
+    path = tmp_path / "heavy_module.py"
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    with pytest.raises(NameError):
+        Completer({}, ModuleAttributeCache(cache_file)).attr_matches("heavy_module.f")
+
+
+def test_fuzzy_matches():
+    class Thing:
+        def get_completion_menu(self):
+            pass
+
+    ns = {"__builtins__": {}, "thing": Thing(), "get_spam": 1, "gadget": 2}
+    completer = Completer(ns, fuzzy=True)
+    assert completer.global_matches("gs")[0] == "get_spam"
+    assert completer.global_matches("gad")[0] == "gadget"
+    assert completer.attr_matches("thing.gcm") == ["thing.get_completion_menu"]
@@ -0,0 +1,326 @@
+import threading
+from itertools import product
+
+from pyrepl.completing_reader import CompletingReader, CompletionMenu, prefix
+from pyrepl.fuzzy import FuzzyMatcher
+
+from .infrastructure import TestConsole, TestReader
+
+
+class PostingConsole(TestConsole):
+    def __init__(self, events):
+        super().__init__(events)
+        self.posted = []
+        self.has_posted = threading.Event()
+
+    def post_event(self, event):
+        self.posted.append(event)
+        self.has_posted.set()
+
+
+class SlowCompletingReader(CompletingReader, TestReader):
+    completion_deadline = 0.01
+
+    def __init__(self, console):
+        super().__init__(console)
+        self.release = threading.Event()
+
+    def get_completions(self, stem):
+        self.release.wait(5)
+        return ["spam", "spammer"]
+
+
+def test_slow_completions_are_delivered_later():
+    console = PostingConsole([])
+    reader = SlowCompletingReader(console)
+    reader.prepare()
+    reader.insert("s")
+    reader.do_cmd(("complete", None))
+    assert reader.msg == "[ computing... ]"
+    assert reader.cmpltn_pending is not None
+
+    reader.release.set()
+    assert console.has_posted.wait(5)
+    event = console.posted.pop()
+    reader.do_cmd((event.type, event.data))
+    assert reader.get_str() == "spam"
+    assert reader.cmpltn_pending is None
+    # the next press shows the menu
+    reader.do_cmd(("complete", None))
+    assert reader.cmpltn_menu_vis
+
+
+def test_keypress_cancels_pending_completions():
+    console = PostingConsole([])
+    reader = SlowCompletingReader(console)
+    reader.prepare()
+    reader.insert("s")
+    reader.do_cmd(("complete", None))
+    request = reader.cmpltn_pending
+    reader.do_cmd(("self-insert", "x"))
+    assert reader.cmpltn_pending is None
+    assert request.cancelled
+
+    reader.release.set()
+    assert request.wait(5)
+    assert not console.posted
+    # and if it had been, it would be ignored
+    reader.do_cmd(("complete", request))
+    assert reader.get_str() == "sx"
+
+
+def test_fast_completions_are_synchronous():
+    console = PostingConsole([])
+    reader = SlowCompletingReader(console)
+    reader.completion_deadline = 5
+    reader.release.set()
+    reader.prepare()
+    reader.insert("s")
+    reader.do_cmd(("complete", None))
+    assert reader.get_str() == "spam"
+    assert not console.posted
+
+
+class ListCompletingReader(CompletingReader, TestReader):
+    words = ["n" + "".join(p) for p in product("abcdefghij", repeat=5)] + ["other"]
+
+    def get_completions(self, stem):
+        return [w for w in self.words if w.startswith(stem)]
+
+
+def test_menu_narrows_as_stem_grows():
+    reader = ListCompletingReader(TestConsole([]))
+    reader.prepare()
+    reader.insert("n")
+    reader.do_cmd(("complete", None))
+    reader.do_cmd(("complete", None))
+    assert reader.cmpltn_menu_vis
+    assert reader.cmpltn_menu_range == (0, 100000)
+    assert len(reader.cmpltn_menu) < reader.console.height
+
+    for char, expected in [("d", 10000), ("j", 1000), ("j", 100), ("a", 10)]:
+        reader.do_cmd(("self-insert", char))
+        lo, hi = reader.cmpltn_menu_range
+        assert hi - lo == expected
+    assert reader.cmpltn_menu_choices[lo:hi][:2] == ["ndjjaa", "ndjjab"]
+    assert reader.cmpltn_menu[0].startswith("[ ndjjaa ]")
+
+    reader.do_cmd(("self-insert", "x"))
+    assert not reader.cmpltn_menu_vis
+
+
+def test_menu_pages():
+    reader = ListCompletingReader(TestConsole([]))
+    reader.prepare()
+    reader.insert("nab")
+    reader.do_cmd(("complete", None))
+    reader.do_cmd(("complete", None))
+    menu = reader.cmpltn_menu_pages
+    # 21 rows of 8 words, and how many more there are
+    assert len(reader.cmpltn_menu) == 22
+    assert reader.cmpltn_menu[0].startswith("[ nabaaa ][ nabaab ]")
+    assert reader.cmpltn_menu[-1] == "   832 more... "
+    # only the words that may fit on the page were measured
+    assert len(menu.lengths) <= 21 * 16
+    for offset in range(168, 1000, 168):
+        reader.do_cmd(("complete", None))
+        assert menu.offset == offset
+    assert menu.next_offset == 0
+    assert reader.cmpltn_menu[-1].startswith("[ nabjjc ]")
+
+
+def test_menu_sort_in_column():
+    menu = CompletionMenu(list("abcdefg"), False, True)
+    console = TestConsole([])
+    console.width = 9
+    assert menu.render(console) == ["a  d  g  ", "b  e     ", "c  f     "]
+    console.height = 5
+    assert menu.render(console) == ["a  d  g  ", "b  e     ", "   2 more... "]
+    menu.next_page()
+    assert menu.render(console) == ["c  f     "]
+    assert menu.next_offset == 0
+
+
+def test_prefix():
+    assert prefix(["spammer", "spam", "spanish"], 2) == "a"
+    assert prefix(["spam"]) == "spam"
+    assert prefix(["spam", "eggs"]) == ""
+
+
+def test_completion_cache():
+    class CountingReader(CompletingReader, TestReader):
+        assume_immutable_completions = False
+        calls = 0
+
+        def get_completions(self, stem):
+            self.calls += 1
+            return ["spammer", "spam"] if "spam".startswith(stem) else []
+
+    reader = CountingReader(TestConsole([]))
+    reader.prepare()
+    reader.insert("sp")
+    reader.do_cmd(("complete", None))
+    assert reader.get_str() == "spam"
+    reader.do_cmd(("complete", None))
+    assert reader.cmpltn_menu_choices == ["spam", "spammer"]
+    assert reader.calls == 2
+    # retyping hits the cache
+    reader.do_cmd(("backward-kill-word", None))
+    reader.insert("sp")
+    reader.do_cmd(("complete", None))
+    assert reader.calls == 2
+
+    reader.invalidate_completions()
+    reader.do_cmd(("complete", None))
+    assert reader.calls == 3
+
+
+class FuzzyCompletingReader(CompletingReader, TestReader):
+    fuzzy_completion = True
+    words = sorted(["get_completion_menu", "getCompletionMenu", "gcmd", "other"])
+
+    def get_completions(self, stem):
+        return FuzzyMatcher().match(self.words, stem)
+
+
+def test_fuzzy_completion():
+    reader = FuzzyCompletingReader(TestConsole([]))
+    reader.prepare()
+    reader.insert("gc")
+    reader.do_cmd(("complete", None))
+    # no common prefix to insert: the menu shows straight away
+    assert reader.get_str() == "gc"
+    assert reader.cmpltn_menu_vis
+    assert reader.cmpltn_menu_choices == [
+        "gcmd",
+        "getCompletionMenu",
+        "get_completion_menu",
+    ]
+    # narrowing keeps the ranking
+    reader.do_cmd(("self-insert", "e"))
+    assert reader.cmpltn_menu_choices == ["getCompletionMenu", "get_completion_menu"]
+
+    # matches with a common prefix other than the stem
+    reader = FuzzyCompletingReader(TestConsole([]))
+    reader.words = ["get_cmds", "get_completion_menu"]
+    reader.prepare()
+    reader.insert("x gc")
+    reader.do_cmd(("complete", None))
+    assert reader.get_str() == "x gc"
+    assert reader.cmpltn_menu_vis
+    assert sorted(reader.cmpltn_menu_choices) == reader.words
+
+    # the sole completion replaces the stem
+    reader = FuzzyCompletingReader(TestConsole([]))
+    reader.prepare()
+    reader.insert("x otr")
+    reader.do_cmd(("complete", None))
+    assert reader.get_str() == "x other"
+
+
+class MultiSourceReader(CompletingReader, TestReader):
+    completion_deadline = 0.01
+
+    def __init__(self, console):
+        super().__init__(console)
+        self.release = threading.Event()
+
+    def get_completion_sources(self, stem):
+        return [self.fast, self.slow]
+
+    def fast(self, stem):
+        return ["spam", "spanish"]
+
+    def slow(self, stem):
+        self.release.wait(5)
+        return ["spammer", "spam"]
+
+
+def test_sources_are_merged_as_they_arrive():
+    console = PostingConsole([])
+    reader = MultiSourceReader(console)
+    reader.prepare()
+    reader.insert("sp")
+    reader.do_cmd(("complete", None))
+    # the fast source shows up without inserting anything
+    assert reader.cmpltn_menu_vis
+    assert reader.cmpltn_menu_choices == ["spam", "spanish"]
+    assert reader.get_str() == "sp"
+    assert reader.cmpltn_pending is not None
+
+    reader.release.set()
+    assert console.has_posted.wait(5)
+    event = console.posted.pop()
+    reader.do_cmd((event.type, event.data))
+    assert reader.cmpltn_pending is None
+    assert reader.cmpltn_menu_choices == ["spam", "spammer", "spanish"]
+    assert reader.cmpltn_menu[0].startswith("[ spam    ][ spammer ]")
+    assert reader.get_str() == "sp"
+
+
+def test_partial_results_are_not_inserted():
+    console = PostingConsole([])
+    reader = MultiSourceReader(console)
+    reader.slow = lambda stem: reader.release.wait(5) and ["sport"]
+    reader.prepare()
+    reader.insert("sp")
+    reader.do_cmd(("complete", None))
+    reader.do_cmd(("complete", None))
+    # "spa" is common to what the fast source found
+    assert reader.get_str() == "sp"
+    assert reader.cmpltn_menu_choices == ["spam", "spanish"]
+
+    reader.release.set()
+    assert console.has_posted.wait(5)
+    event = console.posted.pop()
+    reader.do_cmd((event.type, event.data))
+    assert reader.cmpltn_menu_choices == ["spam", "spanish", "sport"]
+    assert reader.get_str() == "sp"
+
+
+class SlowSpamReader(SlowCompletingReader):
+    def get_completions(self, stem):
+        if "xylophone".startswith(stem):
+            return ["xylophone"]
+        return super().get_completions(stem)
+
+
+def test_pressing_again_while_pending():
+    console = PostingConsole([])
+    reader = SlowSpamReader(console)
+    reader.prepare()
+    reader.insert("x")
+    reader.do_cmd(("complete", None))
+    assert reader.get_str() == "xylophone"
+    for char in " sp":
+        reader.do_cmd(("self-insert", char))
+    reader.do_cmd(("complete", None))
+    # the choices of the previous completion are no use
+    reader.do_cmd(("complete", None))
+    assert reader.get_str() == "xylophone sp"
+    assert reader.msg == "[ computing... ]"
+    assert reader.cmpltn_pending is not None
+
+    reader.release.set()
+    assert console.has_posted.wait(5)
+    event = console.posted.pop()
+    reader.do_cmd((event.type, event.data))
+    assert reader.get_str() == "xylophone spam"
+    # the posted completion isn't a command of its own
+    reader.do_cmd(("complete", None))
+    assert reader.cmpltn_menu_vis
+
+
+def test_posted_commands_leave_the_digit_arg_alone():
+    console = PostingConsole([])
+    reader = SlowCompletingReader(console)
+    reader.prepare()
+    reader.insert("s")
+    reader.do_cmd(("complete", None))
+    request = reader.cmpltn_pending
+    reader.do_cmd(("digit-arg", "3"))
+    reader.release.set()
+    assert request.wait(5)
+    # posted before the digit argument cancelled it
+    reader.do_cmd(("complete", request))
+    assert reader.arg == 3
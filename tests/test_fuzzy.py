@@ -0,0 +1,50 @@
+import time
+
+from pyrepl.fuzzy import FuzzyMatcher, features, matches
+
+
+def test_features():
+    assert features("get_completion_menu") == ("get_completion_menu", (0, 4, 15))
+    assert features("getCompletionMenu") == ("getcompletionmenu", (0, 3, 13))
+    assert features("utf8") == ("utf8", (0, 3))
+    assert features("__init__") == ("__init__", (0, 2))
+
+
+def test_matches():
+    assert matches("gcm", "get_completion_menu")
+    assert matches("GCM", "getCompletionMenu")
+    assert matches("get", "getattr")
+    assert not matches("cm", "get_completion_menu")
+    assert not matches("gmc", "get_completion_menu")
+    assert not matches("", "get")
+
+
+def test_ranking():
+    words = sorted(
+        ["gc", "get_completion_menu", "getCompletionMenu", "gcmd", "gimmick"]
+    )
+    # prefixes first, then the matches on segment starts
+    assert FuzzyMatcher().match(words, "gcm") == [
+        "gcmd",
+        "getCompletionMenu",
+        "get_completion_menu",
+    ]
+
+
+def test_ranking_is_stable_as_query_grows():
+    words = sorted(["set_item", "setitem", "sequence_item", "system"])
+    matcher = FuzzyMatcher()
+    ranked = matcher.match(words, "si")
+    narrowed = matcher.match(words, "sit")
+    assert narrowed == [w for w in ranked if matches("sit", w)]
+
+
+def test_many_candidates():
+    words = sorted(f"name_{i}_{j}" for i in range(1000) for j in range(100))
+    matcher = FuzzyMatcher()
+    matcher.match(words, "n")  # computes the features
+    start = time.perf_counter()
+    ranked = matcher.match(words, "n9_99")
+    assert ranked[0] == "name_9_99"
+    assert "name_19_99" in ranked
+    assert time.perf_counter() - start < 1
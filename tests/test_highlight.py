@@ -0,0 +1,78 @@
+from pyrepl.highlight import Highlighter, lex_line
+from pyrepl.reader import Reader
+
+from .infrastructure import TestConsole
+
+
+def test_lex_line():
+    runs, state = lex_line('def f(x=1): return len("a#b")  # hi', None)
+    assert runs == [
+        (0, 3, "keyword"),
+        (4, 5, "definition"),
+        (8, 9, "number"),
+        (12, 18, "keyword"),
+        (19, 22, "builtin"),
+        (23, 28, "string"),
+        (31, 35, "comment"),
+    ]
+    assert state is None
+    assert lex_line("bar1 = 2", None) == ([(7, 8, "number")], None)
+
+
+def test_lex_multiline_string():
+    runs, state = lex_line('x = """abc', None)
+    assert runs == [(4, 10, "string")] and state == '"""'
+    assert lex_line("more", state) == ([(0, 4, "string")], '"""')
+    runs, state = lex_line('end""" + 1', state)
+    assert runs == [(0, 6, "string"), (9, 10, "number")] and state is None
+    # not continued without a backslash
+    assert lex_line("'abc", None) == ([(0, 4, "string")], None)
+
+
+def test_only_changed_lines_are_lexed():
+    highlighter = Highlighter()
+    lines = ["def f():", "    x = 1", "    return x"]
+    highlighter.colors(lines)
+    assert highlighter.lexed == 3
+    lines[1] = "    x = 12"
+    highlighter.colors(lines)
+    assert highlighter.lexed == 4
+    # opening a string changes how the lines after it start
+    lines[1] = '    x = """'
+    colors = highlighter.colors(lines)
+    assert highlighter.lexed == 6
+    assert colors[2] == [(0, 12, highlighter.theme["string"])]
+
+
+class ColorReader(Reader):
+    def get_colors(self, lines):
+        return Highlighter({"keyword": "1"}).colors(lines)
+
+
+def test_colored_screen():
+    reader = ColorReader(TestConsole([]))
+    reader.prepare()
+    reader.ps1 = ""
+    reader.insert("if x" + " " * 80 + "pass")
+    screen = reader.calc_screen()
+    # each row of a wrapped line has its own escapes
+    assert screen[0] == "\x1b[1mif\x1b[0m x" + " " * 75 + "\\"
+    assert screen[1] == "     \x1b[1mpass\x1b[0m"
+    # and the cursor isn't thrown off by them
+    assert reader.cxy == (9, 1)
+
+
+def test_soft_keywords():
+    def keywords(line):
+        runs = lex_line(line, None)[0]
+        return [line[a:b] for a, b, kind in runs if kind == "keyword"]
+
+    assert keywords("match x:") == ["match"]
+    assert keywords("    case [a, _]:  # c") == ["case"]
+    assert keywords('    case "#":') == ["case"]
+    assert keywords("type Point = tuple[int, int]") == ["type"]
+    assert keywords("type(x)") == []
+    assert keywords("match = re.match(p, s)") == []
+    assert keywords("print(type, match, _)") == []
+    assert keywords("_ = 1") == []
+    assert keywords("type == 1") == []
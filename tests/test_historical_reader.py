@@ -0,0 +1,156 @@
+import threading
+
+from pyrepl.historical_reader import (
+    HistoricalReader,
+    fuzzy_candidates,
+    fuzzy_extend,
+    fuzzy_rank,
+)
+from pyrepl.history import HistoryFile
+
+from .infrastructure import TestConsole, TestReader, read_spec
+
+
+class HistoricalTestReader(HistoricalReader, TestReader):
+    def __init__(self, console):
+        super().__init__(console)
+        self.history = ["import os", "print(x)", "import sys", "import os"]
+
+
+def test_fuzzy_extend_and_rank():
+    history = ["list_dirs()", "lambda x: x", "plot(data)"]
+    candidates = fuzzy_candidates(history)
+    for c in "ld":
+        candidates = fuzzy_extend(candidates, c)
+    # the word-boundary match beats the more recent scattered one
+    assert fuzzy_rank(candidates, len(history), 10) == [0, 2, 1]
+    assert fuzzy_extend(candidates, "z") == []
+
+
+def test_fuzzy_history_search():
+    read_spec(
+        [
+            (
+                "fuzzy-history-search",
+                [
+                    "(fuzzy-search `') import os",
+                    "> import os",
+                    "  import sys",
+                    "  print(x)",
+                ],
+            ),
+            (
+                ("fuzzy-history-add-character", "s"),
+                ["(fuzzy-search `s') import sys", "> import sys", "  import os"],
+            ),
+            (
+                ("fuzzy-history-add-character", "y"),
+                ["(fuzzy-search `sy') import sys", "> import sys"],
+            ),
+            (
+                "fuzzy-history-backspace",
+                ["(fuzzy-search `s') import sys", "> import sys", "  import os"],
+            ),
+            (
+                "fuzzy-history-next",
+                ["(fuzzy-search `s') import os", "  import sys", "> import os"],
+            ),
+            (("fuzzy-history-end", "\x01"), ["import os"]),
+            ("accept", ["import os"]),
+        ],
+        reader_class=HistoricalTestReader,
+    )
+
+
+def test_fuzzy_history_cancel():
+    read_spec(
+        [
+            (("self-insert", "abc"), ["abc"]),
+            ("fuzzy-history-search", None),
+            (("fuzzy-history-add-character", "p"), None),
+            ("fuzzy-history-cancel", ["abc"]),
+            ("accept", ["abc"]),
+        ],
+        reader_class=HistoricalTestReader,
+    )
+
+
+class PostingConsole(TestConsole):
+    def __init__(self):
+        super().__init__([])
+        self.posted = []
+        self.has_posted = threading.Event()
+
+    def post_event(self, event):
+        self.posted.append(event)
+        self.has_posted.set()
+
+
+def test_fuzzy_history_search_in_background():
+    console = PostingConsole()
+    reader = HistoricalTestReader(console)
+    reader.fuzzy_thread_threshold = 0
+    reader.prepare()
+    reader.do_cmd(("fuzzy-history-search", None))
+    assert reader.fuzzy_pending
+    assert console.has_posted.wait(5)
+
+    event = console.posted.pop()
+    reader.do_cmd((event.type, event.data))
+    assert not reader.fuzzy_pending
+    assert reader.fuzzy_matches == [3, 2, 1]
+    assert reader.get_str() == "import os"
+
+
+def test_operate_and_get_next_bounded_history():
+    class BoundedReader(HistoricalReader, TestReader):
+        history_max_length = 3
+
+    console = TestConsole(
+        [
+            ("previous-history", None),
+            ("previous-history", ["b"]),
+            ("operate-and-get-next", ["b"]),
+        ]
+    )
+    reader = BoundedReader(console)
+    reader.history.extend(["a", "b", "c"])
+    reader.historyi = 3
+    reader.readline()
+    assert reader.history == ["b", "c", "b"]
+    assert reader.history[reader.next_history] == "c"
+
+
+def test_shared_history_file(tmp_path):
+    filename = str(tmp_path / "history")
+    other = HistoryFile(filename)
+    other.read()
+
+    console = TestConsole([(("self-insert", "mine"), None), ("accept", None)])
+    reader = HistoricalTestReader(console)
+    reader.history_file = HistoryFile(filename)
+    reader.history_file.read()
+    other.append("theirs")
+    reader.readline()
+    assert reader.history[-2:] == ["theirs", "mine"]
+    assert other.tail() == ["mine"]
+
+
+def test_compact_history_copies_only_edited_entries():
+    class CompactReader(HistoricalReader, TestReader):
+        history_compact = True
+
+    console = TestConsole(
+        [
+            ("previous-history", ["b"]),
+            ("previous-history", ["a"]),
+            (("self-insert", "!"), ["a!"]),
+            ("next-history", ["b"]),
+            ("accept", None),
+        ]
+    )
+    reader = CompactReader(console)
+    reader.history.extend(["a", "b"])
+    reader.readline()
+    assert set(reader.transient_history) == {0, 2}
+    assert reader.history == ["a!", "b", "b"]
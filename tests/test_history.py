@@ -0,0 +1,254 @@
+import os
+import random
+import subprocess
+import sys
+
+import pytest
+
+from pyrepl.history import CompactHistory, History, HistoryFile
+
+
+@pytest.fixture(params=[History, CompactHistory])
+def history_class(request):
+    return request.param
+
+
+def test_list_protocol(history_class):
+    history = history_class(["a", "b", "c"])
+    assert history == ["a", "b", "c"]
+    assert len(history) == 3
+    assert history[0] == "a"
+    assert history[-1] == "c"
+    assert history[1:] == ["b", "c"]
+    history[1] = "B"
+    del history[0]
+    assert history == ["B", "c"]
+    with pytest.raises(IndexError):
+        history[2]
+    del history[:]
+    assert history == []
+
+
+def test_maxlen(history_class):
+    history = history_class(maxlen=3)
+    for entry in "abcde":
+        history.append(entry)
+    assert history == ["c", "d", "e"]
+    assert history.last_removed == 0
+    history.maxlen = 1
+    assert history == ["e"]
+
+
+def test_maxlen_compaction():
+    history = History(maxlen=10)
+    for i in range(5000):
+        history.append(str(i))
+    assert history == [str(i) for i in range(4990, 5000)]
+    assert len(history._entries) < 2 * 1024 + 10
+
+
+def test_ignore_dups(history_class):
+    history = history_class(ignore_dups=True)
+    for entry in ["a", "a", "b", "a"]:
+        history.append(entry)
+    assert history == ["a", "b", "a"]
+
+
+def test_erase_dups(history_class):
+    history = history_class(["a", "b", "c"], erase_dups=True)
+    history.append("a")
+    assert history == ["b", "c", "a"]
+    assert history.last_removed == 0
+    history.append("c")
+    assert history == ["b", "a", "c"]
+    assert history.last_removed == 1
+    history.append("d")
+    assert history.last_removed is None
+    del history[0]
+    history[0] = "e"
+    history.append("a")
+    assert history == ["e", "c", "d", "a"]
+    assert "e" in history
+    assert "b" not in history
+
+
+def test_erase_dups_with_maxlen(history_class):
+    history = history_class(maxlen=3, erase_dups=True)
+    for entry in ["a", "b", "c", "d", "b"]:
+        history.append(entry)
+    assert history == ["c", "d", "b"]
+
+
+def check_erase_dups(history_class, seed):
+    rng = random.Random(seed)
+    maxlen = rng.choice([None, 5])
+    history = history_class(maxlen=maxlen, erase_dups=True)
+    model = []
+    for _ in range(300):
+        entry = rng.choice(["a", "b", "c", "dd", "ee", "ff", "g"])
+        op = rng.random()
+        if op < 0.5:
+            history.append(entry)
+            if entry in model:
+                del model[len(model) - 1 - model[::-1].index(entry)]
+            model.append(entry)
+            if maxlen is not None and len(model) > maxlen:
+                del model[0]
+        elif not model:
+            continue
+        elif op < 0.85:
+            i = rng.randrange(len(model))
+            history[i] = model[i] = entry
+        else:
+            i = rng.randrange(len(model))
+            del history[i]
+            del model[i]
+        assert history == model
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_erase_dups_matches_list(history_class, seed):
+    check_erase_dups(history_class, seed)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_compact_erase_dups_with_hash_collisions(monkeypatch, seed):
+    monkeypatch.setattr("pyrepl.history.hash", len, raising=False)
+    check_erase_dups(CompactHistory, seed)
+
+
+def test_compact_storage():
+    history = CompactHistory(["print('é')", "x\ud800", "", "for x in y:\n    x"])
+    assert history == ["print('é')", "x\ud800", "", "for x in y:\n    x"]
+    assert list(reversed(history))[0] == "for x in y:\n    x"
+    assert len(history._offsets) == 5
+    assert "" in history
+    assert "x" not in history
+
+
+def test_compact_overlay_and_compaction():
+    history = CompactHistory(maxlen=10)
+    for i in range(5000):
+        history.append(str(i))
+        if i % 7 == 0:
+            history[-1] = f"edited {i}"
+    expected = [str(i) for i in range(4990, 5000)]
+    expected[1] = "edited 4991"
+    expected[8] = "edited 4998"
+    assert history == expected
+    assert len(history._offsets) < 2 * 1024 + 10
+    assert set(history._overlay) <= {history._start + 1, history._start + 8}
+
+
+def test_compact_erase_dups_after_assignment():
+    history = CompactHistory(["a", "b", "c"], erase_dups=True)
+    history[0] = "c"
+    history.append("a")
+    assert history == ["c", "b", "c", "a"]
+    # the most recent occurrence goes, as with History
+    history.append("c")
+    assert history.last_removed == 2
+    assert history == ["c", "b", "a", "c"]
+
+
+def test_compact_overlay_is_folded_back():
+    history = CompactHistory(str(i) for i in range(3000))
+    for i in range(3000):
+        history[i] = f"edited {i}"
+    assert len(history._overlay) < 1024
+    assert history == [f"edited {i}" for i in range(3000)]
+
+
+def test_compact_erase_dups_uses_index(monkeypatch):
+    history = CompactHistory((str(i) for i in range(1000)), erase_dups=True)
+    history.append("500")
+    # no more searching the blob
+    monkeypatch.setattr(history, "_find", None)
+    history.append("x")
+    history.append("10")
+    history.append("500")
+    assert history.last_removed == 998
+    assert len(history) == 1001
+    assert history[-4:] == ["999", "x", "10", "500"]
+    assert "10" not in history[:-2]
+
+
+def test_history_file_tail(tmp_path):
+    filename = str(tmp_path / "history")
+    a = HistoryFile(filename)
+    b = HistoryFile(filename)
+    assert a.read() == []
+    assert b.read() == []
+
+    a.append("x = 1")
+    a.append("for i in x:\n    pass")
+    assert b.tail() == ["x = 1", "for i in x:\n    pass"]
+    assert b.tail() == []
+    b.append("y")
+    assert a.tail() == ["y"]
+    assert a.tail() == []
+    assert HistoryFile(filename).read() == ["x = 1", "for i in x:\n    pass", "y"]
+
+
+def test_history_file_append_picks_up_pending(tmp_path):
+    filename = str(tmp_path / "history")
+    a = HistoryFile(filename)
+    b = HistoryFile(filename)
+    a.read()
+    b.read()
+    a.append("a")
+    b.append("b")
+    assert b.tail() == ["a"]
+    assert a.tail() == ["b"]
+
+
+def test_history_file_rewritten(tmp_path):
+    histfile = tmp_path / "history"
+    histfile.write_bytes(b"old\n")
+    a = HistoryFile(str(histfile))
+    assert a.read() == ["old"]
+    histfile.write_bytes(b"rewritten\n")
+    assert a.tail() == []
+    with open(histfile, "ab") as f:
+        f.write(b"new\n")
+    assert a.tail() == ["new"]
+
+
+def test_history_file_partial_entry(tmp_path):
+    histfile = tmp_path / "history"
+    a = HistoryFile(str(histfile))
+    a.read()
+    histfile.write_bytes(b"done\npart")
+    assert a.tail() == ["done"]
+    with open(histfile, "ab") as f:
+        f.write(b"ial\n")
+    assert a.tail() == ["partial"]
+
+
+APPENDER = """
+import sys
+from pyrepl.history import HistoryFile
+
+history_file = HistoryFile(sys.argv[1])
+history_file.read()
+for i in range(int(sys.argv[3])):
+    history_file.append(f"{sys.argv[2]} {i}\\n" + "x" * 1000)
+"""
+
+
+def test_history_file_concurrent_processes(tmp_path):
+    filename = str(tmp_path / "history")
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    processes = [
+        subprocess.Popen(
+            [sys.executable, "-c", APPENDER, filename, f"p{n}", "50"], env=env
+        )
+        for n in range(4)
+    ]
+    for process in processes:
+        assert process.wait(timeout=30) == 0
+
+    entries = HistoryFile(filename).read()
+    assert sorted(entries) == sorted(
+        f"p{n} {i}\n" + "x" * 1000 for n in range(4) for i in range(50)
+    )
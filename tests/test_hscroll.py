@@ -0,0 +1,57 @@
+from pyrepl.reader import Reader, scroll_window
+
+from .infrastructure import TestConsole
+
+
+def make_reader(text, width=20):
+    console = TestConsole([])
+    console.width = width
+    reader = Reader(console)
+    reader.prepare()
+    reader.ps1 = "> "
+    reader.horizontal_scroll = True
+    reader.insert(text)
+    return reader
+
+
+def test_scroll_window():
+    cells = list("0123456789" * 3)
+    assert scroll_window(cells[:9], 0, 9, 10) == (0, 9)
+    assert scroll_window(cells, 0, None, 10) == (0, 9)
+    assert scroll_window(cells, 0, 5, 10) == (0, 9)
+    # moves to put the cursor in the middle
+    assert scroll_window(cells, 0, 20, 10) == (16, 24)
+    # and stays put while it shows
+    assert scroll_window(cells, 16, 18, 10) == (16, 24)
+    assert scroll_window(cells, 16, 30, 10) == (23, 30)
+    # wide characters aren't cut in half
+    assert scroll_window(["a", "日", ""] * 4, 0, None, 6) == (0, 4)
+    assert scroll_window(["a", "日", ""] * 4, 0, 9, 6) == (7, 10)
+    assert scroll_window(["a", "日", ""] * 4, 0, 10, 6) == (7, 10)
+
+
+def test_long_line_takes_one_row():
+    reader = make_reader("0123456789" * 100)
+    assert reader.calc_screen() == ["> <67890123456789"]
+    assert reader.cxy == (17, 0)
+    reader.pos = 10
+    assert reader.calc_screen() == ["> <345678901234567>"]
+    assert reader.cxy == (10, 0)
+    reader.pos = 0
+    assert reader.calc_screen() == ["> 0123456789012345>"]
+    assert reader.cxy == (2, 0)
+    reader.pos = 15
+    reader.calc_screen()
+    assert reader.cxy == (17, 0)
+
+
+def test_other_lines_show_their_start():
+    reader = make_reader("0123456789" * 3 + "\n" + "abc")
+    assert reader.calc_screen() == ["/>> 01234567890123>", r"\__ abc"]
+    assert reader.cxy == (7, 1)
+
+
+def test_short_lines_are_unchanged():
+    reader = make_reader("x = 1")
+    assert reader.calc_screen() == ["> x = 1"]
+    assert reader.cxy == (7, 0)
@@ -0,0 +1,165 @@
+import os
+import sys
+import threading
+import zipfile
+
+import pytest
+
+from pyrepl import module_lister
+from pyrepl.module_lister import ModuleIndex
+
+
+@pytest.fixture
+def site(tmp_path):
+    site = tmp_path / "site"
+    (site / "pkg").mkdir(parents=True)
+    (site / "mod.py").write_text("")
+    (site / "pkg" / "__init__.py").write_text("")
+    (site / "pkg" / "sub.py").write_text("")
+    (site / "ns").mkdir()
+    (site / "ns" / "inner.py").write_text("")
+    (site / "data").mkdir()
+    (site / "data" / "README").write_text("")
+    archive = tmp_path / "lib.zip"
+    with zipfile.ZipFile(archive, "w") as z:
+        z.writestr("zmod.py", "")
+        z.writestr("zpkg/__init__.py", "")
+        z.writestr("zpkg/zsub.py", "")
+    return [str(site), str(archive)]
+
+
+def test_module_index(site, tmp_path):
+    index = ModuleIndex(site, cache_file=str(tmp_path / "cache.json"))
+    index.start()
+    assert index.wait(10)
+    assert index.find_modules("mod") == ["mod"]
+    assert index.find_modules("pkg.") == ["pkg.sub"]
+    assert index.find_modules("ns.") == ["ns.inner"]
+    assert index.find_modules("z") == ["zmod", "zpkg"]
+    assert index.find_modules("zpkg.z") == ["zpkg.zsub"]
+    assert index.find_modules("zpkg.zb", fuzzy=True) == ["zpkg.zsub"]
+    assert index.find_modules("zp", fuzzy=True) == ["zpkg"]
+    assert "data" not in index.packages[""]
+    with pytest.raises(ImportError):
+        index.find_modules("nothere.x")
+
+
+def test_module_index_cache(site, tmp_path, monkeypatch):
+    cache_file = str(tmp_path / "cache.json")
+    ModuleIndex(site, cache_file=cache_file).wait()
+
+    def scan(entry):
+        raise AssertionError(f"{entry} rescanned")
+
+    with monkeypatch.context() as m:
+        m.setattr(module_lister, "_scan", scan)
+        assert ModuleIndex(site, cache_file=cache_file).find_modules("pkg.") == [
+            "pkg.sub"
+        ]
+
+    # a new module in a package makes its sys.path entry be rescanned
+    pkg = os.path.join(site[0], "pkg")
+    with open(os.path.join(pkg, "other.py"), "w"):
+        pass
+    st = os.stat(pkg)
+    os.utime(pkg, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    assert ModuleIndex(site, cache_file=cache_file).find_modules("pkg.") == [
+        "pkg.other",
+        "pkg.sub",
+    ]
+
+
+SOURCE = """
+import os.path
+from json import loads as parse
+__all__ = ["exported"]
+__all__ += ["more"]
+
+def function():
+    pass
+
+class Class:
+    attribute = 1
+
+try:
+    from fast import speedup
+except ImportError:
+    def speedup():
+        pass
+
+constant, (other, _private) = 1, (2, 3)
+raise RuntimeError("imported")
+"""
+
+
+def test_module_exports(tmp_path, monkeypatch):
+    pkg = tmp_path / "exports_pkg"
+    pkg.mkdir()
+    (pkg / "__init__.py").write_text("")
+    (pkg / "mod.py").write_text(SOURCE)
+    monkeypatch.syspath_prepend(str(tmp_path))
+
+    assert module_lister.module_exports("exports_pkg.mod") == [
+        "Class",
+        "__all__",
+        "_private",
+        "constant",
+        "exported",
+        "function",
+        "more",
+        "os",
+        "other",
+        "parse",
+        "speedup",
+    ]
+    assert "exports_pkg" not in sys.modules
+    assert module_lister.module_exports("exports_pkg.nothere") == []
+
+    # reread when the source changes
+    (pkg / "mod.py").write_text("def changed(): pass\n")
+    st = os.stat(pkg / "mod.py")
+    os.utime(pkg / "mod.py", ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    assert module_lister.module_exports("exports_pkg.mod") == ["changed"]
+
+
+def test_module_exports_imported():
+    assert "dumps" in module_lister.module_exports("json")
+
+
+def test_partial_index(site, monkeypatch):
+    release = threading.Event()
+    scan = module_lister._scan
+
+    def slow_scan(entry):
+        if entry.endswith(".zip"):
+            release.wait(10)
+        return scan(entry)
+
+    monkeypatch.setattr(module_lister, "_scan", slow_scan)
+    index = ModuleIndex(site)
+    # what the first path entry has, without waiting for the second
+    for _ in range(100):
+        if index.find_modules("pkg.", timeout=0.1):
+            break
+    assert index.find_modules("pkg.", timeout=0) == ["pkg.sub"]
+    assert index.find_modules("z", timeout=0) == []
+    assert index.find_modules("zpkg.", timeout=0) == []
+    assert not index.ready
+    release.set()
+    assert index.find_modules("z") == ["zmod", "zpkg"]
+
+
+def test_module_index_cache_cleanup(site, tmp_path):
+    cache_file = str(tmp_path / "cache.json")
+    ModuleIndex(site, cache_file=cache_file).wait()
+    assert set(module_lister.load_cache(cache_file)) == set(site)
+    # left over by a session that exited while saving
+    stale = cache_file + ".12345.tmp"
+    with open(stale, "w"):
+        pass
+    os.utime(stale, (0, 0))
+
+    # entries that aren't on the path any more are dropped
+    ModuleIndex(site[:1], cache_file=cache_file).wait()
+    assert set(module_lister.load_cache(cache_file)) == set(site[:1])
+    assert not os.path.exists(stale)
@@ -0,0 +1,68 @@
+import os
+
+from pyrepl.path_completer import DirectoryCache, complete_path
+
+
+def completions(stem, cache):
+    return [path for batch in complete_path(stem, cache) for path in batch]
+
+
+def test_complete_path(tmp_path):
+    (tmp_path / "data").mkdir()
+    (tmp_path / "data.csv").write_text("")
+    (tmp_path / ".hidden").write_text("")
+    cache = DirectoryCache()
+    assert sorted(completions(str(tmp_path / "da"), cache)) == [
+        str(tmp_path / "data.csv"),
+        str(tmp_path / "data") + os.sep,
+    ]
+    # no hidden files unless asked for
+    assert len(completions(str(tmp_path) + os.sep, cache)) == 2
+    assert completions(str(tmp_path / ".h"), cache) == [str(tmp_path / ".hidden")]
+    assert completions(str(tmp_path / "nothere" / "x"), cache) == []
+
+
+def test_listings_are_cached(tmp_path, monkeypatch):
+    (tmp_path / "a").write_text("")
+    cache = DirectoryCache()
+    assert completions(str(tmp_path / "a"), cache) == [str(tmp_path / "a")]
+
+    scanned = []
+    real_scandir = os.scandir
+
+    def scandir(path):
+        scanned.append(path)
+        return real_scandir(path)
+
+    monkeypatch.setattr(os, "scandir", scandir)
+    assert completions(str(tmp_path / "a"), cache) == [str(tmp_path / "a")]
+    assert not scanned
+    # a new file changes the modification time of the directory
+    (tmp_path / "ab").write_text("")
+    os.utime(tmp_path, ns=(0, 0))
+    assert completions(str(tmp_path / "a"), cache) == [
+        str(tmp_path / "a"),
+        str(tmp_path / "ab"),
+    ]
+    assert scanned == [str(tmp_path)]
+
+
+def test_listing_is_incremental(tmp_path, monkeypatch):
+    monkeypatch.setattr("pyrepl.path_completer.BATCH_SIZE", 10)
+    for i in range(25):
+        (tmp_path / f"f{i:02}").write_text("")
+    cache = DirectoryCache()
+    batches = complete_path(str(tmp_path / "f"), cache)
+    assert len(next(batches)) == 10
+    # interrupted: the next completion carries on from there
+    batches.close()
+    listing = cache.listing(str(tmp_path))
+    assert len(listing.names) == 10 and not listing.complete
+    # without keeping the directory open in the meantime
+    assert listing._it is None
+    assert [len(batch) for batch in complete_path(str(tmp_path / "f"), cache)] == [
+        20,
+        5,
+    ]
+    assert listing.complete
+    assert len(completions(str(tmp_path / "f"), cache)) == 25
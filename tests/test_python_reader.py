@@ -0,0 +1,101 @@
+import os
+
+from pyrepl import module_lister
+from pyrepl.history import History
+from pyrepl.python_reader import PythonicReader, open_string
+
+from .infrastructure import TestConsole
+
+
+def test_open_string():
+    assert open_string("x = 1") is None
+    assert open_string('open("/us') == 6
+    assert open_string("a = 'b' + 'c") == 11
+    assert open_string('"""ab\ncd') == 3
+    assert open_string('x # "a\n') is None
+    assert open_string('x = "a\\"b') == 5
+    assert open_string("'a\nb") is None
+    # replacement fields of f-strings are code
+    assert open_string('f"{os.pa') is None
+    assert open_string('rf"{x}/{{us') == 3
+    assert open_string('elif"a') == 5
+
+
+def make_reader(locals):
+    reader = PythonicReader(TestConsole([]), locals, history_database=":memory:")
+    reader.prepare()
+    return reader
+
+
+def test_completion_sources(tmp_path):
+    reader = make_reader({"spam": 1})
+    reader.history.append("spanish = spain.capital")
+    reader.insert("spa")
+    completions = [
+        word
+        for source in reader.get_completion_sources("spa")
+        for word in source("spa")
+    ]
+    assert sorted(completions) == ["spain", "spam", "spanish"]
+    assert reader.history_completions("spain.") == ["spain.capital"]
+
+    reader = make_reader({})
+    reader.insert(f'open("{tmp_path}{os.sep}')
+    assert reader.get_stem() == f"{tmp_path}{os.sep}"
+    (tmp_path / "file").write_text("")
+    reader.do_cmd(("complete", None))
+    assert reader.get_str() == f'open("{tmp_path / "file"}'
+    # the directory cache keeps track of changes to paths
+    assert not reader.cmpltn_cache
+
+
+def test_history_completions_of_bounded_history():
+    reader = make_reader({})
+    reader.history = History(["eggs = 1", "ham = 2"], maxlen=2, erase_dups=True)
+    assert reader.history_completions("ha") == ["ham"]
+    # full: the length stays the same
+    reader.append_history("bacon = 3")
+    reader.append_history("eggs = 1")
+    assert len(reader.history) == 2
+    assert reader.history_completions("ba") == ["bacon"]
+
+
+def test_module_completions_dont_wait_for_the_index(monkeypatch):
+    index = module_lister.ModuleIndex([])
+    # never ready
+    monkeypatch.setattr(index, "start", lambda: None)
+    index.packages = {"": ["spam", "spammer"]}
+    monkeypatch.setattr(module_lister, "_index", index)
+    reader = make_reader({})
+    reader.insert("import spa")
+    (source,) = reader.get_completion_sources("spa")
+    # what is indexed so far, and no more without a console to post to
+    assert list(source("spa")) == [["spam", "spammer"]]
+
+
+def test_fuzzy_completion_set_after_construction():
+    reader = make_reader({"get_completion_menu": 1, "gcmd": 2})
+    # as $PYREPLSTARTUP would
+    reader.fuzzy_completion = True
+    reader.insert("gcm")
+    reader.do_cmd(("complete", None))
+    assert reader.get_str() == "gcm"
+    assert reader.cmpltn_menu_choices == ["gcmd", "get_completion_menu"]
+
+
+def test_names_in_strings(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    reader = make_reader({"os": os, "spam": 1})
+    reader.insert('f"{os.pathse')
+    reader.do_cmd(("complete", None))
+    assert reader.get_str() == 'f"{os.pathsep'
+    # no path matches: names do
+    reader = make_reader({"spam": 1})
+    reader.insert('getattr(x, "spa')
+    reader.do_cmd(("complete", None))
+    assert reader.get_str() == 'getattr(x, "spam'
+    (tmp_path / "spanish").write_text("")
+    reader = make_reader({"spam": 1})
+    reader.insert('getattr(x, "spa')
+    reader.do_cmd(("complete", None))
+    assert reader.get_str() == 'getattr(x, "spanish'
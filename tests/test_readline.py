@@ -123,3 +123,44 @@ def test_write_history_file_with_exception(readline_wrapper, tmp_path):
 
     with open(str(histfile)) as f:
         assert f.readlines() == ["foo\n", "bar\n"]
+
+
+def test_shared_history_file(readline_wrapper, tmp_path):
+    histfile = tmp_path / "history"
+    histfile.write_bytes(b"foo\n")
+
+    readline_wrapper.set_shared_history_file(str(histfile))
+    reader = readline_wrapper.get_reader()
+    assert reader.history == ["foo"]
+
+    with open(histfile, "ab") as f:
+        f.write(b"bar\n")
+    reader.merge_history_file()
+    assert reader.history == ["foo", "bar"]
+
+    reader.history.append("unsaved")
+    readline_wrapper.write_history_file(str(histfile))
+    assert histfile.read_bytes() == b"foo\nbar\n"
+
+
+def test_batch_completer(readline_wrapper):
+    class Completer:
+        calls = 0
+
+        def complete(self, text, state):
+            self.calls += 1
+            words = [w for w in ["spam", "spammer", "eggs"] if w.startswith(text)]
+            return words[state] if state < len(words) else None
+
+        def all_completions(self, text):
+            return [w for w in ["spammer", "spam", "eggs"] if w.startswith(text)]
+
+    completer = Completer()
+    readline_wrapper.set_completer(completer.complete)
+    reader = readline_wrapper.get_reader()
+    assert reader.get_completions("sp") == ["spam", "spammer"]
+    assert completer.calls == 0
+
+    del Completer.all_completions
+    assert reader.get_completions("sp") == ["spam", "spammer"]
+    assert completer.calls == 3
@@ -0,0 +1,109 @@
+import pytest
+
+from pyrepl.historical_reader import HistoricalReader
+from pyrepl.sqlite_history import SQLiteHistory
+
+from .infrastructure import TestConsole, TestReader
+
+
+class HistoricalTestReader(HistoricalReader, TestReader):
+    pass
+
+
+def test_list_protocol():
+    history = SQLiteHistory()
+    history.extend(["a", "b", "c"])
+    assert history == ["a", "b", "c"]
+    assert history[-1] == "c"
+    assert history[1:] == ["b", "c"]
+    assert list(reversed(history)) == ["c", "b", "a"]
+    history[1] = "B"
+    del history[0]
+    assert history == ["B", "c"]
+    with pytest.raises(IndexError):
+        history[2]
+
+
+def test_persistence_and_sessions(tmp_path):
+    filename = str(tmp_path / "history.sqlite3")
+    first = SQLiteHistory(filename, session="first")
+    first.append("a")
+    second = SQLiteHistory(filename, session="second")
+    first.append("b")
+    second.append("c")
+    # each session only sees what was there when it was opened, and
+    # what it added itself
+    assert first == ["a", "b"]
+    assert second == ["a", "c"]
+    assert [e.text for e in first.query()] == ["c", "b", "a"]
+    assert [e.text for e in first.query(session="second")] == ["c"]
+    assert SQLiteHistory(filename) == ["a", "b", "c"]
+
+
+def test_query():
+    history = SQLiteHistory()
+    for text in ["import os", "import sys", "1/0", "imp"]:
+        history.append(text)
+        history.set_outcome(0.5, text != "1/0")
+    assert [e.text for e in history.query(prefix="import")] == [
+        "import sys",
+        "import os",
+    ]
+    assert [e.text for e in history.query(success=False)] == ["1/0"]
+    (entry,) = history.query(limit=1)
+    assert (entry.text, entry.duration, entry.success) == ("imp", 0.5, True)
+
+
+@pytest.mark.parametrize("fts", [True, False])
+def test_search(fts):
+    history = SQLiteHistory()
+    history.fts = history.fts and fts
+    history.extend(["print(x)", "x = 1", "PRINT", "print(y)"])
+    assert history.search("print", 4, forwards=False) == 3
+    assert history.search("print", 3, forwards=False) == 0
+    assert history.search("print", 0, forwards=False) is None
+    assert history.search("print", 0, forwards=True) == 3
+    assert history.search("x", 0, forwards=True) == 1
+    assert history.search("x", 4, forwards=False) == 1
+
+
+def test_isearch():
+    console = TestConsole(
+        [
+            ("reverse-history-isearch", None),
+            *((("isearch-add-character", c), None) for c in "prin"),
+            ("isearch-backwards", None),
+            ("isearch-end", None),
+            ("accept", ["print(x)"]),
+        ]
+    )
+    reader = HistoricalTestReader(console)
+    reader.history = SQLiteHistory()
+    reader.history.extend(["print(x)", "x = 1", "print(y)"])
+    reader.historyi = 3
+    reader.readline()
+    assert reader.history[-1] == "print(x)"
+
+
+def test_entries_deleted_by_another_session(tmp_path):
+    filename = str(tmp_path / "history.sqlite3")
+    first = SQLiteHistory(filename)
+    first.extend(["a", "b", "c", "d"])
+    second = SQLiteHistory(filename)
+    del second[1]
+    del second[-1]
+    # still there, but empty
+    assert len(first) == 4
+    assert first[1] == "" and first[3] == ""
+    assert first[:] == ["a", "", "c", ""]
+    assert list(first) == ["a", "", "c", ""]
+    assert list(reversed(first)) == ["", "c", "", "a"]
+
+    reader = HistoricalTestReader(TestConsole([]))
+    reader.history = first
+    reader.prepare()
+    for _ in range(4):
+        reader.do_cmd(("previous-history", None))
+    assert reader.get_str() == "a"
+    reader.do_cmd(("next-history", None))
+    assert reader.get_str() == ""
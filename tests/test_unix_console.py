@@ -0,0 +1,156 @@
+import os
+import pty
+import select
+import signal
+import termios
+import threading
+
+import pytest
+
+from pyrepl.console import Event
+from pyrepl.unix_console import UnixConsole
+
+
+@pytest.fixture
+def console():
+    master, slave = pty.openpty()
+    console = UnixConsole(slave, slave)
+    console.prepare()
+    yield console
+    console.restore()
+    os.close(master)
+    os.close(slave)
+
+
+def test_post_event_wakes_up_get_event(console):
+    timer = threading.Timer(0.05, console.post_event, (Event("posted", None),))
+    timer.start()
+    try:
+        assert console.get_event() == Event("posted", None)
+    finally:
+        timer.join()
+
+
+def read_output(master):
+    out = b""
+    while select.select([master], [], [], 0.1)[0]:
+        out += os.read(master, 4096)
+    return out
+
+
+@pytest.fixture
+def terminal():
+    master, slave = pty.openpty()
+    console = UnixConsole(slave, slave)
+    console.prepare()
+    console.height, console.width = 24, 80
+    yield console, master
+    console.restore()
+    os.close(master)
+    os.close(slave)
+
+
+def test_colored_line_changes_are_written_by_cell(terminal):
+    console, master = terminal
+    console.refresh(["\x1b[1;34mdef\x1b[0m f(x): pass"], (15, 0))
+    assert b"\x1b[1;34mdef\x1b[0m f(x): pass" in read_output(master)
+
+    console.refresh(["\x1b[1;34mdef\x1b[0m f(y): pass"], (15, 0))
+    out = read_output(master)
+    assert b"y" in out
+    assert b"def" not in out and b"pass" not in out
+    # only attributes changing
+    console.refresh(["\x1b[1;34mdef\x1b[0m \x1b[33mf\x1b[0m(y): pass"], (15, 0))
+    out = read_output(master)
+    assert b"\x1b[33mf\x1b[0m" in out
+    assert b"def" not in out and b"(y)" not in out
+
+
+def test_refresh_repaints_when_cheaper(terminal):
+    console, master = terminal
+    old = [f"{i} " + "abcdefgh" * 8 for i in range(5)]
+    console.refresh(old, (0, 0))
+    read_output(master)
+
+    # a character a row: writing just those is cheaper
+    console.refresh([line.replace("a", "b", 1) for line in old], (0, 0))
+    out = read_output(master)
+    assert not console.frame_repainted
+    assert console.frame_bytes == len(out) < 100
+
+    # the rows below going: clearing them all at once is
+    console.refresh(["x = 1"], (5, 0))
+    out = read_output(master)
+    assert console.frame_repainted
+    assert console.frame_bytes == len(out) < 30
+    assert out.count(b"x = 1") == 1
+
+
+def test_nonblocking_output_drops_frames():
+    master, slave = pty.openpty()
+    # no newline translation: what is read is what was written
+    attrs = termios.tcgetattr(slave)
+    attrs[1] &= ~termios.OPOST
+    termios.tcsetattr(slave, termios.TCSANOW, attrs)
+    console = UnixConsole(slave, slave, nonblocking_output=True)
+    console.prepare()
+    console.height, console.width = 24, 80
+    try:
+        # nothing reads the output, so it backs up
+        for i in range(1000):
+            console.refresh([f"{i} {j} " + "x" * 70 for j in range(24)], (0, 0))
+            if console.pending_output:
+                break
+        else:
+            pytest.fail("the output never backed up")
+        for i in range(100):
+            console.refresh([f"{i} {j} " + "y" * 70 for j in range(24)], (0, 0))
+        # at most the frame going out and the newest are queued
+        assert console.pending_output < 2 * 24 * 80
+
+        console.refresh([f"last {j}" for j in range(24)], (0, 0))
+        out = b""
+        thread = threading.Thread(target=console.restore)
+        thread.start()
+        while thread.is_alive() or select.select([master], [], [], 0.1)[0]:
+            out += read_output(master)
+        thread.join()
+        assert b"last 23" in out
+        # the frames in between never went out: they would have taken
+        # over 100KB
+        assert len(out) < 50000
+        assert console.output_bytes == len(out)
+    finally:
+        os.close(master)
+        os.close(slave)
+
+
+@pytest.mark.skipif(not os.path.isdir("/proc/self/fd"), reason="needs /proc")
+def test_wakeup_pipe_is_closed_by_restore():
+    master, slave = pty.openpty()
+    try:
+        before = len(os.listdir("/proc/self/fd"))
+        for _ in range(3):
+            console = UnixConsole(slave, slave)
+            console.prepare()
+            console.restore()
+            # posting after restore doesn't write anywhere
+            console.post_event(Event("posted", None))
+        assert len(os.listdir("/proc/self/fd")) == before
+    finally:
+        os.close(master)
+        os.close(slave)
+
+
+def test_sigwinch_doesnt_take_the_wakeup_lock(console):
+    class Held:
+        def __enter__(self):
+            raise AssertionError("would deadlock if held by the main thread")
+
+    lock = console._UnixConsole__wakeup_lock
+    console._UnixConsole__wakeup_lock = Held()
+    try:
+        os.kill(os.getpid(), signal.SIGWINCH)
+    finally:
+        console._UnixConsole__wakeup_lock = lock
+    assert console.get_event() == Event("resize", None)
@@ -0,0 +1,69 @@
+from pyrepl.reader import Reader
+from pyrepl.widths import char_width, disp_cells, str_width
+
+from .infrastructure import TestConsole
+
+
+def test_char_width():
+    assert char_width("a") == 1
+    assert char_width("日") == 2
+    assert char_width("́") == 0
+    assert char_width("‍") == 0
+    assert str_width("日本語 ok") == 9
+    assert str_width("é") == 1
+
+
+def test_disp_cells():
+    assert disp_cells("a日b") == (["a", "日", "", "b"], [1, 1, 0, 1])
+    # clusters go in one cell
+    assert disp_cells("éx") == (["é", "x"], [2, 1])
+    assert disp_cells("\U0001f469‍\U0001f4bb!") == (
+        ["\U0001f469‍\U0001f4bb", "", "!"],
+        [3, 0, 1],
+    )
+    assert disp_cells("\x03") == (["^", "C"], [1, 0])
+
+
+def make_reader(text, width=10):
+    console = TestConsole([])
+    console.width = width
+    reader = Reader(console)
+    reader.prepare()
+    reader.ps1 = "> "
+    reader.insert(text)
+    return reader
+
+
+def test_wide_characters_wrap_whole():
+    reader = make_reader("abcde日本")
+    assert reader.calc_screen() == ["> abcde日\\", "本"]
+    assert reader.cxy == (2, 1)
+    # the prompt and 6 characters leave one column on the first row,
+    # too narrow for a wide character, which moves down
+    reader = make_reader("abcdef日本")
+    assert reader.calc_screen() == ["> abcdef \\", "日本"]
+    assert reader.cxy == (4, 1)
+    assert reader.pos2xy(6) == (0, 1)
+    assert reader.pos2xy(7) == (2, 1)
+    assert reader.pos2xy(5) == (7, 0)
+
+
+def test_combining_characters():
+    reader = make_reader("éé")
+    assert reader.calc_screen() == ["> éé"]
+    assert reader.cxy == (4, 0)
+    assert reader.pos2xy(2) == (3, 0)
+
+
+def test_exact_fit():
+    # the rows are full: the cursor goes on a row of its own
+    reader = make_reader("x" * 8, width=11)
+    assert reader.calc_screen() == ["> xxxxxxxx\\", ""]
+    assert reader.cxy == (0, 1)
+    reader = make_reader("x" * 18, width=11)
+    assert reader.calc_screen() == ["> xxxxxxxx\\", "xxxxxxxxxx\\", ""]
+    assert reader.cxy == (0, 2)
+    reader = make_reader("x" * 6 + "日", width=11)
+    assert reader.calc_screen() == ["> xxxxxx日\\", ""]
+    assert reader.cxy == (0, 1)
+    assert reader.pos2xy(6) == (8, 0)